@@ -1,652 +1,876 @@
-from flask import Flask, jsonify, request, make_response, send_file
-from flask.globals import session
-from flask_restful import Api, Resource, reqparse, abort, fields, marshal_with
-from flask_sqlalchemy import SQLAlchemy
-from flask_marshmallow import Marshmallow
-from dataclasses import dataclass
-from sqlalchemy import schema
-from marshmallow_sqlalchemy import ModelSchema
-from werkzeug.security import generate_password_hash, check_password_hash
-import datetime
-from sqlalchemy.orm import backref
+from flask import Flask, current_app, jsonify, request, stream_with_context, g, has_request_context
+from flask import json as flask_json
+from flask.cli import with_appcontext
+from flask.globals import session as session_cookie
+from sqlalchemy import event, and_, or_, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload, load_only
 from functools import wraps
 from datetime import datetime, timedelta
-import os
-import urllib.parse
-import uuid
+import base64
+import hashlib
+import json
+import time
 import jwt
+import click
 
-# --- Config ------------------------------------------------------------------------------------
-
-app = Flask(__name__)
-api = Api(app)
-
-app.config['SQLALCHEMY_DATABASE_URI'] = "your database"
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
-app.config['SECRET_KEY'] = 'secret af'
-
-db = SQLAlchemy(app)
-ma = Marshmallow(app)
-
-# --- Models ------------------------------------------------------------------------------
-
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    public_id = db.Column(db.String(300), unique=True)
-    username = db.Column(db.String(50), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(300), nullable=False)
-    info = db.relationship(
-        "User_Info", cascade="all, delete-orphan", uselist=False, backref="user")
-    cart = db.relationship(
-        "Cart", cascade="all, delete-orphan", uselist=False, backref="user")
-    orders = db.relationship("Orders", backref="user")
-    reviews = db.relationship("Reviews", backref="user")
-    is_admin = db.Column(db.Boolean, nullable=False, default=False)
+from cache import LRUCache
+from config import Config
+from passwords import PasswordHasher
+from metrics import Registry, SIZE_BUCKETS, COUNT_BUCKETS
+import compression
+from jobs import JobQueue
+import migrations
+from models import db, User, Cart, Cart_Items, Defined_Items, Item, Item_Type, Item_Rating, Orders, \
+    Order_Items, Reviews, Job, Change_Log, Change_Log_Horizon, Stock, Stock_Reservation, Sizes, Order_Archive, \
+    Refresh_Token
+from schemas import ma, schema_for
+from search import SearchIndex, Document
+from sync import ChangeLog, UPSERT
+from stock import Inventory
+from catalog_io import CatalogIO
+from archive import OrderArchive
 
-    def __repr__(self):
-        return f"User('{self.username}')"
-
-
-class User_Info(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True)
-    first_name = db.Column(db.String(30), nullable=True)
-    last_name = db.Column(db.String(30), nullable=True)
-    phone_number = db.Column(db.String(30), nullable=True)
-    address = db.Column(db.String(30), nullable=True)
-
-
-class Orders(db.Model):
-    __tablename__ = 'orders'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    order_items = db.relationship(
-        "Order_Items", backref="order", cascade="all,delete")
-    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    price = db.Column(db.Float)
-    paid = db.Column(db.Boolean, nullable=False)
+# --- Services ------------------------------------------------------------------------------------
 
+# Shared by every blueprint and, like db, created here unconfigured:
+# create_app applies the app's settings to them (configure_services).
 
-class Order_Items(db.Model):
-    __tablename__ = 'order_items'
-    id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey(
-        'orders.id'), nullable=False)
-    date_added = db.Column(db.DateTime, nullable=False,
-                           default=datetime.utcnow)
-    defined_item_id = db.Column(db.Integer, db.ForeignKey(
-        'defined_items.id'), nullable=False)
+catalog_cache = LRUCache()
+token_cache = LRUCache()
+metrics = Registry()
+recent_writes = LRUCache(maxsize=100000)
+password_hasher = PasswordHasher()
 
 
-class Cart(db.Model):
-    __tablename__ = 'cart'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True)
-    cart_items = db.relationship("Cart_Items", backref="cart")
-
-
-class Cart_Items(db.Model):
-    __tablename__ = 'cart_items'
-    id = db.Column(db.Integer, primary_key=True)
-    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
-    defined_item_id = db.Column(db.Integer, db.ForeignKey('defined_items.id'))
-    date_added = db.Column(db.DateTime, nullable=False,
-                           default=datetime.utcnow)
-
-
-class Defined_Items(db.Model):
-    __tablename__ = 'defined_items'
-
-    id = db.Column(db.Integer, primary_key=True)
-    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
-    size = db.Column(db.String(10), nullable=False)
-    amount = db.Column(db.Integer, nullable=False)
-    order_item = db.relationship("Order_Items", backref=backref(
-        'defined_item', remote_side=[id]), lazy=True)
-    cart_item_id = db.relationship("Cart_Items", backref=backref(
-        'defined_item', remote_side=[id]), lazy=True)
-
-
-class Item(db.Model):
-    __tablename__ = 'item'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
-    description = db.Column(db.String(200), nullable=True)
-    price = db.Column(db.Float, nullable=False)
-    image_file = db.Column(db.String(20), nullable=False, default='shirt.jpg')
-    item_type_id = db.Column(db.Integer, db.ForeignKey('item_type.id'))
-    defined_item = db.relationship(
-        "Defined_Items", backref=backref('item', remote_side=[id]), lazy=True)
-    reviews = db.relationship("Reviews", backref="item")
-
-
-class Item_Type(db.Model):
-    __tablename__ = 'item_type'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=False)
-    item = db.relationship("Item", backref=backref(
-        'item_type', remote_side=[id]), lazy=True)
-
-    def __repr__(self):
-        return f"('{self.name}')"
-
-
-class Sizes(db.Model):
-    __tablename__ = 'sizes'
-    id = db.Column(db.Integer, primary_key=True)
-    size = db.Column(db.String(10), nullable=False)
-    value = db.Column(db.String(10), nullable=False)
-
-
-class Reviews(db.Model):
-    __tablename__ = 'reviews'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
-    comment = db.Column(db.Text, nullable=False)
-    rating = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-
-# --- Schemas -------------------------------------------------------------------------
-
-
-class Item_TypeSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Item_Type
-        sqla_session = db.session
-        load_instance = True
-
-
-class ProductSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Item
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-    item_type = ma.Nested(Item_TypeSchema, many=False)
-
-
-class DefinedItemSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Defined_Items
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-    item = ma.Nested(ProductSchema, many=False, exclude=["reviews"])
+# --- Queries -------------------------------------------------------------------------
 
 
-class CartItemSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Cart_Items
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-    defined_item = ma.Nested(DefinedItemSchema, many=False, exclude=[
-                             "id", "cart_item_id", "order_item"])
-
-
-class CartSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Cart
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
+def catalog_query(fields=None):
+    # ProductSchema walks item_type, defined_item and reviews on every row,
+    # so load them up front: one query for items + types, one per collection.
+    loaders = {
+        'item_type': joinedload(Item.item_type),
+        'defined_item': selectinload(Item.defined_item),
+        'reviews': selectinload(Item.reviews),
+        'rating': joinedload(Item.rating),
+    }
+    return Item.query.options(
+        *[loader for name, loader in loaders.items() if fields is None or name in fields])
 
 
-class UserSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = User
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-
+def users_query():
+    return User.query.options(
+        selectinload(User.info),
+        selectinload(User.cart),
+        selectinload(User.orders),
+        selectinload(User.reviews))
 
-class OrderItemsSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Order_Items
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-
-    defined_item = ma.Nested(DefinedItemSchema, many=False)
 
+def orders_query():
+    # OrdersSchema nests order_items -> defined_item -> item -> item_type.
+    return Orders.query.options(
+        selectinload(Orders.order_items).joinedload(Order_Items.defined_item).options(
+            selectinload(Defined_Items.order_item),
+            selectinload(Defined_Items.cart_item_id),
+            joinedload(Defined_Items.item).options(
+                joinedload(Item.item_type),
+                selectinload(Item.defined_item))))
 
-class OrdersSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Orders
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
 
-    order_items = ma.Nested(OrderItemsSchema, many=True)
+def defined_items_query():
+    return Defined_Items.query.options(
+        selectinload(Defined_Items.order_item),
+        selectinload(Defined_Items.cart_item_id),
+        joinedload(Defined_Items.item).options(
+            joinedload(Item.item_type),
+            selectinload(Item.defined_item)))
 
 
-class UserInfoSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = User_Info
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
+def cart_items_query(cart_id):
+    # CartItemSchema nests defined_item -> item -> item_type.
+    return Cart_Items.query.options(
+        joinedload(Cart_Items.defined_item).joinedload(Defined_Items.item).options(
+            joinedload(Item.item_type),
+            selectinload(Item.defined_item))).filter_by(cart_id=cart_id)
 
 
-class ReviewSchema(ma.SQLAlchemyAutoSchema):
-    class Meta:
-        model = Reviews
-        sqla_session = db.session
-        load_instance = True
-        include_relationships = True
-    user = ma.Nested(UserSchema, many=False, exclude=[
-                     "id", "public_id", "public_id", "email", "info", "password", "cart", "orders", "reviews", "is_admin"])
-# --- Authentication decorator -------------------------------------------------------------------------
+def reviews_query():
+    return Reviews.query.options(joinedload(Reviews.user))
 
 
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'x-access-token' in request.headers:
-            token = request.headers['x-access-token']
+# --- Pagination -------------------------------------------------------------------------
 
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
+# List endpoints page only when asked to (?limit= or ?cursor=), so clients
+# that expect the whole list keep working. The cursor for the next page is
+# sent in the X-Next-Cursor header and the body stays a plain JSON array.
 
-        try:
-            data = jwt.decode(token, app.config['SECRET_KEY'])
-            current_user = User.query.filter_by(
-                public_id=data['public_id']).first()
-        except:
-            return jsonify({'message': 'Token is invalid!'}), 401
 
-        return f(current_user, *args, **kwargs)
+def is_paginated():
+    return 'limit' in request.args or 'cursor' in request.args
 
-    return decorated
 
+def parse_fields(schema_class):
+    fields = request.args.get('fields')
+    if not fields:
+        return None
 
-# --- Image Routes ------------------------------------------------------------------------------------
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = set(fields) - set(schema_for(schema_class).fields)
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(sorted(unknown)))
 
-@app.route('/image', methods=['GET'])
-def get_image():
+    return fields
 
-    name = request.args.get('name', None)
-    photo = request.args.get('photo', default="grey.jpg")
 
-    url = "img/" + name + "/" + photo
-    return send_file(url, mimetype='image/gif')
+def load_fields(query, model, fields, keys=()):
+    # Only SELECT the requested columns plus whatever the keyset needs. When
+    # every requested field is a column there is nothing to nest, so fetch
+    # plain rows rather than ORM instances; the schemas dump either.
+    if fields is None:
+        return query
 
+    columns = [getattr(model, column.key)
+               for column in model.__table__.columns if column.key in fields]
+    if len(columns) < len(fields):
+        return query.options(load_only(*columns, *keys))
 
-# --- Cart Routes ------------------------------------------------------------------------------------
+    primary_key = [getattr(model, column.key) for column in model.__mapper__.primary_key]
+    extra = {key.key: key for key in [*keys, *primary_key] if key.key not in fields}
+    return query.with_entities(*columns, *extra.values())
 
-@app.route('/api/user/defined_items', methods=['GET'])
-def get_user_defined_items():
 
-    result = Defined_Items.query.all()
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
 
-    schema = DefinedItemSchema(many=True)
-    output = schema.dump(result)
 
-    return jsonify(output), 200
+def decode_cursor(cursor, columns=None):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or columns is not None and len(values) != len(columns):
+            raise ValueError
+        if columns is None:
+            return values
 
+        return [datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) else value
+                for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor!')
 
-@app.route('/api/user/cart_items', methods=['GET'])
-@token_required
-def get_user_cart_items(current_user):
 
-    result = Cart_Items.query.filter_by(cart_id=current_user.cart.id).all()
+def keyset_after(columns, values, descending):
+    column, value = columns[0], values[0]
+    after = column < value if descending else column > value
 
-    schema = CartItemSchema(many=True, exclude=["cart"])
-    output = schema.dump(result)
+    if len(columns) == 1:
+        return after
+    return or_(after, and_(column == value, keyset_after(columns[1:], values[1:], descending)))
 
-    return jsonify(output), 200
 
+def page_limit():
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'], type=int)
+    return max(1, min(limit, current_app.config['PAGE_SIZE_LIMIT']))
 
-@app.route('/api/user/add/cart_items/<int:item_id>', methods=['POST'])
-@token_required
-def add_item_to_cart(current_user, item_id):
 
-    item = Item.query.filter_by(id=item_id).first()
-    data = request.get_json()
-    defined_item = Defined_Items(
-        item_id=item.id, size=data['size'], amount=data['amount'], cart_item_id=current_user.cart.id)
-    db.session.add(defined_item)
-    db.session.commit()
+def fetch_page(query, columns, descending=False):
+    order = [column.desc() if descending else column.asc() for column in columns]
+    if not is_paginated():
+        return query.order_by(*order).all(), None
 
-    return jsonify({"message": "Item was added to cart!"}), 200
+    limit = page_limit()
 
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(keyset_after(columns, decode_cursor(cursor, columns), descending))
 
-@app.route('/test', methods=['DELETE'])
-def test():
+    rows = query.order_by(*order).limit(limit + 1).all()
 
-    data = request.get_json()
+    if len(rows) <= limit:
+        return rows, None
 
-    return jsonify({"message": data["items"]}), 200
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
 
 
-@app.route('/api/user/delete_cart_item', methods=['DELETE'])
-@token_required
-def delete_user_cart_item(current_user):
+def page_response(output, next_cursor):
+    response = jsonify(output)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
-    data = request.get_json()
-    id = data["item_id"]
 
-    result = Cart_Items.query.filter_by(
-        cart_id=current_user.cart.id, id=id).first()
+# --- Streaming -------------------------------------------------------------------------
 
-    if result:
-        db.session.delete(result)
-        db.session.commit()
-        return jsonify({"message": "Items has been removed from cart!"}), 200
-    else:
-        return jsonify({"message": "Item not found!"}), 404
+# ?stream=ndjson sends one object per line, ?stream=json a chunked JSON array.
+# Rows are fetched in STREAM_BATCH_SIZE batches and dumped one at a time, so
+# neither the ORM objects nor the output list are ever held in full.
 
-# --- Order item Routes ------------------------------------------------------------------------------------
+STREAM_MODES = ('ndjson', 'json')
 
 
-@app.route('/api/user/complete_order/<int:order_id>', methods=['PUT'])
-@token_required
-def complete_payment(current_user, order_id):
+def stream_mode():
+    mode = request.args.get('stream')
+    if mode is not None and mode not in STREAM_MODES:
+        raise ValueError('Unknown stream mode: ' + mode)
+    return mode
 
-    result = Orders.query.filter_by(
-        user_id=current_user.id, id=order_id).first()
 
-    result.paid = True
-    db.session.commit()
+def stream_response(query, schema, mode):
+    return stream_rows(query.yield_per(current_app.config['STREAM_BATCH_SIZE']), schema.dump, mode)
 
-    return jsonify({"message": "Payment was completed!"}), 200
 
+def stream_rows(rows, dump, mode):
+    def generate_ndjson():
+        for row in rows:
+            yield flask_json.dumps(dump(row)) + '\n'
 
-@app.route('/api/user/orders', methods=['GET'])
-@token_required
-def get_user_orders(current_user):
+    def generate_json():
+        separator = '['
+        for row in rows:
+            yield separator + flask_json.dumps(dump(row))
+            separator = ','
+        yield '[]\n' if separator == '[' else ']\n'
 
-    result = Orders.query.filter_by(user_id=current_user.id).all()
+    if mode == 'ndjson':
+        return current_app.response_class(stream_with_context(generate_ndjson()),
+                                          mimetype='application/x-ndjson')
+    return current_app.response_class(stream_with_context(generate_json()),
+                                      mimetype=current_app.config['JSONIFY_MIMETYPE'])
 
-    schema = OrdersSchema(many=True)
-    output = schema.dump(result)
 
-    return jsonify(output), 200
+# --- Catalog cache -------------------------------------------------------------------------
 
+# Every model that ends up in a ProductSchema payload.
+CATALOG_MODELS = (Item, Item_Type, Defined_Items, Reviews, Item_Rating)
 
-@app.route('/api/user/delete_order', methods=['DELETE'])
-@token_required
-def delete_user_order(current_user):
 
-    data = request.get_json()
-    item_id = data["item_id"]
+@event.listens_for(db.session, 'after_flush')
+def mark_catalog_changes(session, flush_context):
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(obj, CATALOG_MODELS) for obj in changed):
+        session.info['catalog_changed'] = True
 
-    result = Orders.query.filter_by(
-        user_id=current_user.id, id=item_id).first()
+    # The search index only needs the items whose text, price, type or sizes moved.
+    searched = session.info.setdefault('search_changed', set())
+    for obj in changed:
+        if isinstance(obj, Item):
+            searched.add(obj.id)
+        elif isinstance(obj, Defined_Items) and inspect(obj).dict.get('item_id') is not None:
+            searched.add(obj.item_id)
 
-    if result:
 
-        db.session.delete(result)
-        db.session.commit()
-        return jsonify({"message": "Order has been removed!"}), 200
-    else:
-        return jsonify({"message": "Order does not exist!"}), 400
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def mark_catalog_bulk_changes(context):
+    if issubclass(context.mapper.class_, CATALOG_MODELS):
+        context.session.info['catalog_changed'] = True
+    if issubclass(context.mapper.class_, (Item, Defined_Items)):
+        context.session.info['search_reset'] = True
 
 
-@app.route('/api/delete_orders', methods=['DELETE'])
-def delete_orders():
-    orders = Orders.query.all()
-    for order in orders:
-        db.session.delete(order)
-        db.session.commit()
+@event.listens_for(db.session, 'after_commit')
+def invalidate_catalog(session):
+    if session.info.pop('catalog_changed', False):
+        catalog_cache.invalidate()
+        recent_writes.set(('catalog',), True)
+    if session.info.pop('search_reset', False):
+        search_index.reset()
+    search_index.touch(session.info.pop('search_changed', ()))
 
-    return jsonify({"message": "Orders has been removed!"}), 200
 
+@event.listens_for(db.session, 'after_rollback')
+def forget_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
+    session.info.pop('search_changed', None)
+    session.info.pop('search_reset', None)
 
-@app.route('/api/user/create_order', methods=['POST'])
-@token_required
-def create_user_order(current_user):
 
-    new_order = Orders(paid=False, user_id=current_user.id)
-    db.session.add(new_order)
+def json_bytes(output):
+    return jsonify(output).get_data()
 
-    cart_items = Cart_Items.query.filter_by(cart_id=current_user.cart.id).all()
-    amount = 0
-    for item in cart_items:
 
-        new_order_item = Order_Items(
-            defined_item_id=item.id, order_id=new_order.id)
-        db.session.add(new_order_item)
-        amount += item.defined_item.item.price * item.defined_item.amount
+def json_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype=current_app.config['JSONIFY_MIMETYPE'])
 
-    new_order.price = amount
-    db.session.commit()
 
-    schema = OrdersSchema(many=False)
-    output = schema.dump(new_order)
+# --- Instrumentation -------------------------------------------------------------------------
 
-    return jsonify(output), 200
+# Per request: statement count and DB time (cursor events), marshmallow dump
+# time (BaseSchema) and response size, aggregated per route into the
+# histograms served at /metrics.
 
-# --- Product Routes ------------------------------------------------------------------------------------
 
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even
+    # when it fails. The dialect's first-connect checks have no context and
+    # go untimed.
+    if context is not None:
+        context.statement_start = time.perf_counter()
 
-@app.route('/api/products', methods=['GET'])
-def get_all_products():
-    result = Item.query.all()
 
-    schema = ProductSchema(many=True)
-    output = schema.dump(result)
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'statement_start', None)
+    if start is None:
+        return
 
-    return jsonify(output), 200
+    elapsed = time.perf_counter() - start
+    if has_request_context() and 'instrumentation' in g:
+        g.instrumentation['queries'] += 1
+        g.instrumentation['db_time'] += elapsed
+        if current_app.config['SLOW_REQUEST_MS'] is not None:
+            g.instrumentation['statements'].append((statement, elapsed))
 
 
-@app.route('/api/product/addtocart', methods=['POST'])
-@token_required
-def add_to_cart(current_user):
+def start_instrumentation():
+    if current_app.config['METRICS_ENABLED']:
+        g.instrumentation = {'start': time.perf_counter(), 'queries': 0, 'db_time': 0.0,
+                             'serialize_time': 0.0, 'statements': []}
 
-    data = request.get_json()
-    item_id = data["item_id"]
-    size = data["selectedSize"]
-    amount = data["selectedAmount"]
 
-    if item_id is not None or size is not None or amount is None:
+def record_instrumentation(response):
+    data = g.pop('instrumentation', None)
+    if data is None:
+        return response
 
-        def_item = Defined_Items(
-            item_id=item_id, size=size, amount=int(amount))
-        db.session.add(def_item)
-        db.session.commit()
+    elapsed = time.perf_counter() - data['start']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'route': route, 'method': request.method}
 
-        new_cart_item = Cart_Items(
-            cart_id=current_user.cart.id, defined_item_id=def_item.id)
-        db.session.add(new_cart_item)
-        db.session.commit()
+    metrics.inc('http_requests_total', 'Requests handled.',
+                dict(labels, status=response.status_code))
+    metrics.observe('http_request_duration_seconds', 'Time spent in the view.', labels, elapsed)
+    metrics.observe('db_queries_per_request', 'SQL statements per request.', labels,
+                    data['queries'], COUNT_BUCKETS)
+    metrics.observe('db_time_seconds', 'Time spent executing SQL per request.', labels,
+                    data['db_time'])
+    metrics.observe('serialization_seconds', 'Time spent serializing per request.',
+                    labels, data['serialize_time'])
+    if not response.is_streamed:
+        metrics.observe('response_size_bytes', 'Response body size.', labels,
+                        response.calculate_content_length() or 0, SIZE_BUCKETS)
 
-        return jsonify({"message": "Item has been added to the cart!"}), 200
-    else:
-        return jsonify({"message": "Error!"}), 400
+    threshold = current_app.config['SLOW_REQUEST_MS']
+    if threshold is not None and elapsed * 1000 >= threshold:
+        current_app.logger.warning(
+            "Slow request %s %s: %.1f ms, %d queries (%.1f ms), dump %.1f ms\n%s",
+            request.method, request.full_path, elapsed * 1000, data['queries'],
+            data['db_time'] * 1000, data['serialize_time'] * 1000,
+            '\n'.join('  %.1f ms  %s' % (seconds * 1000, statement)
+                      for statement, seconds in data['statements']))
 
+    return response
 
-@app.route('/api/product/<int:item_id>', methods=['GET'])
-def get_product(item_id):
-    result = Item.query.filter_by(id=item_id).first()
 
-    if result:
-        schema = ProductSchema()
-        output = schema.dump(result)
+def get_metrics():
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-        return jsonify(output), 200
-    else:
-        return jsonify({'message': 'Item not found!'}), 404
 
+# --- Conditional requests -------------------------------------------------------------------------
 
-# --- User Routes ------------------------------------------------------------------------------------
 
-@app.route('/api/users/check/<string:uname>', methods=['GET'])
-def check_user(uname):
-    result = User.query.filter_by(username=uname).first()
+def content_etag(body):
+    return hashlib.sha1(body).hexdigest()
 
-    if result:
-        schema = UserSchema()
-        output = schema.dump(result)
 
-        return jsonify(output), 200
+def list_etag(version, fields=None, mode=None):
+    # One version of a list's rows is still many bodies: other fields, other
+    # pages and page sizes, a stream. Each gets its own validator, so a
+    # client's copy of one never revalidates another.
+    cursor = request.args.get('cursor')
+    variant = [fields and list(fields), mode, is_paginated() and page_limit(), cursor and decode_cursor(cursor)]
+    if not any(variant):
+        return version
+    return '%s-%s' % (version, content_etag(json.dumps(variant).encode())[:16])
+
+
+def not_modified(etag, last_modified=None):
+    # Checked before anything is serialized, so a matching client costs
+    # only the version lookup.
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since
     else:
-        return jsonify({'message': 'User not found!'}), 404
+        matched = False
 
+    if matched:
+        return tag_response(current_app.response_class(status=304), etag, last_modified)
+    return None
 
-@app.route('/api/user', methods=['GET'])
-@token_required
-def get_user_details(current_user):
-    result = User.query.filter_by(id=current_user.id).first()
 
-    if result:
-        schema = UserSchema()
-        output = schema.dump(result)
+def tag_response(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
 
-        return jsonify(output), 200
-    else:
-        return jsonify({'message': 'User not found!'}), 404
 
+def cached_json_response(entry):
+    # Catalog cache entries are CachedBody objects: the etag is hashed once
+    # when the entry is filled and each compressed variant made once, when
+    # a client first asks for it, rather than on every request.
+    response = not_modified(entry.etag)
+    if response:
+        return response
 
-@app.route('/api/user/<string:public_id>', methods=['GET'])
-def get_user(public_id):
-    result = User.query.filter_by(public_id=public_id).first()
+    encoding = accepted_encoding(len(entry.body))
+    if encoding is None:
+        return tag_response(json_response(entry.body), entry.etag)
 
-    if result:
-        schema = UserSchema()
-        output = schema.dump(result)
+    response = json_response(entry.encoded(encoding, current_app.config['COMPRESSION_CACHED_LEVELS'][encoding]))
+    response.headers['Content-Encoding'] = encoding
+    response.set_etag(entry.etag, weak=True)
+    return response
 
-        return jsonify(output), 200
-    else:
-        return jsonify({'message': 'User not found!'}), 404
 
+# --- Compression -------------------------------------------------------------------------
 
-@app.route('/api/users', methods=['GET'])
-def get_all_users():
+# JSON bodies of at least COMPRESSION_MIN_SIZE bytes go out as br or gzip,
+# whichever the client prefers. A compressed response carries the weak form
+# of the plain body's ETag, so revalidation works with either.
 
-    result = User.query.all()
 
-    schema = UserSchema(many=True)
-    output = schema.dump(result)
+def accepted_encoding(size):
+    if size < current_app.config['COMPRESSION_MIN_SIZE']:
+        return None
+    return compression.negotiate(request.accept_encodings)
 
-    return jsonify(output), 200
 
+def compress_response(response):
+    # Registered after record_instrumentation, so it runs first and the
+    # size metric sees the bytes actually sent.
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+    if response.mimetype != current_app.config['JSONIFY_MIMETYPE'] or response.is_streamed:
+        return response
 
-@app.route('/api/users', methods=['POST'])
-def create_user():
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers:
+        return response
 
-    data = request.get_json()
-    user = User.query.filter_by(username=data['username']).first()
+    encoding = accepted_encoding(response.calculate_content_length() or 0)
+    if encoding is None:
+        return response
 
-    if not user:
+    level = current_app.config['COMPRESSION_LEVELS'][encoding]
+    response.set_data(compression.compress(response.get_data(), encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
-        hashed_password = generate_password_hash(
-            data['password'], method="sha256")
 
-        new_user = User(public_id=str(
-            uuid.uuid4()), username=data['username'], email=data['email'], password=hashed_password, is_admin=False)
+# --- Read replica -------------------------------------------------------------------------
 
-        new_user.info = User_Info()
-        new_user.cart = Cart()
 
-        db.session.add(new_user)
-        db.session.commit()
+def read_only(f=None, catalog=False):
+    """Lets the route's queries go to the replica bind, if one is configured.
 
-        return jsonify({'message': 'User created!'}), 201
+    catalog=True also keeps them on the primary for a moment after any
+    catalog write, so the catalog cache is never refilled from a lagging
+    replica.
+    """
+    if f is None:
+        return lambda f: read_only(f, catalog)
 
-    else:
-        return jsonify({'message': 'User already exists!'}), 401
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_only = True
+        g.read_catalog = catalog
+        return f(*args, **kwargs)
 
-# --- UserInfo Routes ------------------------------------------------------------------------------------
+    return decorated
 
 
-@app.route('/api/user_info', methods=['GET'])
-@token_required
-def get_info(current_user):
-    result = User_Info.query.filter_by(user_id=current_user.id).first()
+def use_replica(session):
+    if not has_request_context() or not g.get('read_only') or 'replica' not in current_app.config['SQLALCHEMY_BINDS']:
+        return False
+    if session.new or session.dirty or session.deleted:
+        return False
+    if g.get('read_catalog') and recent_writes.get(('catalog',)):
+        return False
 
-    if result:
-        schema = UserInfoSchema()
-        output = schema.dump(result)
+    # Read-your-writes: the signed session cookie covers a client that
+    # switches worker processes, the in-process map covers clients that
+    # drop cookies.
+    if session_cookie.get('primary_until', 0) > time.time():
+        return False
+    user_id = g.get('user_id')
+    return user_id is None or not recent_writes.get(('user', user_id))
 
-        return jsonify(output), 200
-    else:
-        return jsonify({'message': 'Info not found!'}), 404
 
+db.use_replica = use_replica
 
-@app.route('/api/user_info/update', methods=['PUT'])
-@token_required
-def update_info(current_user):
 
-    data = request.get_json()
-    info = User_Info.query.filter_by(user_id=current_user.id).first()
+@event.listens_for(db.session, 'after_flush')
+def mark_user_write(session, flush_context):
+    session.info['wrote'] = True
 
-    if info:
 
-        info.first_name = data["first_name"]
-        info.last_name = data["last_name"]
-        info.phone_number = data["phone_number"]
-        info.address = data["address"]
-        db.session.commit()
+@event.listens_for(db.session, 'after_commit')
+def remember_user_write(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        session_cookie['primary_until'] = time.time() + current_app.config['REPLICA_LAG_SECONDS']
+        if g.get('user_id') is not None:
+            recent_writes.set(('user', g.user_id), True)
 
-        return jsonify({'message': 'Info Updated!'}), 200
 
-    else:
-        return jsonify({'message': 'Server error!'}), 401
+@event.listens_for(db.session, 'after_rollback')
+def forget_user_write(session):
+    session.info.pop('wrote', None)
 
-# --- Reviews Route ------------------------------------------------------------------------------------
 
+# --- Authentication decorator -------------------------------------------------------------------------
 
-@app.route('/api/reviews/product/<int:item_id>', methods=['GET'])
-def get_reviews(item_id):
-    result = Reviews.query.filter_by(item_id=item_id).all()
 
-    if result:
-        schema = ReviewSchema(many=True)
-        output = schema.dump(result)
+class Principal:
+    """The caller of an authenticated route, built from the token cache.
 
-        return jsonify(output), 200
-    else:
-        return jsonify({'message': 'No comments!'}), 404
+    Holds only what most handlers need. Any other attribute is read from the
+    full User row, which is loaded the first time it is asked for.
+    """
 
+    def __init__(self, id, public_id, cart_id, is_admin):
+        self.id = id
+        self.public_id = public_id
+        self.cart_id = cart_id
+        self.is_admin = is_admin
+        self._user = None
 
-@app.route('/api/create_review', methods=['POST'])
-@token_required
-def create_review(current_user):
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return self._user
 
-    data = request.get_json()
-    item_id = data["item_id"]
-    rating = data["rating"]
-    comment = data["comment"]
+    def __getattr__(self, name):
+        return getattr(self.user, name)
 
-    if item_id is not None or rating is not None or comment is None:
 
-        newComment = Reviews(
-            item_id=item_id, user_id=current_user.id, comment=comment, rating=rating)
-        db.session.add(newComment)
-        db.session.commit()
+def load_identity(token):
+    # Cached per token until the token itself expires (or AUTH_CACHE_TTL,
+    # whichever is sooner), so a valid token costs one decode and one query.
+    key = hashlib.sha256(token.encode()).digest()
+    identity = token_cache.get(key)
 
-        return jsonify({'message': 'Comment Written!'}), 200
+    if identity is None:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'])
+        if data.get('type', 'access') != 'access':
+            return None
 
-    else:
-        return jsonify({'message': 'Server error!'}), 401
+        row = db.session.query(User.id, User.public_id, Cart.id, User.is_admin).outerjoin(
+            Cart, Cart.user_id == User.id).filter(User.public_id == data['public_id']).first()
+        if row is None:
+            return None
+
+        identity = tuple(row)
+        ttl = data['exp'] - time.time() if 'exp' in data else None
+        token_cache.set(key, identity, ttl=min(ttl, token_cache.ttl) if ttl else None)
+
+    return identity
+
+
+def invalidate_identity(public_id):
+    token_cache.evict(lambda identity: identity[1] == public_id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def mark_identity_changes(session, flush_context):
+    changed = session.info.setdefault('identity_changed', set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.public_id)
+
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if state.attrs.is_admin.history.has_changes() or state.attrs.public_id.history.has_changes():
+                changed.add(obj.public_id)
+                changed.update(state.attrs.public_id.history.deleted)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_identities(session):
+    for public_id in session.info.pop('identity_changed', ()):
+        invalidate_identity(public_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_identity_changes(session):
+    session.info.pop('identity_changed', None)
+
+
+@event.listens_for(db.session, 'before_flush')
+def revoke_refresh_tokens(session, flush_context, instances):
+    # A new password hash (a rehash at login included) ends every session
+    # the old one started; access tokens still run out on their own.
+    changed = [obj.id for obj in session.dirty
+               if isinstance(obj, User) and inspect(obj).attrs.password.history.has_changes()]
+    if changed:
+        session.query(Refresh_Token).filter(Refresh_Token.user_id.in_(changed)).delete(synchronize_session=False)
+
+
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = None
+        if 'x-access-token' in request.headers:
+            token = request.headers['x-access-token']
+
+        if not token:
+            return jsonify({'message': 'Token is missing!'}), 401
+
+        try:
+            identity = load_identity(token)
+        except:
+            return jsonify({'message': 'Token is invalid!'}), 401
+
+        if identity is None:
+            return jsonify({'message': 'Token is invalid!'}), 401
+
+        g.user_id = identity[0]
+        return f(Principal(*identity), *args, **kwargs)
+
+    return decorated
+
+
+def admin_required(f):
+    @wraps(f)
+    @token_required
+    def decorated(current_user, *args, **kwargs):
+        if not current_user.is_admin:
+            return jsonify({'message': 'Admin rights required!'}), 403
+        return f(current_user, *args, **kwargs)
+
+    return decorated
+
+
+# --- Jobs ------------------------------------------------------------------------------------
+
+# Slow or bulk work goes through job_queue (jobs.py): the request enqueues a
+# row and returns, a worker thread in each web process (or `flask run-jobs`
+# on its own) picks it up. Clients follow progress at /api/jobs/<id>.
+
+job_queue = JobQueue(db, Job)
+
+
+def start_job_worker():
+    # Runs on each worker's first request, so with --preload the thread is
+    # started after the fork, in the process that uses it.
+    if current_app.config['JOBS_WORKER']:
+        job_queue.start(current_app._get_current_object())
+
+
+def job_accepted(message, job):
+    response = jsonify({'message': message, 'job_id': job.id})
+    response.headers['Location'] = '/api/jobs/%d' % job.id
+    return response
+
+
+# --- Stock ------------------------------------------------------------------------------------
+
+# Checkout reserves stock for tracked (item, size) pairs with conditional
+# decrements (stock.py); payment keeps it, deleting the order or leaving it
+# unpaid for STOCK_HOLD_MINUTES (the release_stock job) gives it back.
+
+inventory = Inventory(db, Stock, Stock_Reservation)
+
+
+# --- Order archive ------------------------------------------------------------------------------------
+
+# `flask archive-orders` moves paid orders older than ORDER_ARCHIVE_AFTER_DAYS
+# out of orders/order_items into one summary row each (archive.py), so the
+# live tables stop growing with every customer's history. /api/user/orders
+# pages through both.
+
+order_archive = OrderArchive(db, Order_Archive)
+
+
+# --- Sync ------------------------------------------------------------------------------------
+
+# The mobile client keeps its own copy of the catalog, its cart and its
+# orders and asks /api/sync for what changed since its last cursor, instead
+# of fetching every list again. change_log (sync.py) records the changes
+# from the flush events; bulk statements record theirs with change_log.record.
+
+change_log = ChangeLog(db, Change_Log, Change_Log_Horizon)
+
+cart_owners = LRUCache(maxsize=100000)
+
+
+def cart_owner(cart_id):
+    # A cart belongs to the same user for life.
+    user_id = cart_owners.get(cart_id)
+    if user_id is None:
+        user_id = db.session.query(Cart.user_id).filter(Cart.id == cart_id).scalar()
+        cart_owners.set(cart_id, user_id)
+    return user_id
+
+
+def defined_item_parents(connection, ids):
+    # A defined item is one cart or order line; clients see it nested in
+    # that cart item or order, which is private to its user.
+    cart_items = db.select([Cart_Items.id, Cart.user_id]).where(and_(
+        Cart_Items.cart_id == Cart.id, Cart_Items.defined_item_id.in_(ids)))
+    orders = db.select([Orders.id, Orders.user_id]).distinct().where(and_(
+        Order_Items.order_id == Orders.id, Order_Items.defined_item_id.in_(ids)))
+    return [('cart_item', id, owner) for id, owner in connection.execute(cart_items)] + \
+        [('order', id, owner) for id, owner in connection.execute(orders)]
+
+
+def item_type_parents(connection, ids):
+    # Every item nests its type's name, so a renamed type changes them all.
+    items = db.select([Item.id]).where(Item.item_type_id.in_(ids))
+    return [('item', id, None) for id, in connection.execute(items)]
+
+
+change_log.track(Item, 'item')
+change_log.track_nested(Item_Type, item_type_parents)
+change_log.track_nested(Defined_Items, defined_item_parents)
+change_log.track(Reviews, 'review')
+change_log.track(Orders, 'order', owner=lambda values: values.get('user_id'))
+change_log.track(Cart_Items, 'cart_item', owner=lambda values: cart_owner(values.get('cart_id')))
+
+
+# --- Search ------------------------------------------------------------------------------------
+
+# /api/products/search answers from an in-process inverted index (search.py).
+# Writes through this app's session reload just the items they touched; the
+# TTL picks up catalog edits made by other workers or by the eShop site.
+
+
+def load_search_documents(item_ids=None):
+    # Always read the primary: a document loaded from a lagging replica
+    # would stay in the index until the next full rebuild.
+    items = db.select([Item.id, Item.name, Item.description, Item.price, Item.item_type_id])
+    sizes = db.select([Defined_Items.item_id, Defined_Items.size]).distinct()
+    if item_ids is not None:
+        items = items.where(Item.id.in_(item_ids))
+        sizes = sizes.where(Defined_Items.item_id.in_(item_ids))
+
+    with db.engine.connect() as connection:
+        item_sizes = {}
+        for item_id, size in connection.execute(sizes):
+            item_sizes.setdefault(item_id, set()).add(size)
+        return [Document(row.id, row.name, row.description, row.price, row.item_type_id,
+                         frozenset(item_sizes.get(row.id, ())))
+                for row in connection.execute(items)]
 
 
-# --- Login Route ------------------------------------------------------------------------------------
+search_index = SearchIndex(load_search_documents)
 
-@ app.route('/login')
-def login():
-    auth = request.authorization
 
-    if not auth or not auth.username or not auth.password:
-        return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
+# --- Catalog import/export ------------------------------------------------------------------------------------
 
-    user = User.query.filter_by(username=auth.username).first()
+# Bulk loads and dumps of the catalog tables (catalog_io.py), for admins at
+# /api/catalog/<entity> and, for large files, `python manage.py import-catalog`.
 
-    if not user:
-        return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
 
-    if check_password_hash(user.password, auth.password):
-        token = jwt.encode({'public_id': user.public_id, 'exp': datetime.utcnow(
-        ) + timedelta(minutes=30)}, app.config['SECRET_KEY'])
+def catalog_written(entity, ids):
+    # Bulk statements skip the flush events that keep the caches and the
+    # change log in step, so the import reports what it wrote instead.
+    db.session.info['catalog_changed'] = True
+    db.session.info['search_reset'] = True
+    if entity == 'item':
+        change_log.record(entity, UPSERT, [(row_id, None) for row_id in ids])
+    elif entity == 'item_type':
+        change_log.record_nested(Item_Type, ids)
+    elif entity == 'defined_item':
+        change_log.record_nested(Defined_Items, ids)
 
-        return jsonify({'token': token.decode('UTF-8')})
 
-    return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
+catalog_io = CatalogIO(db, on_write=catalog_written)
+catalog_io.register('item_type', Item_Type)
+catalog_io.register('item', Item)
+catalog_io.register('defined_item', Defined_Items)
+catalog_io.register('size', Sizes)
+
+
+# --- Database commands ------------------------------------------------------------------------------------
+
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, default=None, help="Stop after this version.")
+@with_appcontext
+def db_upgrade(target):
+    """Apply pending schema migrations."""
+    ran = migrations.upgrade(db.engine, db.metadata, target)
+    for version, description in ran:
+        click.echo("Applied %04d %s" % (version, description))
+    if not ran:
+        click.echo("Schema is up to date.")
+
+
+@click.command('db-status')
+@with_appcontext
+def db_status():
+    """List applied and pending schema migrations."""
+    applied = migrations.applied_versions(db.engine)
+    for version, description, _ in sorted(migrations.MIGRATIONS, key=lambda m: m[0]):
+        row = applied.get(version)
+        state = row.applied_at.strftime("%Y-%m-%d %H:%M") if row else "pending"
+        click.echo("%04d %-40s %s" % (version, description, state))
+
+
+# --- App factory ------------------------------------------------------------------------------------
+
+
+def configure_services(config):
+    catalog_cache.maxsize, catalog_cache.ttl = config['CATALOG_CACHE_SIZE'], config['CATALOG_CACHE_TTL']
+    token_cache.maxsize, token_cache.ttl = config['AUTH_CACHE_SIZE'], config['AUTH_CACHE_TTL']
+    recent_writes.ttl = config['REPLICA_LAG_SECONDS']
+    password_hasher.configure(config['PASSWORD_SCRYPT_N'], config['PASSWORD_SCRYPT_R'],
+                              config['PASSWORD_SCRYPT_P'], config['PASSWORD_WORKERS'],
+                              config['PASSWORD_QUEUE_SIZE'], host_slots=config['PASSWORD_HOST_SLOTS'])
+    job_queue.lease = config['JOBS_LEASE_SECONDS']
+    job_queue.poll_interval = config['JOBS_POLL_INTERVAL']
+    job_queue.retry_delay = config['JOBS_RETRY_DELAY']
+    change_log.settle = config['SYNC_SETTLE_SECONDS']
+    change_log.retention = timedelta(days=config['SYNC_RETENTION_DAYS'])
+    search_index.ttl = config['SEARCH_INDEX_TTL']
+    inventory.hold = timedelta(minutes=config['STOCK_HOLD_MINUTES'])
+    catalog_io.batch_size = config['CATALOG_IO_BATCH_SIZE']
+    catalog_io.max_errors = config['CATALOG_IO_MAX_ERRORS']
+    order_archive.after = timedelta(days=config['ORDER_ARCHIVE_AFTER_DAYS'])
+
+
+def create_app(config=None):
+    """Builds the app from config.Config, overridden by ``config`` (a dict,
+    or an object with upper-case attributes).
+
+    Creating an app opens no database connection and starts no thread, so
+    gunicorn --preload can build it once in the master process and fork the
+    workers from it (see startup.py).
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    # The blueprints import this module, so they are imported here.
+    from routes import BLUEPRINTS
+
+    db.init_app(app)
+    ma.init_app(app)
+    configure_services(app.config)
+
+    app.before_request(start_instrumentation)
+    # after_request functions run last-registered first: compress_response
+    # before record_instrumentation, so the size metric sees the bytes sent.
+    app.after_request(record_instrumentation)
+    app.after_request(compress_response)
+    app.before_first_request(start_job_worker)
+    app.add_url_rule('/metrics', 'metrics', get_metrics, methods=['GET'])
+
+    for blueprint in BLUEPRINTS:
+        app.register_blueprint(blueprint)
+    app.cli.add_command(db_upgrade)
+    app.cli.add_command(db_status)
+
+    return app
@@ -0,0 +1,96 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, or_, text
+import json
+
+
+def month_of(moment):
+    return date(moment.year, moment.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class OrderArchive:
+    """Paid orders older than ``after``, kept as one compact row each, by month.
+
+    A summary holds what the order history shows: the date, the total, the
+    line count and a snapshot of the lines as they were at archive time
+    (item name, size, amount and unit price). Reading it joins nothing,
+    and later catalog edits don't rewrite old orders.
+
+    ``model`` is keyed by (id, month). On PostgreSQL its table is
+    partitioned by RANGE (month), and ``store`` creates the monthly
+    partitions it needs. Elsewhere month is an ordinary indexed column.
+    Reads bounded by date filter on month too, so they only touch the
+    months in range.
+    """
+
+    def __init__(self, db, model, after=timedelta(days=365)):
+        self.db = db
+        self.model = model
+        self.after = after
+        self._partitions = set()
+
+    def cutoff(self):
+        """Paid orders placed before this are due for the archive."""
+        return datetime.utcnow() - self.after
+
+    def ensure_partitions(self, months):
+        # In their own committed transaction, so a batch that rolls back
+        # doesn't leave this process believing a partition exists.
+        months = set(months) - self._partitions
+        if not months or self.db.engine.dialect.name != 'postgresql':
+            return
+
+        name = self.model.__tablename__
+        with self.db.engine.begin() as connection:
+            quote = connection.dialect.identifier_preparer.quote
+            for month in sorted(months):
+                partition = '%s_%04d_%02d' % (name, month.year, month.month)
+                if connection.execute(text("SELECT to_regclass(:name)"), name=partition).scalar() is None:
+                    connection.execute("CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')" % (
+                        quote(partition), quote(name), month.isoformat(), next_month(month).isoformat()))
+        self._partitions.update(months)
+
+    def store(self, summaries):
+        """Adds summaries (dicts of id, user_id, date, price, line_count and
+        lines) in the current transaction."""
+        if not summaries:
+            return
+        now = datetime.utcnow()
+        rows = [dict(summary, month=month_of(summary['date']), lines=json.dumps(summary['lines']), archived=now)
+                for summary in summaries]
+        self.ensure_partitions(row['month'] for row in rows)
+        self.db.session.execute(self.model.__table__.insert(), rows)
+
+    def query(self, user_id, before=None, after=None):
+        """The user's summaries, newest first, strictly between the (date, id)
+        keys ``after`` and ``before`` when given."""
+        model = self.model
+        query = self.db.session.query(
+            model.id, model.date, model.price, model.line_count, model.lines, model.archived).filter(
+            model.user_id == user_id)
+        if before is not None:
+            query = query.filter(model.month <= month_of(before[0]), or_(
+                model.date < before[0], and_(model.date == before[0], model.id < before[1])))
+        if after is not None:
+            query = query.filter(model.month >= month_of(after[0]), or_(
+                model.date > after[0], and_(model.date == after[0], model.id > after[1])))
+        return query.order_by(model.date.desc(), model.id.desc())
+
+    def delete(self, condition=None):
+        """Deletes the summaries matching ``condition``, or all of them."""
+        query = self.db.session.query(self.model)
+        if condition is not None:
+            query = query.filter(condition)
+        return query.delete(synchronize_session=False)
+
+    @staticmethod
+    def dump(row, fields=None):
+        output = {'id': row.id, 'date': row.date.isoformat(), 'price': row.price, 'paid': True,
+                  'line_count': row.line_count, 'lines': json.loads(row.lines)}
+        if fields is not None:
+            output = {key: value for key, value in output.items() if key in fields}
+        output['archived'] = True
+        return output
@@ -0,0 +1,134 @@
+"""ASGI entry point, for serving the API from an event loop.
+
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app
+
+Connection budget: every worker process opens up to ASGI_THREADS database
+connections for requests plus one for its job thread, so the line above
+needs 4 * (ASGI_THREADS + 1) connections (36 with the default of 8), and
+as many again on the replica when one is configured. Keep it under the database's
+max_connections, minus whatever else connects to it; raise ASGI_THREADS
+only with -w lowered to match.
+
+/image is handled natively: the file is located (and a variant rendered if
+needed) on a worker thread, then streamed to the client in chunks without
+holding a thread for the duration of the download. Every other route runs
+the Flask app on a pool of ASGI_THREADS threads, and the database pool is
+sized to match so a request never waits for a connection another thread
+could have used.
+"""
+from a2wsgi import WSGIMiddleware
+from urllib.parse import parse_qs
+from api import create_app
+from schemas import warm_schemas
+import asyncio
+import json
+import os
+import images
+
+THREADS = int(os.environ.get('ASGI_THREADS', 8))
+CHUNK_SIZE = 64 * 1024
+
+flask_app = create_app({'DB_POOL_SIZE': THREADS})
+warm_schemas()
+
+wsgi_app = WSGIMiddleware(flask_app, workers=THREADS)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == '/image' and scope['method'] in ('GET', 'HEAD'):
+        await serve_image(scope, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+async def serve_image(scope, send):
+    args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+    headers = {key.decode().lower(): value.decode() for key, value in scope['headers']}
+    config = flask_app.config
+
+    try:
+        width = int(args['w']) if 'w' in args else None
+    except ValueError:
+        width = -1
+    fmt = args.get('format')
+
+    if width is not None and width not in config['IMAGE_WIDTHS']:
+        return await send_message(send, 400, 'Unsupported width!')
+    if fmt is not None and fmt not in images.FORMATS:
+        return await send_message(send, 400, 'Unsupported format!')
+
+    loop = asyncio.get_running_loop()
+    try:
+        path, mimetype = await loop.run_in_executor(
+            None, images.get_image, config['IMAGE_ROOT'], config['IMAGE_CACHE_DIR'],
+            args.get('name'), args.get('photo', 'grey.jpg'), width, fmt, config['IMAGE_QUALITY'])
+    except images.ImageNotFound:
+        return await send_message(send, 404, 'Image not found!')
+    except images.ResizeUnavailable:
+        return await send_message(send, 501, 'Image resizing is not available!')
+
+    stat = await loop.run_in_executor(None, os.stat, path)
+    etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+    response_headers = [
+        (b'content-type', mimetype.encode()),
+        (b'etag', etag.encode()),
+        (b'cache-control', b'public, max-age=%d' % config['IMAGE_MAX_AGE']),
+        (b'accept-ranges', b'bytes'),
+    ]
+
+    if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+        await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    start, end, status = 0, stat.st_size - 1, 200
+    byte_range = parse_range(headers.get('range'), stat.st_size)
+    if byte_range is not None:
+        start, end = byte_range
+        status = 206
+        response_headers.append(
+            (b'content-range', b'bytes %d-%d/%d' % (start, end, stat.st_size)))
+
+    response_headers.append((b'content-length', b'%d' % (end - start + 1)))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+
+    if scope['method'] == 'HEAD' or end < start:
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+
+    if remaining > 0:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def parse_range(header, size):
+    # Single "bytes=start-end" ranges only; anything else gets the whole file.
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+
+    first, _, last = header[len('bytes='):].partition('-')
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+
+async def send_message(send, status, message):
+    body = (json.dumps({'message': message}) + '\n').encode()
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'), (b'content-length', b'%d' % len(body))]})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,130 @@
+"""Times bulk catalog loads: one commit per row against the batched import, and the export.
+
+    python -m benchmarks.catalog_import
+    python -m benchmarks.catalog_import --rows 100000 --database postgresql://localhost/eshop_bench
+
+Generates an item CSV with a few broken rows, loads it row by row through
+the ORM (what a script against single-row writes does), then through
+catalog_io into a fresh database, loads it again to time the update path,
+and exports it back. Reports rows per second and the peak memory of each
+step; the import and export peaks should not grow with --rows.
+"""
+from api import catalog_io
+from models import db, Item, Item_Type
+from benchmarks.seed import setup_database
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+
+def write_csv(path, rows, types, broken_every=1000):
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        output.write('name,description,price,item_type_id\n')
+        for i in range(rows):
+            price = 'n/a' if i % broken_every == broken_every - 1 else '%.2f' % (10 + i % 90)
+            output.write('Item %d,"Description, number %d",%s,%d\n' % (i, i, price, i % types + 1))
+
+
+def fresh(database, types):
+    context = setup_database(database)
+    db.session.add_all([Item_Type(name="Type %d" % i) for i in range(types)])
+    db.session.commit()
+    return context
+
+
+def measure(f):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def per_row_commits(path):
+    # Every row parsed, added and committed on its own.
+    with open(path, encoding='utf-8') as stream:
+        next(stream)
+        for line in stream:
+            name, _, rest = line.partition(',')
+            description, _, rest = rest[1:].partition('",')
+            price, item_type_id = rest.strip().split(',')
+            try:
+                db.session.add(Item(name=name, description=description, price=float(price),
+                                    item_type_id=int(item_type_id)))
+                db.session.commit()
+            except ValueError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--per-row', type=int, default=2000,
+                        help="rows to load with per-row commits (it is slow)")
+    parser.add_argument('--types', type=int, default=10)
+    parser.add_argument('--database', default=None, help="default: a SQLite file per step")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'items.csv')
+    small = os.path.join(directory, 'items-small.csv')
+    write_csv(path, args.rows, args.types)
+    write_csv(small, min(args.per_row, args.rows), args.types)
+
+    def database(name):
+        return args.database or 'sqlite:///' + os.path.join(directory, name)
+
+    results = []
+    try:
+        context = fresh(database('per-row.db'), args.types)
+        _, elapsed, peak = measure(lambda: per_row_commits(small))
+        results.append(("per-row commits", min(args.per_row, args.rows), elapsed, peak))
+        db.session.remove()
+        context.pop()
+
+        context = fresh(database('import.db'), args.types)
+
+        def load():
+            with open(path, encoding='utf-8', newline='') as stream:
+                return catalog_io.import_stream('item', stream, 'csv')
+
+        report, elapsed, peak = measure(load)
+        results.append(("import (inserts)", args.rows, elapsed, peak))
+        skipped = report.error_count
+        assert report.inserted == args.rows - skipped, report.as_dict()
+
+        export = os.path.join(directory, 'export.csv')
+
+        def dump():
+            with open(export, 'w', encoding='utf-8', newline='') as output:
+                for chunk in catalog_io.export('item', 'csv'):
+                    output.write(chunk)
+
+        _, elapsed, peak = measure(dump)
+        results.append(("export", args.rows - skipped, elapsed, peak))
+
+        def reload():
+            with open(export, encoding='utf-8', newline='') as stream:
+                return catalog_io.import_stream('item', stream, 'csv')
+
+        report, elapsed, peak = measure(reload)
+        results.append(("import (updates)", args.rows - skipped, elapsed, peak))
+        assert report.updated == args.rows - skipped and not report.error_count, report.as_dict()
+        db.session.remove()
+        context.pop()
+    finally:
+        shutil.rmtree(directory)
+
+    print("%d rows, %d of them invalid, batches of %d\n" % (args.rows, skipped, catalog_io.batch_size))
+    print("%-20s %10s %10s %10s %12s" % ("step", "rows", "seconds", "rows/s", "peak KiB"))
+    for step, rows, elapsed, peak in results:
+        print("%-20s %10d %10.2f %10.0f %12.0f" % (step, rows, elapsed, rows / elapsed, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
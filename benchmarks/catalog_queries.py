@@ -0,0 +1,45 @@
+"""Checks that the product endpoints run a fixed number of SQL statements.
+
+    python -m benchmarks.catalog_queries
+"""
+from sqlalchemy import event
+from models import db
+from benchmarks.seed import app, setup_database, seed_catalog
+import sys
+
+
+def count_statements(client, url):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+def main():
+    failed = False
+    for url in ("/api/products", "/api/product/1"):
+        counts = {}
+        for size in (1, 10, 100):
+            setup_database()
+            seed_catalog(items=size)
+            counts[size] = count_statements(app.test_client(), url)
+            db.session.remove()
+
+        print("%-20s %s" % (url, counts))
+        if len(set(counts.values())) != 1:
+            print("  FAIL: statement count grows with catalog size")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Times /api/user/create_order for growing cart sizes.
+
+    python -m benchmarks.checkout [--runs 5] [--database sqlite:////tmp/bench.db]
+
+Checkout latency should stay roughly flat from 1 to 500 cart lines.
+"""
+from sqlalchemy import event
+from models import db, Item, User
+from benchmarks.seed import app, setup_database, seed_catalog, seed_cart, token_for
+import argparse
+import statistics
+import time
+
+CART_SIZES = (1, 10, 100, 500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--database', default="sqlite://")
+    args = parser.parse_args()
+
+    setup_database(args.database)
+    seed_catalog(items=50)
+    user = User.query.filter_by(username="seed").first()
+    user_id = user.id
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    headers = {'x-access-token': token_for(user)}
+    client = app.test_client()
+
+    statements = []
+    event.listen(db.engine, "before_cursor_execute", lambda *a: statements.append(1))
+
+    print("%10s %10s %10s %12s" % ("lines", "median ms", "max ms", "statements"))
+    for size in CART_SIZES:
+        timings = []
+        for _ in range(args.runs):
+            seed_cart(User.query.get(user_id), size, item_ids)
+            db.session.remove()
+
+            statements.clear()
+            start = time.perf_counter()
+            response = client.post('/api/user/create_order', headers=headers)
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.status_code
+
+        print("%10d %10.2f %10.2f %12d" % (size, statistics.median(timings), max(timings), len(statements)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compression CPU cost against bytes saved, per encoding and level.
+
+    python -m benchmarks.compression
+    python -m benchmarks.compression --items 500 --repeat 20
+
+Seeds a catalog, fetches the uncompressed JSON of the larger payloads and
+compresses each one at every level, reporting the compressed size, the
+ratio and the median time to compress.
+"""
+from models import db, Item
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, seed_orders, token_for
+import argparse
+import compression
+import statistics
+import time
+
+PAYLOADS = ('/api/products', '/api/product/1', '/api/user/orders', '/api/user/defined_items')
+
+LEVELS = {'gzip': (1, 4, 6, 9), 'br': (1, 4, 5, 6, 9, 11)}
+
+
+def fetch_payloads(items):
+    seed_catalog(items=items)
+    users = seed_users(1)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, 20, 4, item_ids)
+    token = token_for(users[0])
+
+    client = app.test_client()
+    bodies = {}
+    for url in PAYLOADS:
+        response = client.get(url, headers={'x-access-token': token, 'Accept-Encoding': 'identity'})
+        assert response.status_code == 200 and 'Content-Encoding' not in response.headers, url
+        bodies[url] = response.get_data()
+    return bodies
+
+
+def median_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    context = setup_database()
+    bodies = fetch_payloads(args.items)
+    context.pop()
+
+    print("%-26s %-6s %5s %10s %7s %10s" % ("payload", "coding", "level", "bytes", "ratio", "ms"))
+    for url, body in bodies.items():
+        print("%-26s %-6s %5s %10d %7s %10s" % (url, "none", "-", len(body), "1.00", "-"))
+        for encoding in compression.available_encodings():
+            for level in LEVELS[encoding]:
+                size = len(compression.compress(body, encoding, level))
+                seconds = median_time(lambda: compression.compress(body, encoding, level), args.repeat)
+                print("%-26s %-6s %5d %10d %7.2f %10.2f" % (
+                    url, encoding, level, size, size / len(body), seconds * 1000))
+
+    print("\nconfigured: COMPRESSION_LEVELS=%s COMPRESSION_CACHED_LEVELS=%s COMPRESSION_MIN_SIZE=%d" % (
+        app.config['COMPRESSION_LEVELS'], app.config['COMPRESSION_CACHED_LEVELS'],
+        app.config['COMPRESSION_MIN_SIZE']))
+
+
+if __name__ == '__main__':
+    main()
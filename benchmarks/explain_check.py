@@ -0,0 +1,168 @@
+"""Checks that the hot routes are served from indexes, not full table scans.
+
+Builds the schema with the migration set, seeds it, calls each route and
+runs EXPLAIN on every SELECT, UPDATE and DELETE the route issued:
+
+    python -m benchmarks.explain_check
+    python -m benchmarks.explain_check --database postgresql://localhost/eshop_bench
+
+On PostgreSQL sequential scans are disabled for the EXPLAIN so a missing
+index shows up as "Seq Scan" even on a small seed.
+"""
+from sqlalchemy import event, inspect
+from api import encode_cursor, order_archive
+from models import db, Item, User
+from benchmarks.seed import app, seed_catalog, seed_users, seed_orders, seed_cart, token_for
+from routes.orders import archive_orders
+from datetime import timedelta
+import argparse
+import os
+import re
+import sys
+import tempfile
+import migrations
+
+# (method, path, json body, tables the route is meant to read in full)
+ROUTES = [
+    ('GET', '/api/products?limit=20', None, {'item'}),
+    ('GET', '/api/product/1', None, set()),
+    ('GET', '/api/reviews/product/1', None, set()),
+    ('GET', '/api/reviews/product/1/summary', None, set()),
+    ('POST', '/api/create_review', {'item_id': 1, 'rating': 4, 'comment': "Nice"}, set()),
+    ('GET', '/api/users/check/user0', None, set()),
+    ('GET', '/api/user', None, set()),
+    ('GET', '/api/user_info', None, set()),
+    ('GET', '/api/user/cart_items', None, set()),
+    ('GET', '/api/user/orders', None, set()),
+    ('GET', '/api/user/orders?limit=5', None, set()),
+    ('POST', '/api/user/create_order', None, set()),
+    ('PUT', '/api/user/complete_order/2', None, set()),
+    ('GET', '/api/sync', None, set()),
+    ('GET', '/api/sync?cursor=' + encode_cursor([0]), None, set()),
+]
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def build(uri):
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    context = app.app_context()
+    context.push()
+    db.drop_all()
+    migrations.version_table.drop(db.engine, checkfirst=True)
+    for version, description in migrations.upgrade(db.engine, db.metadata):
+        print("migrated %04d %s" % (version, description))
+    return context
+
+
+def missing_indexes():
+    """Indexes declared on the models that the migrations did not create."""
+    inspector = inspect(db.engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing += [index.name for index in table.indexes if index.name not in existing]
+    return missing
+
+
+def seed():
+    seed_catalog(items=200, defined_per_item=3, reviews_per_item=5)
+    users = seed_users(50)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, 10, 3, item_ids)
+    # Order history reads the archive too, so put the older paid orders there.
+    order_archive.after = timedelta(days=180)
+    archive_orders(100)
+    for user in users:
+        seed_cart(user, 5, item_ids)
+    token = token_for(User.query.filter_by(username="user0").one())
+    db.session.remove()
+    return token
+
+
+def capture(client, method, path, body, token):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.open(path, method=method, json=body, headers={'x-access-token': token})
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    db.session.remove()
+    assert response.status_code == 200, (path, response.status_code)
+    return statements
+
+
+def explain(statement, parameters):
+    """Returns (plan lines, tables read in full)."""
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if db.engine.dialect.name == 'postgresql':
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("EXPLAIN " + statement, parameters)
+            lines = [row[0] for row in cursor.fetchall()]
+            scans = {m.group(1) for line in lines for m in [POSTGRES_SCAN.search(line)] if m}
+        else:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            lines = [row[-1] for row in cursor.fetchall()]
+            scans = {m.group(1) for line in lines for m in [SQLITE_SCAN.match(line)] if m}
+        connection.rollback()
+        return lines, scans
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help="database URL (default: a temporary SQLite file)")
+    args = parser.parse_args()
+
+    path = None
+    if args.database is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+    context = build(args.database or 'sqlite:///' + path)
+
+    failed = False
+    try:
+        missing = missing_indexes()
+        if missing:
+            print("FAIL: declared on the models but not created by a migration: %s" % ", ".join(missing))
+            failed = True
+
+        # No ANALYZE: every seeded review has the same author, and statistics
+        # from that would talk SQLite out of indexes real data needs.
+        token = seed()
+
+        client = app.test_client()
+        for method, url, body, allowed in ROUTES:
+            statements = capture(client, method, url, body, token)
+            problems = []
+            for statement, parameters in statements:
+                lines, scans = explain(statement, parameters)
+                if scans - allowed:
+                    problems.append((sorted(scans - allowed), statement, lines))
+
+            print("%-6s %-36s %2d statements  %s" % (
+                method, url, len(statements), "FAIL" if problems else "ok"))
+            for tables, statement, lines in problems:
+                print("  full scan of %s in:\n    %s" % (", ".join(tables), " ".join(statement.split())))
+                for line in lines:
+                    print("    | " + line)
+            failed = failed or bool(problems)
+    finally:
+        context.pop()
+        if path:
+            os.remove(path)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
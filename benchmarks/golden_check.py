@@ -0,0 +1,136 @@
+"""Checks that the compiled serializers produce byte-identical JSON.
+
+Seeds a database with fixed ids, dates and public ids, then fetches every
+read route twice, once through marshmallow's own dump and once through the
+compiled dumpers, and compares the bodies byte for byte. It also reports
+the time spent serializing on each path.
+
+    python -m benchmarks.golden_check
+    python -m benchmarks.golden_check --record golden.json    # save the bodies
+    python -m benchmarks.golden_check --against golden.json   # compare with a saved run
+"""
+from api import catalog_cache, metrics
+from models import db, Item, User
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, seed_orders, seed_cart, token_for
+from datetime import datetime, timedelta
+import argparse
+import json
+import sys
+
+USER = "user0"
+
+ROUTES = [
+    '/api/products',
+    '/api/products?limit=7',
+    '/api/products?limit=7&fields=id,name,price',
+    '/api/products?fields=id,item_type,rating',
+    '/api/products?stream=ndjson',
+    '/api/product/3',
+    '/api/user/defined_items',
+    '/api/user/defined_items?stream=json',
+    '/api/user/cart_items',
+    '/api/user/orders',
+    '/api/user/orders?limit=3',
+    '/api/user/orders?fields=id,price,paid',
+    '/api/user/orders?stream=json',
+    '/api/users/check/' + USER,
+    '/api/user',
+    '/api/user/public-1',
+    '/api/users',
+    '/api/users?fields=id,username',
+    '/api/user_info',
+    '/api/reviews/product/2',
+    '/api/reviews/product/2?fields=comment,rating',
+]
+
+EPOCH = datetime(2021, 1, 1)
+
+
+def seed():
+    seed_catalog(items=40, defined_per_item=3, reviews_per_item=3)
+    users = seed_users(10)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, 6, 3, item_ids)
+    for user in users:
+        seed_cart(user, 4, item_ids)
+
+    # Pin everything that is otherwise random or time dependent.
+    for table in db.metadata.sorted_tables:
+        columns = [column.name for column in table.columns if isinstance(column.type, db.DateTime)]
+        if not columns or 'id' not in table.c:
+            continue
+        ids = [row_id for row_id, in db.session.execute(db.select([table.c.id]))]
+        if ids:
+            db.session.execute(table.update().where(table.c.id == db.bindparam('row_id')), [
+                dict({'row_id': row_id}, **{column: EPOCH + timedelta(hours=row_id) for column in columns})
+                for row_id in ids])
+    db.session.execute(User.__table__.update().values(
+        public_id='public-' + db.cast(User.__table__.c.id, db.String), password='x'))
+    db.session.commit()
+
+    token = token_for(User.query.filter_by(username=USER).one())
+    db.session.remove()
+    return token
+
+
+def fetch_all(client, token, fast):
+    app.config['FAST_SERIALIZERS'] = fast
+    catalog_cache.invalidate()
+    bodies = {}
+    for url in ROUTES:
+        response = client.get(url, headers={'x-access-token': token})
+        assert response.status_code == 200, (url, response.status_code)
+        bodies[url] = response.get_data()
+    return bodies
+
+
+def serialize_seconds():
+    _, _, histograms = metrics._metrics['serialization_seconds']
+    return sum(histogram.sum for histogram in histograms.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--record', help="write the response bodies to this file")
+    parser.add_argument('--against', help="also compare with bodies saved by --record")
+    parser.add_argument('--rounds', type=int, default=5, help="timed passes per path")
+    args = parser.parse_args()
+
+    context = setup_database()
+    token = seed()
+    client = app.test_client()
+
+    reference = fetch_all(client, token, fast=False)
+    compiled = fetch_all(client, token, fast=True)
+
+    failed = False
+    for url in ROUTES:
+        same = reference[url] == compiled[url]
+        print("%-48s %7d bytes  %s" % (url, len(reference[url]), "ok" if same else "FAIL"))
+        failed = failed or not same
+
+    if args.against:
+        with open(args.against) as f:
+            saved = json.load(f)
+        for url in ROUTES:
+            if url in saved and saved[url] != compiled[url].decode():
+                print("FAIL: %s differs from %s" % (url, args.against))
+                failed = True
+
+    if args.record:
+        with open(args.record, 'w') as f:
+            json.dump({url: body.decode() for url, body in compiled.items()}, f, indent=1)
+
+    for fast in (False, True):
+        before = serialize_seconds()
+        for _ in range(args.rounds):
+            fetch_all(client, token, fast)
+        print("serialize time, %-11s %8.1f ms" % (
+            "compiled:" if fast else "marshmallow:", (serialize_seconds() - before) * 1000))
+
+    context.pop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
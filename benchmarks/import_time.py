@@ -0,0 +1,102 @@
+"""Worker startup cost: importing the app, building it and warming the schemas.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --budget-ms 900
+
+Every run is a fresh interpreter, so nothing is already imported. Reports
+the median time of each step and the slowest imports, and fails when:
+
+- building the app opened a database connection or started a thread, which
+  would break gunicorn --preload (the workers would share them after fork);
+- an optional heavy module (Pillow, the ASGI adapter) got imported eagerly;
+- --budget-ms is given and import + create_app took longer than that.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by some requests or entry points; importing them is their job.
+LAZY_MODULES = ('PIL', 'a2wsgi', 'uvicorn', 'flask_restful')
+
+PROBE = r'''
+import json, sys, threading, time
+start = time.perf_counter()
+import api
+imported = time.perf_counter()
+app = api.create_app()
+created = time.perf_counter()
+from schemas import warm_schemas
+warm_schemas()
+warmed = time.perf_counter()
+
+from flask_sqlalchemy import get_state
+print(json.dumps({
+    'import': imported - start, 'create_app': created - imported, 'warm_schemas': warmed - created,
+    'engines': len(get_state(app).connectors), 'threads': threading.active_count(),
+    'modules': sorted(name for name in sys.modules if name.split('.')[0] in %r),
+}))
+'''
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE % (LAZY_MODULES,)], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(count):
+    # -X importtime lines: "import time: self | cumulative | name", nesting by indent.
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import api'], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stderr
+    top = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match and len(match.group(3)) <= 2:
+            top.append((int(match.group(2)), match.group(4)))
+    return sorted(top, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="fail if import + create_app takes longer (median)")
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.runs)]
+    steps = {step: statistics.median(run[step] for run in runs) * 1000
+             for step in ('import', 'create_app', 'warm_schemas')}
+
+    for step, ms in steps.items():
+        print("%-14s %8.1f ms" % (step, ms))
+    boot = steps['import'] + steps['create_app']
+    print("%-14s %8.1f ms\n" % ("boot", boot))
+
+    print("slowest top-level imports of `import api` (cumulative):")
+    for microseconds, name in slowest_imports(10):
+        print("  %8.1f ms  %s" % (microseconds / 1000, name))
+
+    failed = False
+    last = runs[-1]
+    if last['engines'] or last['threads'] > 1:
+        print("FAIL: create_app opened %d engines and left %d threads; not safe to --preload"
+              % (last['engines'], last['threads']))
+        failed = True
+    if last['modules']:
+        print("FAIL: imported eagerly: %s" % ", ".join(last['modules']))
+        failed = True
+    if args.budget_ms is not None and boot > args.budget_ms:
+        print("FAIL: boot took %.1f ms, budget is %.1f ms" % (boot, args.budget_ms))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Times bulk order deletion: the old per-order commit loop against the batched job.
+
+    python -m benchmarks.jobs
+    python -m benchmarks.jobs --orders 20000 --lines 3 --batch 1000
+
+Both runs start from the same seeded SQLite file. For the job it reports how
+long the DELETE request takes (just the enqueue) and how long the job takes
+to finish in the background, with the number of progress updates.
+"""
+from api import job_queue
+from models import db, Item, Job, Orders, User
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, seed_orders, token_for
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def seed(path, orders, lines):
+    context = setup_database('sqlite:///' + path)
+    seed_catalog(items=50)
+    users = seed_users(max(1, orders // 100))
+    users[0].is_admin = True
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, orders // len(users), lines, item_ids)
+    db.session.remove()
+    context.pop()
+
+
+def open_copy(template, path):
+    shutil.copyfile(template, path)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    context = app.app_context()
+    context.push()
+    return context
+
+
+def per_order_commits():
+    # What /api/delete_orders used to do inside the request.
+    for order in Orders.query.all():
+        db.session.delete(order)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--lines', type=int, default=3)
+    parser.add_argument('--batch', type=int, default=app.config['DELETE_BATCH_SIZE'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    template = os.path.join(directory, 'template.db')
+    seed(template, args.orders, args.lines)
+    count = None
+
+    try:
+        context = open_copy(template, os.path.join(directory, 'inline.db'))
+        count = Orders.query.count()
+        start = time.perf_counter()
+        per_order_commits()
+        inline = time.perf_counter() - start
+        db.session.remove()
+        context.pop()
+
+        context = open_copy(template, os.path.join(directory, 'job.db'))
+        app.config['DELETE_BATCH_SIZE'] = args.batch
+        headers = {'x-access-token': token_for(User.query.filter_by(is_admin=True).first())}
+        start = time.perf_counter()
+        response = app.test_client().delete('/api/delete_orders', headers=headers)
+        request_time = time.perf_counter() - start
+        assert response.status_code == 202, response.status_code
+
+        updates = []
+        original = job_queue.update
+
+        def update(job_id, **values):
+            if 'progress' in values:
+                updates.append(values['progress'])
+            original(job_id, **values)
+
+        job_queue.update = update
+        start = time.perf_counter()
+        job_queue.run_pending()
+        job_time = time.perf_counter() - start
+        job_queue.update = original
+
+        job = Job.query.get(response.get_json()['job_id'])
+        assert job.status == 'done' and Orders.query.count() == 0, job.status
+        db.session.remove()
+        context.pop()
+    finally:
+        shutil.rmtree(directory)
+
+    print("%d orders with %d lines each" % (count, args.lines))
+    print("per-order commits, inside the request    %9.1f ms" % (inline * 1000))
+    print("job: DELETE /api/delete_orders returns   %9.1f ms" % (request_time * 1000))
+    print("job: batched DELETEs in the background   %9.1f ms  (%d batches of up to %d)" % (
+        job_time * 1000, len(updates), args.batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Order history for a long-time customer, before and after archiving old orders.
+
+    python -m benchmarks.order_history
+    python -m benchmarks.order_history --orders 5000 --years 6 --days 365
+
+Seeds one user with --orders orders spread over --years years (most of them
+paid) and a few hundred other users, then times /api/user/orders as a full
+list, as its first page, as a walk through every page and as a revalidation
+with the full list's ETag (a 304). Then it runs the
+archive with --days and times the same requests again. Also checks that
+the history lists the same orders, in the same order, either way.
+"""
+from sqlalchemy import func
+from api import order_archive
+from models import db, Item, Orders, Order_Items, Defined_Items, User
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, token_for
+from routes.orders import archive_orders
+from datetime import datetime, timedelta
+import argparse
+import random
+import statistics
+import time
+
+
+def seed(orders, years, others):
+    setup_database()
+    seed_catalog(items=200, defined_per_item=0, reviews_per_item=0)
+    users = seed_users(others + 1)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    rnd = random.Random(0)
+    now = datetime.utcnow()
+
+    def add_orders(user, count):
+        for i in range(count):
+            order = Orders(user_id=user.id, paid=rnd.random() < 0.95, price=rnd.randint(10, 200),
+                           date=now - timedelta(days=rnd.uniform(0, 365 * years)))
+            for _ in range(rnd.randint(1, 4)):
+                order.order_items.append(Order_Items(defined_item=Defined_Items(
+                    item_id=rnd.choice(item_ids), size=rnd.choice("SML"), amount=rnd.randint(1, 3))))
+            db.session.add(order)
+            if i % 500 == 499:
+                db.session.commit()
+        db.session.commit()
+
+    add_orders(users[0], orders)
+    for user in users[1:]:
+        add_orders(user, max(1, orders // 50))
+    return User.query.get(users[0].id)
+
+
+def timed(client, path, headers, runs, status=200):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == status, response.status_code
+    return statistics.median(timings), response
+
+
+def walk(client, headers, limit):
+    start = time.perf_counter()
+    ids, cursor, pages = [], None, 0
+    while True:
+        response = client.get('/api/user/orders?limit=%d' % limit + ('&cursor=' + cursor if cursor else ''),
+                              headers=headers)
+        ids += [order['id'] for order in response.get_json()]
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids, pages, (time.perf_counter() - start) * 1000
+
+
+def measure(client, headers, runs, limit):
+    full, response = timed(client, '/api/user/orders', headers, runs)
+    first, _ = timed(client, '/api/user/orders?limit=%d' % limit, headers, runs)
+    revalidate, _ = timed(client, '/api/user/orders', dict(headers, **{'If-None-Match': response.headers['ETag']}),
+                          runs, status=304)
+    ids, pages, walked = walk(client, headers, limit)
+    return {'full': full, 'first': first, 'revalidate': revalidate, 'walk': walked, 'pages': pages, 'bytes': len(response.get_data()),
+            'ids': ids, 'live': db.session.query(func.count(Orders.id)).scalar(),
+            'lines': db.session.query(func.count(Order_Items.id)).scalar()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--others', type=int, default=200)
+    parser.add_argument('--days', type=int, default=app.config['ORDER_ARCHIVE_AFTER_DAYS'])
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    user = seed(args.orders, args.years, args.others)
+    headers = {'x-access-token': token_for(user), 'Accept-Encoding': 'identity'}
+    client = app.test_client()
+    db.session.remove()
+
+    before = measure(client, headers, args.runs, args.limit)
+
+    order_archive.after = timedelta(days=args.days)
+    start = time.perf_counter()
+    moved = archive_orders(app.config['ORDER_ARCHIVE_BATCH_SIZE'])
+    archive_time = time.perf_counter() - start
+    db.session.remove()
+
+    after = measure(client, headers, args.runs, args.limit)
+    assert after['ids'] == before['ids'], "history changed after archiving"
+
+    print("archived %d orders older than %d days in %.2f s\n" % (moved, args.days, archive_time))
+    print("%-34s %12s %12s" % ("", "before", "after"))
+    for label, key, unit in (("live orders (all users)", 'live', ""), ("live order lines", 'lines', ""),
+                             ("full history, median", 'full', "ms"), ("full history, body", 'bytes', "B"),
+                             ("first page of %d, median" % args.limit, 'first', "ms"),
+                             ("full history 304, median", 'revalidate', "ms"),
+                             ("every page (%d pages)" % before['pages'], 'walk', "ms")):
+        print("%-34s %10.0f%-2s %10.0f%-2s" % (label, before[key], unit, after[key], unit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Checks read-replica routing against two local SQLite files.
+
+    python -m benchmarks.replica_check
+
+The replica is a copy of the primary taken before one more item and a
+review are written, so every response shows which database served it.
+"""
+from api import catalog_cache, recent_writes
+from models import db, Item, Reviews, User
+from benchmarks.seed import app, setup_database, seed_catalog, token_for
+import shutil
+import sys
+
+PRIMARY = "/tmp/eshop_primary.db"
+REPLICA = "/tmp/eshop_replica.db"
+
+
+def main():
+    app.config['SQLALCHEMY_BINDS'] = {'replica': "sqlite:///" + REPLICA}
+    context = setup_database("sqlite:///" + PRIMARY)
+    seed_catalog(items=2, reviews_per_item=1)
+    shutil.copyfile(PRIMARY, REPLICA)
+
+    db.session.add(Item(name="Primary only", price=1.0, item_type_id=1))
+    db.session.commit()
+    user = User.query.filter_by(username="seed").first()
+    headers = {'x-access-token': token_for(user)}
+    recent_writes.clear()
+    catalog_cache.clear()
+    db.session.remove()
+
+    # Each request below gets its own app context (and so its own g and
+    # session), as it would when served.
+    context.pop()
+
+    failures = []
+
+    def check(name, condition):
+        print("%-58s %s" % (name, "ok" if condition else "FAIL"))
+        if not condition:
+            failures.append(name)
+
+    client = app.test_client()
+    check("catalog reads go to the replica", len(client.get('/api/products').json) == 2)
+    check("user lookups go to the replica", client.get('/api/users/check/seed').status_code == 200)
+
+    response = client.post('/api/create_review', headers=headers,
+                           json={'item_id': 1, 'rating': 5, 'comment': 'fresh'})
+    check("writes succeed", response.status_code == 200)
+    with app.app_context():
+        check("writes land on the primary", Reviews.query.filter_by(comment='fresh').count() == 1)
+
+    reviews = client.get('/api/reviews/product/1').json
+    check("writer reads its own write (session cookie)", len(reviews) == 2)
+
+    app.test_client().post('/api/user/create_order', headers=headers)
+    orders = app.test_client().get('/api/user/orders', headers=headers).json
+    check("writer reads its own write (same user, no cookie)", len(orders) == 1)
+
+    reviews = app.test_client().get('/api/reviews/product/1').json
+    check("other clients read the replica", len(reviews) == 1)
+
+    check("catalog reads stay on the primary right after a catalog write",
+          len(app.test_client().get('/api/products').json) == 3)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Times /api/products/search against catalog size.
+
+    python -m benchmarks.search
+    python -m benchmarks.search --sizes 1000 10000 50000 --repeat 50
+
+Each size gets a fresh SQLite catalog. The index is built once per size,
+outside the timings, and the median request time is reported per query.
+A selective query should take about the same time at every size.
+"""
+from api import search_index
+from models import db, Item, Item_Type, Defined_Items
+from benchmarks.seed import app, setup_database
+import argparse
+import random
+import statistics
+import time
+
+WORDS = ("cotton linen denim wool silk slim loose classic vintage summer winter "
+         "striped plain checked hooded zip pocket cropped long short").split()
+SIZES = ("XS", "S", "M", "L", "XL")
+
+QUERIES = [
+    '/api/products/search?q=vintage+striped&limit=20',
+    '/api/products/search?q=hood&limit=20',
+    '/api/products/search?q=item+42',
+    '/api/products/search?type=Jacket&size=XL&min_price=20&max_price=21&sort=price',
+    '/api/products/search?min_price=10&max_price=10.5&fields=id,name,price',
+]
+
+
+def seed_catalog(items, seed=0):
+    rnd = random.Random(seed)
+    types = [Item_Type(name=name) for name in ("Shirt", "Pants", "Jacket", "Shorts")]
+    db.session.add_all(types)
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(Item, [
+        {'id': i + 1, 'name': "Item %d %s" % (i, " ".join(rnd.sample(WORDS, 2))),
+         'description': " ".join(rnd.sample(WORDS, 6)), 'price': round(rnd.uniform(5, 100), 2),
+         'image_file': "blue.jpg", 'item_type_id': rnd.choice(types).id} for i in range(items)])
+    db.session.bulk_insert_mappings(Defined_Items, [
+        {'item_id': i + 1, 'size': size, 'amount': 1}
+        for i in range(items) for size in rnd.sample(SIZES, 2)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        context = setup_database()
+        seed_catalog(size)
+        search_index.reset()
+
+        client = app.test_client()
+        start = time.perf_counter()
+        client.get(QUERIES[0])
+        build = time.perf_counter() - start
+
+        for url in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, (url, response.status_code)
+            results[url, size] = (statistics.median(timings), response.headers['X-Total-Count'])
+
+        print("%d items: index built in %.0f ms" % (size, build * 1000))
+        db.session.remove()
+        context.pop()
+
+    print("\n%-80s" % "median ms (matches)" + "".join("%16d" % size for size in args.sizes))
+    for url in QUERIES:
+        print("%-80s" % url + "".join(
+            "%16s" % ("%.2f (%s)" % (results[url, size][0] * 1000, results[url, size][1]))
+            for size in args.sizes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+from api import create_app
+from models import db, Item, Item_Type, Defined_Items, Reviews, User, Cart, User_Info, Cart_Items, Orders, Order_Items
+from werkzeug.security import generate_password_hash
+from datetime import datetime, timedelta
+import random
+import uuid
+import jwt
+
+# The app every benchmark drives. Jobs are run explicitly
+# (job_queue.run_pending) rather than by a thread sharing the test database.
+app = create_app({'SQLALCHEMY_ECHO': False, 'JOBS_WORKER': False})
+
+
+def setup_database(uri="sqlite://"):
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    context = app.app_context()
+    context.push()
+    db.drop_all()
+    db.create_all()
+    return context
+
+
+def seed_catalog(items=10, defined_per_item=3, reviews_per_item=2):
+    """Fill item types, items, defined items and reviews with dummy rows."""
+    user = User(public_id=str(uuid.uuid4()), username="seed", email="seed@example.com",
+                password=generate_password_hash("seed"), is_admin=False)
+    user.info = User_Info()
+    user.cart = Cart()
+    db.session.add(user)
+
+    types = [Item_Type(name=name) for name in ("Shirt", "Pants", "Jacket", "Shorts")]
+    db.session.add_all(types)
+
+    for i in range(items):
+        item = Item(name="Item %d" % i, description="Description %d" % i,
+                    price=10.0 + i, image_file="blue.jpg", item_type=types[i % len(types)])
+        for j in range(defined_per_item):
+            item.defined_item.append(Defined_Items(size="M", amount=j + 1))
+        for j in range(reviews_per_item):
+            item.reviews.append(Reviews(user=user, comment="Review %d" % j, rating=j % 5 + 1))
+        db.session.add(item)
+
+    db.session.commit()
+
+
+def seed_users(count, password="password"):
+    """Creates users user0..userN, all sharing ``password``, each with info and a cart."""
+    hashed = generate_password_hash(password, method="sha256")
+    users = []
+    for i in range(count):
+        user = User(public_id=str(uuid.uuid4()), username="user%d" % i,
+                    email="user%d@example.com" % i, password=hashed, is_admin=False)
+        user.info = User_Info()
+        user.cart = Cart()
+        users.append(user)
+
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def seed_orders(users, orders_per_user, lines_per_order, item_ids, seed=0):
+    """Gives every user ``orders_per_user`` orders of ``lines_per_order`` lines each."""
+    rnd = random.Random(seed)
+    for user in users:
+        for i in range(orders_per_user):
+            order = Orders(user_id=user.id, paid=i % 2 == 0, price=0,
+                           date=datetime.utcnow() - timedelta(days=rnd.randint(0, 365)))
+            for _ in range(lines_per_order):
+                defined_item = Defined_Items(item_id=rnd.choice(item_ids), size="M",
+                                             amount=rnd.randint(1, 3))
+                order.order_items.append(Order_Items(defined_item=defined_item))
+            db.session.add(order)
+        db.session.commit()
+
+
+def seed_cart(user, lines, item_ids):
+    """Put ``lines`` defined items into the user's cart, cycling through ``item_ids``."""
+    for i in range(lines):
+        defined_item = Defined_Items(item_id=item_ids[i % len(item_ids)], size="M", amount=i % 3 + 1)
+        db.session.add(Cart_Items(cart_id=user.cart.id, defined_item=defined_item))
+    db.session.commit()
+
+
+def token_for(user, minutes=30):
+    return jwt.encode({'public_id': user.public_id,
+                       'exp': datetime.utcnow() + timedelta(minutes=minutes)},
+                      app.config['SECRET_KEY']).decode('UTF-8')
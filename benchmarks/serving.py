@@ -0,0 +1,119 @@
+"""Compares concurrent-client throughput of the sync and async deployments.
+
+    python -m benchmarks.serving [--clients 64] [--workers 2] [--duration 10]
+
+Seeds a database, starts gunicorn with the default sync workers
+(startup:app) and then with uvicorn workers (asgi:app) against it, and
+hammers each with the same number of concurrent clients fetching the
+catalog, a product and full-size images.
+"""
+from benchmarks.seed import setup_database, seed_catalog
+from benchmarks.suite import percentile
+from models import db
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+MODES = {
+    'sync': ['gunicorn', '--preload', '-w', '{workers}', '-b', '127.0.0.1:{port}', 'startup:app'],
+    'async': ['gunicorn', '--preload', '-w', '{workers}', '-k', 'uvicorn.workers.UvicornWorker',
+              '-b', '127.0.0.1:{port}', 'asgi:app'],
+}
+
+PATHS = ['/api/products', '/api/product/1', '/image?name=Shirt&photo=blue.jpg',
+         '/image?name=Pants&photo=grey.jpg']
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url + '/api/product/1', timeout=5)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError("Server at %s did not start" % url)
+
+
+def hammer(url, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url + PATHS[i % len(PATHS)], timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors[0] += not ok
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {'requests': len(latencies), 'errors': errors[0],
+            'throughput': round(len(latencies) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8731)
+    parser.add_argument('--database', default="sqlite:////tmp/eshop_serving.db")
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    args = parser.parse_args()
+
+    setup_database(args.database)
+    seed_catalog(items=200)
+    db.session.remove()
+    db.engine.dispose()
+
+    env = dict(os.environ, DATABASE_URL=args.database)
+    url = 'http://127.0.0.1:%d' % args.port
+    results = {}
+
+    for mode, command in MODES.items():
+        command = [part.format(workers=args.workers, port=args.port) for part in command]
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_until_ready(url)
+            hammer(url, args.clients, 1)
+            results[mode] = hammer(url, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print("%-8s %9s %7s %9s %9s %9s" % ("mode", "requests", "errors", "req/s", "p50 ms", "p99 ms"))
+    for mode, result in results.items():
+        print("%-8s %9d %7d %9.1f %9.2f %9.2f" % (
+            mode, result['requests'], result['errors'], result['throughput'],
+            result['p50_ms'], result['p99_ms']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'clients': args.clients, 'workers': args.workers, 'results': results},
+                      f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Parallel checkouts against limited stock: no overselling, and how throughput scales.
+
+    python -m benchmarks.stock_concurrency
+    python -m benchmarks.stock_concurrency --database postgresql://localhost/eshop_bench \\
+        --url http://127.0.0.1:8000 --threads 1 2 4 8 16
+
+Every round seeds a fresh database in which each user has a cart with one
+line of a few hot items, whose stock covers only part of the demand, and
+lines of cold items with plenty of stock. Then all users check out at once
+from --threads client threads. Afterwards every tracked (item, size) must
+satisfy
+
+    starting stock == units left + units held by the orders that went through
+
+and no count may be negative. Any mismatch is oversell and fails the run.
+
+In-process (the default) the threads share one interpreter and SQLite
+takes one writer at a time, so the numbers show correctness more than
+scaling. For throughput, run a server (for example
+`gunicorn -w 8 startup:app` with DATABASE_URL set to the same PostgreSQL
+--database) and pass --url.
+"""
+from sqlalchemy import func
+from models import db, Item, Defined_Items, Cart_Items, Orders, Order_Items, Stock
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, token_for
+from benchmarks.suite import HttpClient
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+
+class ThreadClients:
+    """A Flask test client per request; each request runs in its caller's thread."""
+
+    def request(self, method, path, headers=None, json_body=None):
+        response = app.test_client().open(path, method=method, headers=headers, json=json_body)
+        return response.status_code, response.get_data(), None
+
+
+def seed(database, users, hot_items, hot_stock, cold_lines):
+    context = setup_database(database)
+    seed_catalog(items=hot_items + cold_lines * 4, defined_per_item=0, reviews_per_item=0)
+    item_ids = [item_id for item_id, in db.session.query(Item.id).order_by(Item.id)]
+    hot, cold = item_ids[:hot_items], item_ids[hot_items:]
+
+    db.session.add_all([Stock(item_id=item_id, size='M', available=hot_stock) for item_id in hot])
+    db.session.add_all([Stock(item_id=item_id, size='M', available=users * 10) for item_id in cold])
+    db.session.commit()
+
+    rnd = random.Random(0)
+    seeded = seed_users(users)
+    for user in seeded:
+        lines = [(rnd.choice(hot), rnd.randint(1, 2))] + [(item_id, 1) for item_id in rnd.sample(cold, cold_lines)]
+        for item_id, amount in lines:
+            db.session.add(Cart_Items(cart_id=user.cart.id,
+                                      defined_item=Defined_Items(item_id=item_id, size='M', amount=amount)))
+    db.session.commit()
+
+    initial = {(row.item_id, row.size): row.available for row in Stock.query}
+    tokens = [token_for(user) for user in seeded]
+    db.session.remove()
+    return context, initial, tokens
+
+
+def audit(initial):
+    """Tracked pairs whose stock doesn't add up, as {pair: (units ordered, units left)}."""
+    held = dict(((item_id, size), units) for item_id, size, units in db.session.query(
+        Defined_Items.item_id, Defined_Items.size, func.sum(Defined_Items.amount)).join(
+        Order_Items, Order_Items.defined_item_id == Defined_Items.id).group_by(
+        Defined_Items.item_id, Defined_Items.size))
+    left = {(row.item_id, row.size): row.available for row in Stock.query}
+    return {pair: (held.get(pair, 0), left[pair]) for pair, stock in initial.items()
+            if held.get(pair, 0) + left[pair] != stock or left[pair] < 0}
+
+
+def run(client, tokens, threads):
+    def checkout(token):
+        status, _, _ = client.request('POST', '/api/user/create_order', headers={'x-access-token': token})
+        return status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = list(executor.map(checkout, tokens))
+    return statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=None, help="default: a fresh SQLite file per round")
+    parser.add_argument('--url', help="check out through a running server on the same --database")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--hot-items', type=int, default=5)
+    parser.add_argument('--hot-stock', type=int, default=60)
+    parser.add_argument('--cold-lines', type=int, default=2)
+    args = parser.parse_args()
+    if args.url and not args.database:
+        parser.error("--url needs the server's --database")
+
+    client = HttpClient(args.url) if args.url else ThreadClients()
+    directory = tempfile.mkdtemp()
+    failed = False
+    baseline = None
+
+    print("%8s %8s %8s %8s %8s %10s %8s %10s" % (
+        "threads", "orders", "ok", "409", "other", "orders/s", "speedup", "oversold"))
+    for threads in args.threads:
+        database = args.database or 'sqlite:///' + os.path.join(directory, 'stock-%d.db' % threads)
+        context, initial, tokens = seed(database, args.users, args.hot_items, args.hot_stock, args.cold_lines)
+
+        statuses, elapsed = run(client, tokens, threads)
+        db.session.remove()
+        mismatched = audit(initial)
+        orders = db.session.query(func.count(Orders.id)).scalar()
+        db.session.remove()
+        context.pop()
+
+        ok, sold_out = statuses.count(200), statuses.count(409)
+        rate = len(statuses) / elapsed
+        baseline = baseline or rate
+        print("%8d %8d %8d %8d %8d %10.1f %7.2fx %10d" % (
+            threads, orders, ok, sold_out, len(statuses) - ok - sold_out, rate, rate / baseline,
+            sum(max(0, held - initial[pair]) for pair, (held, _) in mismatched.items())))
+
+        if mismatched or orders != ok:
+            print("FAIL: stock does not add up: %s" % sorted(mismatched.items())[:5])
+            failed = True
+
+    shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
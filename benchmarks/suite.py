@@ -0,0 +1,300 @@
+"""Load-test and benchmark suite for the API.
+
+Seeds a database with configurable volumes, drives the app through a mix of
+realistic client sessions and reports latency percentiles, throughput and
+SQL statements per request for every endpoint.
+
+    python -m benchmarks.suite --volume small --mix shopper --output run.json
+    python -m benchmarks.suite --volume medium --baseline run.json
+
+By default requests go through Flask's test client in this process. With
+--url they are sent over HTTP to a running server (for example a local
+gunicorn) that must be configured with the same --database; statement
+counts are only available in-process.
+"""
+from sqlalchemy import event
+from models import db, Item, User
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, seed_orders, seed_cart
+import argparse
+import base64
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+
+VOLUMES = {
+    'small': dict(users=20, items=50, defined_per_item=3, reviews_per_item=5,
+                  orders_per_user=5, lines_per_order=3, cart_lines=2),
+    'medium': dict(users=200, items=500, defined_per_item=5, reviews_per_item=20,
+                   orders_per_user=20, lines_per_order=4, cart_lines=5),
+    'large': dict(users=1000, items=3000, defined_per_item=5, reviews_per_item=40,
+                  orders_per_user=50, lines_per_order=5, cart_lines=10),
+}
+
+PASSWORD = "password"
+
+
+# --- Clients ------------------------------------------------------------------------------
+
+
+class InProcessClient:
+    """Sends requests through the Flask test client and counts SQL statements."""
+
+    counts_statements = True
+
+    def __init__(self):
+        self.client = app.test_client()
+        self.statements = 0
+        event.listen(db.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def request(self, method, path, headers=None, json_body=None):
+        self.statements = 0
+        response = self.client.open(path, method=method, headers=headers, json=json_body)
+        return response.status_code, response.get_data(), self.statements
+
+
+class HttpClient:
+    counts_statements = False
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+        self.requests = requests
+
+    def request(self, method, path, headers=None, json_body=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.url + path, headers=headers, json=json_body)
+        return response.status_code, response.content, None
+
+
+# --- Scenarios ----------------------------------------------------------------------------
+
+# Each step of a session calls session.call(label, method, path, ...); the
+# label groups requests by route rather than by concrete URL.
+
+
+class Session:
+    def __init__(self, client, recorder, username, item_ids, rnd):
+        self.client = client
+        self.recorder = recorder
+        self.username = username
+        self.item_ids = item_ids
+        self.rnd = rnd
+        self.token = None
+
+    def call(self, label, method, path, headers=None, json_body=None, auth=False):
+        headers = dict(headers or {})
+        if auth:
+            if self.token is None:
+                login(self)
+            headers['x-access-token'] = self.token
+
+        start = time.perf_counter()
+        status, body, statements = self.client.request(method, path, headers, json_body)
+        self.recorder.record(label, time.perf_counter() - start, status, len(body), statements)
+        return status, body
+
+
+def browse(session):
+    session.call("GET /api/products", "GET", "/api/products")
+    item_id = session.rnd.choice(session.item_ids)
+    session.call("GET /api/product/<id>", "GET", "/api/product/%d" % item_id)
+    session.call("GET /api/reviews/product/<id>", "GET", "/api/reviews/product/%d" % item_id)
+
+
+def login(session):
+    credentials = base64.b64encode(("%s:%s" % (session.username, PASSWORD)).encode()).decode()
+    status, body = session.call("GET /login", "GET", "/login",
+                                headers={'Authorization': 'Basic ' + credentials})
+    if status == 200:
+        session.token = json.loads(body)['token']
+
+
+def add_to_cart(session):
+    operations = [{"op": "add", "item_id": session.rnd.choice(session.item_ids),
+                   "size": session.rnd.choice(("S", "M", "L")), "amount": 1}]
+    session.call("POST /api/user/cart_items/batch", "POST", "/api/user/cart_items/batch",
+                 json_body={"operations": operations}, auth=True)
+
+
+def checkout(session):
+    add_to_cart(session)
+    session.call("POST /api/user/create_order", "POST", "/api/user/create_order", auth=True)
+
+
+def read_orders(session):
+    session.call("GET /api/user/orders", "GET", "/api/user/orders", auth=True)
+
+
+MIXES = {
+    'browse': [(browse, 1)],
+    'shopper': [(browse, 5), (login, 1), (add_to_cart, 3), (checkout, 1), (read_orders, 2)],
+    'orders': [(read_orders, 3), (checkout, 1)],
+}
+
+
+# --- Recording ----------------------------------------------------------------------------
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, label, seconds, status, size, statements):
+        with self.lock:
+            sample = self.samples.setdefault(
+                label, {'latency': [], 'errors': 0, 'bytes': 0, 'statements': []})
+            sample['latency'].append(seconds * 1000)
+            sample['bytes'] += size
+            if status >= 400:
+                sample['errors'] += 1
+            if statements is not None:
+                sample['statements'].append(statements)
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label, sample in sorted(self.samples.items()):
+            latency = sample['latency']
+            endpoints[label] = {
+                'requests': len(latency),
+                'errors': sample['errors'],
+                'throughput': round(len(latency) / elapsed, 2),
+                'p50_ms': round(percentile(latency, 0.50), 3),
+                'p95_ms': round(percentile(latency, 0.95), 3),
+                'p99_ms': round(percentile(latency, 0.99), 3),
+                'mean_ms': round(statistics.mean(latency), 3),
+                'bytes_per_request': sample['bytes'] // len(latency),
+                'statements_per_request': round(statistics.mean(sample['statements']), 2)
+                if sample['statements'] else None,
+            }
+
+        total = sum(endpoint['requests'] for endpoint in endpoints.values())
+        return {'elapsed_s': round(elapsed, 3), 'requests': total,
+                'throughput': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+# --- Runner -------------------------------------------------------------------------------
+
+
+def seed(volume):
+    seed_catalog(items=volume['items'], defined_per_item=volume['defined_per_item'],
+                 reviews_per_item=volume['reviews_per_item'])
+    users = seed_users(volume['users'], PASSWORD)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, volume['orders_per_user'], volume['lines_per_order'], item_ids)
+    for user in users:
+        seed_cart(user, volume['cart_lines'], item_ids)
+
+    usernames = [username for username, in db.session.query(User.username).filter(
+        User.username != "seed")]
+    db.session.remove()
+    return usernames, item_ids
+
+
+def run_sessions(client, recorder, mix, usernames, item_ids, sessions, worker):
+    rnd = random.Random(worker)
+    steps = [step for step, weight in mix for _ in range(weight)]
+    for _ in range(sessions):
+        session = Session(client, recorder, rnd.choice(usernames), item_ids, rnd)
+        for step in rnd.sample(steps, len(steps)):
+            step(session)
+
+
+def run(args):
+    volume = dict(VOLUMES[args.volume])
+    setup_database(args.database)
+    usernames, item_ids = seed(volume)
+
+    client = HttpClient(args.url) if args.url else InProcessClient()
+    concurrency = args.concurrency if args.url else 1
+    recorder = Recorder()
+
+    # One untimed session per worker warms caches and connections.
+    run_sessions(client, Recorder(), MIXES[args.mix], usernames, item_ids, 1, -1)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=run_sessions, args=(
+        client, recorder, MIXES[args.mix], usernames, item_ids, args.sessions, worker))
+        for worker in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    result = recorder.report(time.perf_counter() - start)
+    result['meta'] = {'volume': args.volume, 'volumes': volume, 'mix': args.mix,
+                      'sessions': args.sessions, 'concurrency': concurrency,
+                      'mode': 'http' if args.url else 'in-process',
+                      'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+                      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return result
+
+
+def print_report(result, baseline=None):
+    print("%-36s %7s %6s %9s %9s %9s %8s %6s" % (
+        "endpoint", "reqs", "errs", "p50 ms", "p95 ms", "p99 ms", "req/s", "sql"))
+    for label, endpoint in result['endpoints'].items():
+        print("%-36s %7d %6d %9.2f %9.2f %9.2f %8.1f %6s" % (
+            label, endpoint['requests'], endpoint['errors'], endpoint['p50_ms'],
+            endpoint['p95_ms'], endpoint['p99_ms'], endpoint['throughput'],
+            endpoint['statements_per_request'] if endpoint['statements_per_request'] is not None else '-'))
+
+        old = (baseline or {}).get('endpoints', {}).get(label)
+        if old:
+            print("%-36s %7s %6s %+8.1f%% %+8.1f%% %+8.1f%% %8s %6s" % (
+                "  vs baseline", "", "", change(old['p50_ms'], endpoint['p50_ms']),
+                change(old['p95_ms'], endpoint['p95_ms']), change(old['p99_ms'], endpoint['p99_ms']),
+                "", "" if old['statements_per_request'] is None else
+                "%+g" % round(endpoint['statements_per_request'] - old['statements_per_request'], 2)))
+
+    print("%d requests in %.2fs, %.1f req/s" % (
+        result['requests'], result['elapsed_s'], result['throughput']))
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--volume', choices=VOLUMES, default='small')
+    parser.add_argument('--mix', choices=MIXES, default='shopper')
+    parser.add_argument('--sessions', type=int, default=50, help='Sessions per worker.')
+    parser.add_argument('--database', default="sqlite:////tmp/eshop_bench.db")
+    parser.add_argument('--url', help='Drive a running server instead of the test client.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads with --url.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare against a previous --output file.')
+    args = parser.parse_args()
+
+    result = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    return 1 if any(endpoint['errors'] for endpoint in result['endpoints'].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
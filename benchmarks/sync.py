@@ -0,0 +1,82 @@
+"""Bytes and time to catch up: refetching every list against /api/sync.
+
+    python -m benchmarks.sync
+    python -m benchmarks.sync --items 2000 --changes 1 10 100
+
+Seeds a catalog and a user with a cart and order history, takes a sync
+cursor, then changes a few items and cart lines and compares what the
+client needs to catch up: the three full lists, or one delta sync.
+"""
+from api import change_log
+from models import db, Item
+from benchmarks.seed import app, setup_database, seed_catalog, seed_users, seed_orders, seed_cart, token_for
+import argparse
+import random
+import time
+
+FULL_LISTS = ('/api/products', '/api/user/cart_items', '/api/user/orders')
+
+
+def fetch(client, urls, headers):
+    start = time.perf_counter()
+    size = 0
+    for url in urls:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, (url, response.status_code)
+        size += len(response.get_data())
+    return size, time.perf_counter() - start
+
+
+def sync_all(client, cursor, headers):
+    # Follows `more` until the client is caught up.
+    start = time.perf_counter()
+    size = changes = 0
+    while True:
+        response = client.get('/api/sync?limit=200&cursor=' + cursor, headers=headers)
+        assert response.status_code == 200, response.status_code
+        size += len(response.get_data())
+        body = response.get_json()
+        changes += len(body['changes'])
+        cursor = body['cursor']
+        if not body['more']:
+            return size, time.perf_counter() - start, changes, cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--changes', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    context = setup_database()
+    change_log.settle = 0
+    seed_catalog(items=args.items)
+    users = seed_users(1)
+    item_ids = [item_id for item_id, in db.session.query(Item.id)]
+    seed_orders(users, 30, 4, item_ids)
+    seed_cart(users[0], 5, item_ids)
+    headers = {'x-access-token': token_for(users[0]), 'Accept-Encoding': 'identity'}
+    rnd = random.Random(0)
+
+    client = app.test_client()
+    cursor = client.get('/api/sync', headers=headers).get_json()['cursor']
+
+    print("%8s %14s %10s %14s %10s %8s" % ("changes", "refetch bytes", "ms", "sync bytes", "ms", "entries"))
+    for count in args.changes:
+        for item_id in rnd.sample(item_ids, count):
+            Item.query.get(item_id).price += 1
+        db.session.commit()
+        client.post('/api/user/cart_items/batch', headers=headers, json={'operations': [
+            {'op': 'add', 'item_id': rnd.choice(item_ids), 'size': 'M', 'amount': 1}]})
+
+        full_size, full_time = fetch(client, FULL_LISTS, headers)
+        sync_size, sync_time, entries, cursor = sync_all(client, cursor, headers)
+        print("%8d %14d %10.1f %14d %10.1f %8d" % (
+            count, full_size, full_time * 1000, sync_size, sync_time * 1000, entries))
+
+    db.session.remove()
+    context.pop()
+
+
+if __name__ == '__main__':
+    main()
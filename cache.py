@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time to live per entry.
+
+    Entries can be keyed on ``version`` (see ``key``) so that ``invalidate``
+    both drops everything and makes values computed from older data
+    unreachable, even if a slow request stores them after the bump.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, *parts):
+        return (self.version,) + parts
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def evict(self, predicate):
+        with self._lock:
+            keys = [key for key, entry in self._data.items() if predicate(entry[0])]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                    'maxsize': self.maxsize, 'version': self.version}
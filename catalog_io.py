@@ -0,0 +1,373 @@
+from sqlalchemy import Integer, Float, Boolean, select, bindparam, func, literal_column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql import table as sql_table, column as sql_column
+import csv
+import io
+import json
+
+FORMATS = ('csv', 'ndjson')
+
+TRUE = ('1', 'true', 't', 'yes', 'y')
+FALSE = ('0', 'false', 'f', 'no', 'n')
+
+
+class ImportReport:
+    """What an import did: rows inserted and updated, and why other rows were
+    skipped. Keeps the first ``max_errors`` errors and counts the rest."""
+
+    def __init__(self, max_errors=1000):
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    def as_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'error_count': self.error_count,
+                'errors': [{'line': line, 'message': message} for line, message in sorted(self.errors)]}
+
+
+class Entity:
+    """One table as it is imported and exported: every column, keyed by id.
+
+    Values are checked against the column types (and String lengths), and
+    required columns must be given; an empty value counts as missing. A
+    missing value takes the column's default, so every parsed row has the
+    same keys and a batch goes out as one executemany.
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.table = model.__table__
+        self.key = self.table.c.id
+        self.columns = list(self.table.c)
+        self.names = [column.name for column in self.columns]
+        self.references = [(column, next(iter(column.foreign_keys)).column)
+                           for column in self.columns if column.foreign_keys]
+
+        # (name, converter, default, required, primary key) per column,
+        # worked out once rather than for every value.
+        self.fields = []
+        for column in self.columns:
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            self.fields.append((column.name, converter(column), default,
+                                default is None and not column.nullable, column.primary_key))
+
+    def parse(self, record):
+        """The row's values from a record of strings (CSV) or JSON values; raises ValueError."""
+        if len(record) > len(self.names) or not set(record) <= set(self.names):
+            raise ValueError("Unknown fields: " + ", ".join(sorted(set(record) - set(self.names))))
+
+        values = {}
+        for name, convert, default, required, primary_key in self.fields:
+            value = record.get(name)
+            if isinstance(value, str):
+                value = value.strip() or None
+
+            if value is not None:
+                value = convert(value)
+            elif primary_key:
+                continue
+            elif default is not None:
+                value = default
+            elif required:
+                raise ValueError("%s is required" % name)
+            values[name] = value
+        return values
+
+
+def converter(column):
+    """A function that checks a non-empty value for ``column`` and returns it
+    as the column's Python type, raising ValueError if it doesn't fit."""
+    name, kind = column.name, column.type
+
+    def invalid(value):
+        return ValueError("%s: invalid %s %r" % (name, kind.__class__.__name__.lower(), value))
+
+    if isinstance(kind, Boolean):
+        def convert(value):
+            if isinstance(value, bool):
+                return value
+            text = str(value).lower()
+            if text in TRUE:
+                return True
+            if text in FALSE:
+                return False
+            raise invalid(value)
+    elif isinstance(kind, (Integer, Float)):
+        number = int if isinstance(kind, Integer) else float
+
+        def convert(value):
+            if isinstance(value, bool) or (number is int and isinstance(value, float) and not value.is_integer()):
+                raise invalid(value)
+            try:
+                return number(value)
+            except (TypeError, ValueError):
+                raise invalid(value)
+    else:
+        length = getattr(kind, 'length', None)
+
+        def convert(value):
+            if not isinstance(value, str):
+                raise ValueError("%s: expected text, got %r" % (name, value))
+            if length and len(value) > length:
+                raise ValueError("%s: longer than %d characters" % (name, length))
+            return value
+    return convert
+
+
+class CatalogIO:
+    """Bulk import and export of catalog tables as CSV or NDJSON.
+
+    Imports read the input as a stream, in batches of ``batch_size`` rows,
+    and commit once per batch. Each batch is parsed, its foreign keys are
+    checked with one query per key, and the valid rows are upserted by id
+    (rows without an id are inserted). On PostgreSQL a batch is COPYed
+    into a temporary staging table and merged with INSERT ... ON CONFLICT;
+    elsewhere it is one executemany UPDATE for the ids that exist and one
+    executemany INSERT for the rest. Rows that fail are reported with their
+    line number and the rest of the batch still goes in: if the database
+    rejects a batch, it is retried row by row to find the culprits.
+
+    ``on_write(entity, ids)`` is called in each batch's transaction with
+    the ids it wrote.
+
+    Exports page through the table by id, so they hold one batch at a time.
+    """
+
+    def __init__(self, db, on_write=None, batch_size=1000, max_errors=1000):
+        self.db = db
+        self.on_write = on_write
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.entities = {}
+
+    def register(self, name, model):
+        self.entities[name] = Entity(name, model)
+
+    # --- Import ---
+
+    def records(self, stream, fmt):
+        """(line, record or None, error) for each record of a text stream."""
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for record in reader:
+                if None in record:
+                    yield reader.line_num, None, "More values than columns"
+                else:
+                    yield reader.line_num, record, None
+        elif fmt == 'ndjson':
+            for line, text in enumerate(stream, 1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError as e:
+                    yield line, None, "Invalid JSON: %s" % e
+                    continue
+                if isinstance(record, dict):
+                    yield line, record, None
+                else:
+                    yield line, None, "Expected a JSON object"
+        else:
+            raise ValueError("Unknown format: %s" % fmt)
+
+    def import_stream(self, name, stream, fmt):
+        """Imports a text stream into entity ``name``; returns an ImportReport."""
+        entity = self.entities[name]
+        report = ImportReport(self.max_errors)
+        batch = []
+        for line, record, error in self.records(stream, fmt):
+            if error is not None:
+                report.error(line, error)
+                continue
+            try:
+                batch.append((line, entity.parse(record)))
+            except ValueError as e:
+                report.error(line, str(e))
+            if len(batch) >= self.batch_size:
+                self.import_batch(entity, batch, report)
+                batch = []
+        if batch:
+            self.import_batch(entity, batch, report)
+        return report
+
+    def import_batch(self, entity, batch, report):
+        rows = self.check_references(entity, batch, report)
+
+        # A later row for the same id replaces an earlier one.
+        by_id, new = {}, []
+        for line, values in rows:
+            if values.get('id') is None:
+                new.append((line, values))
+            else:
+                by_id[values['id']] = (line, values)
+        rows = list(by_id.values()) + new
+
+        session = self.db.session
+        try:
+            with session.begin_nested():
+                self.write(entity, [values for _, values in rows], report)
+        except DBAPIError:
+            for line, values in rows:
+                try:
+                    with session.begin_nested():
+                        self.write(entity, [values], report)
+                except DBAPIError as e:
+                    report.error(line, str(e.orig).strip().splitlines()[0])
+        session.commit()
+
+    def check_references(self, entity, batch, report):
+        for column, target in entity.references:
+            wanted = {values[column.name] for _, values in batch if values.get(column.name) is not None}
+            if not wanted:
+                continue
+            found = self.existing(target, wanted)
+            kept = []
+            for line, values in batch:
+                value = values.get(column.name)
+                if value is not None and value not in found:
+                    report.error(line, "%s: %s %s does not exist" % (column.name, target.table.name, value))
+                else:
+                    kept.append((line, values))
+            batch = kept
+        return batch
+
+    def existing(self, column, values, chunk=500):
+        """The ``values`` found in ``column``. One statement per chunk, with an
+        expanding parameter so its SQL is compiled once and cached."""
+        values = list(values)
+        query = select([column]).where(column.in_(bindparam('values', expanding=True)))
+        found = set()
+        for start in range(0, len(values), chunk):
+            found.update(value for value, in self.db.session.execute(
+                query, {'values': values[start:start + chunk]}))
+        return found
+
+    def write(self, entity, rows, report):
+        if not rows:
+            return
+        if self.db.session.connection().dialect.name == 'postgresql':
+            inserted, updated = self.copy_upsert(entity, rows)
+        else:
+            inserted, updated = self.executemany_upsert(entity, rows)
+        report.inserted += len(inserted)
+        report.updated += len(updated)
+        if self.on_write:
+            self.on_write(entity.name, inserted + updated)
+
+    def copy_upsert(self, entity, rows):
+        connection = self.db.session.connection()
+        quote = connection.dialect.identifier_preparer.quote
+        table = entity.table
+        staging_name = 'staging_' + table.name
+        # Column types only, no constraints: new rows arrive without an id.
+        connection.execute(
+            'CREATE TEMPORARY TABLE IF NOT EXISTS %s ON COMMIT DROP AS SELECT * FROM %s WITH NO DATA' % (
+                quote(staging_name), quote(table.name)))
+        connection.execute('TRUNCATE %s' % quote(staging_name))
+
+        buffer = io.StringIO()
+        for values in rows:
+            buffer.write('\t'.join(copy_text(values.get(name)) for name in entity.names) + '\n')
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (
+            quote(staging_name), ', '.join(quote(name) for name in entity.names)), buffer)
+
+        staging = sql_table(staging_name, *[sql_column(name) for name in entity.names])
+        others = [name for name in entity.names if name != 'id']
+
+        # Rows with an id first, then move the sequence past them, then
+        # let the sequence number the new rows.
+        merge = postgresql.insert(table).from_select(
+            entity.names, select([staging.c[name] for name in entity.names]).where(staging.c.id.isnot(None)))
+        merge = merge.on_conflict_do_update(
+            index_elements=[table.c.id], set_={name: merge.excluded[name] for name in others})
+        inserted, updated = [], []
+        for row_id, was_inserted in connection.execute(
+                merge.returning(table.c.id, literal_column('xmax = 0'))):
+            (inserted if was_inserted else updated).append(row_id)
+        if inserted:
+            connection.execute(select([func.setval(
+                func.pg_get_serial_sequence(table.name, 'id'), select([func.max(table.c.id)]).as_scalar())]))
+
+        add = table.insert().from_select(
+            others, select([staging.c[name] for name in others]).where(staging.c.id.is_(None)))
+        inserted += [row_id for row_id, in connection.execute(add.returning(table.c.id))]
+        return inserted, updated
+
+    def executemany_upsert(self, entity, rows):
+        session = self.db.session
+        table = entity.table
+        existing = self.existing(table.c.id, [values['id'] for values in rows if values.get('id') is not None])
+
+        updates = [values for values in rows if values.get('id') in existing]
+        with_id = [values for values in rows if values.get('id') is not None and values['id'] not in existing]
+        new = [values for values in rows if values.get('id') is None]
+
+        if updates:
+            others = [name for name in entity.names if name != 'id']
+            session.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+                {name: bindparam('b_' + name) for name in others}),
+                [{'b_' + name: value for name, value in values.items()} for values in updates])
+        if with_id:
+            session.execute(table.insert(), with_id)
+        inserted = [values['id'] for values in with_id]
+
+        if new:
+            # executemany gives no ids back; the new rows are the ones above
+            # the highest id before the insert. A concurrent insert can only
+            # add ids to the list, never hide one.
+            last = session.execute(select([func.max(table.c.id)])).scalar() or 0
+            session.execute(table.insert(), new)
+            inserted += [row_id for row_id, in session.execute(
+                select([table.c.id]).where(table.c.id > last).order_by(table.c.id))]
+        return inserted, [values['id'] for values in updates]
+
+    # --- Export ---
+
+    def export(self, name, fmt):
+        """Yields entity ``name`` as text chunks of CSV (with a header) or NDJSON, one batch per chunk."""
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format: %s" % fmt)
+        entity = self.entities[name]
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if fmt == 'csv':
+            writer.writerow(entity.names)
+
+        last = None
+        while True:
+            query = select(entity.columns).order_by(entity.key).limit(self.batch_size)
+            if last is not None:
+                query = query.where(entity.key > last)
+            rows = self.db.session.execute(query).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if fmt == 'csv':
+                    writer.writerow(['' if value is None else value for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(entity.names, row))) + '\n')
+            last = rows[-1].id
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def copy_text(value):
+    """A value in PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
@@ -0,0 +1,48 @@
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def available_encodings():
+    """Content codings we can produce, most preferred first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """Picks a coding from a werkzeug Accept-Encoding header, or None for identity."""
+    return accept_encodings.best_match(available_encodings())
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    # mtime=0 keeps the output, and so the bytes we cache, stable.
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CachedBody:
+    """A response body with its ETag and compressed variants.
+
+    Each variant is compressed the first time a client asks for it and kept
+    for as long as the entry lives, so a cached response is compressed once
+    per content version rather than once per request.
+    """
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding, level):
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    data = self._encoded[encoding] = compress(self.body, encoding, level)
+        return data
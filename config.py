@@ -0,0 +1,56 @@
+"""Settings for create_app. Anything deployment-specific comes from the environment."""
+import os
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', "your database")
+    SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']} \
+        if 'DATABASE_REPLICA_URL' in os.environ else {}
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    REPLICA_LAG_SECONDS = 5
+    SQLALCHEMY_ECHO = False
+    SQLALCHEMY_TRACK_MODIFICATIONS = True
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'secret af')
+    CATALOG_CACHE_SIZE = 512
+    CATALOG_CACHE_TTL = 300
+    SEARCH_INDEX_TTL = 600
+    PAGE_SIZE_DEFAULT = 50
+    PAGE_SIZE_LIMIT = 200
+    STREAM_BATCH_SIZE = 200
+    AUTH_CACHE_SIZE = 10000
+    AUTH_CACHE_TTL = 120
+    IMAGE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+    IMAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.image_cache')
+    IMAGE_WIDTHS = (100, 200, 400, 800)
+    IMAGE_FORMATS = ('jpeg', 'webp')
+    IMAGE_QUALITY = 80
+    IMAGE_MAX_AGE = 7 * 24 * 3600
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_LEVELS = {'br': 5, 'gzip': 6}
+    COMPRESSION_CACHED_LEVELS = {'br': 9, 'gzip': 9}
+    JOBS_WORKER = os.environ.get('JOBS_WORKER', '1') != '0'
+    JOBS_POLL_INTERVAL = 2
+    JOBS_LEASE_SECONDS = 60
+    JOBS_RETRY_DELAY = 5
+    DELETE_BATCH_SIZE = 500
+    SYNC_SETTLE_SECONDS = 5
+    SYNC_RETENTION_DAYS = 30
+    STOCK_HOLD_MINUTES = 30
+    CATALOG_IO_BATCH_SIZE = 1000
+    ORDER_ARCHIVE_AFTER_DAYS = 365
+    ORDER_ARCHIVE_BATCH_SIZE = 500
+    CATALOG_IO_MAX_ERRORS = 1000
+    METRICS_ENABLED = True
+    FAST_SERIALIZERS = True
+    SLOW_REQUEST_MS = None
+    PASSWORD_SCRYPT_N = 2 ** 14
+    PASSWORD_SCRYPT_R = 8
+    PASSWORD_SCRYPT_P = 1
+    PASSWORD_WORKERS = 2
+    PASSWORD_QUEUE_SIZE = 16
+    PASSWORD_HOST_SLOTS = int(os.environ.get('PASSWORD_HOST_SLOTS', 4))
+    ACCESS_TOKEN_MINUTES = 30
+    REFRESH_TOKEN_HOURS = 24
@@ -0,0 +1,117 @@
+from werkzeug.security import safe_join
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+# Output formats we can re-encode to, keyed by the ?format= value.
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+
+
+def default_file_mode():
+    # The umask can only be read by setting it, so this runs once, at
+    # import, before any request threads exist.
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# mkstemp creates files as 0600; variants get what open() would give them,
+# so a server running as another user than `manage.py warm-images` can read them.
+FILE_MODE = default_file_mode()
+
+
+class ImageNotFound(Exception):
+    pass
+
+
+class ResizeUnavailable(Exception):
+    pass
+
+
+def find_source(root, category, photo):
+    """Returns the path of img/<category>/<photo>, refusing anything outside root."""
+    if not category or not photo:
+        raise ImageNotFound()
+
+    path = safe_join(root, category, photo)
+    if path is None or not os.path.isfile(path):
+        raise ImageNotFound()
+
+    return path
+
+
+def variant_key(source, width, fmt, quality):
+    # Keyed on the source's identity on disk, so replacing a photo gives
+    # its variants new names instead of serving stale ones.
+    stat = os.stat(source)
+    key = "%s:%d:%d:%s:%s:%s" % (os.path.abspath(source), stat.st_mtime_ns, stat.st_size,
+                                 width, fmt, quality)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def render_variant(source, target, width, fmt, quality):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ResizeUnavailable()
+
+    pil_format = FORMATS[fmt][0]
+    with Image.open(source) as image:
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        # Write next to the target and rename, so a concurrent request never
+        # sees a half-written file.
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, pil_format, quality=quality, optimize=True)
+            os.chmod(partial, FILE_MODE)
+            os.replace(partial, target)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+
+def get_image(root, cache_dir, category, photo, width=None, fmt=None, quality=80):
+    """Returns (path, mimetype) for the requested photo or one of its variants.
+
+    Variants are rendered on first request into cache_dir and served from
+    there afterwards.
+    """
+    source = find_source(root, category, photo)
+
+    if width is None and fmt is None:
+        return source, mimetypes.guess_type(source)[0] or 'application/octet-stream'
+
+    fmt = fmt or 'jpeg'
+    target = os.path.join(cache_dir, variant_key(source, width, fmt, quality) + FORMATS[fmt][2])
+    if not os.path.isfile(target):
+        os.makedirs(cache_dir, exist_ok=True)
+        render_variant(source, target, width, fmt, quality)
+
+    return target, FORMATS[fmt][1]
+
+
+def warm(root, cache_dir, widths, formats, quality=80):
+    """Pre-renders every width/format variant of every photo under root."""
+    rendered = 0
+    for category in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, category)):
+            continue
+
+        for photo in sorted(os.listdir(os.path.join(root, category))):
+            for fmt in formats:
+                for width in widths:
+                    get_image(root, cache_dir, category, photo, width, fmt, quality)
+                    rendered += 1
+
+    return rendered
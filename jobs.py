@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event, and_, or_
+import json
+import threading
+import traceback
+
+
+class JobContext:
+    """What a task function gets: the job's payload and a way to report progress."""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job.id
+        self.payload = json.loads(job.payload) if job.payload else {}
+        self.attempt = job.attempts
+
+    def progress(self, done, total=None):
+        """Records progress and extends the lease. Commits the current transaction."""
+        self.queue.update(self.id, progress=done, total=total,
+                          locked_until=datetime.utcnow() + timedelta(seconds=self.queue.lease))
+
+
+class JobQueue:
+    """Persistent background jobs, stored as rows of ``model``.
+
+    ``enqueue`` adds the row to the caller's session, so a job exists only
+    if the transaction that asked for it commits. Workers claim due jobs
+    with a conditional UPDATE, so any number of processes can poll the same
+    table and each job runs in one of them at a time. A claim is a lease:
+    a worker that dies mid-job leaves it to be picked up again once the
+    lease runs out. Failed jobs are retried with exponential backoff up to
+    the task's ``max_attempts``; since a job can run more than once, tasks
+    have to be safe to repeat.
+    """
+
+    def __init__(self, db, model, lease=60, poll_interval=2, retry_delay=5):
+        self.db = db
+        self.model = model
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.tasks = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        event.listen(db.session, 'after_commit', self._after_commit)
+
+    def task(self, kind, max_attempts=3):
+        def decorator(f):
+            self.tasks[kind] = (f, max_attempts)
+            return f
+        return decorator
+
+    def enqueue(self, kind, payload=None, delay=0, user_id=None):
+        """Adds a job to the current session; it is queued when the session commits.
+
+        ``user_id`` is whom the job is for, if anyone.
+        """
+        _, max_attempts = self.tasks[kind]
+        now = datetime.utcnow()
+        job = self.model(kind=kind, payload=json.dumps(payload or {}), status='queued',
+                         attempts=0, max_attempts=max_attempts, progress=0,
+                         run_after=now + timedelta(seconds=delay), created=now, updated=now, user_id=user_id)
+        self.db.session.add(job)
+        self.db.session.info['jobs_enqueued'] = True
+        return job
+
+    def _after_commit(self, session):
+        if session.info.pop('jobs_enqueued', False):
+            self._wake.set()
+
+    def update(self, job_id, **values):
+        values['updated'] = datetime.utcnow()
+        self.db.session.query(self.model).filter(self.model.id == job_id).update(
+            values, synchronize_session=False)
+        self.db.session.commit()
+
+    def claim(self):
+        model = self.model
+        now = datetime.utcnow()
+        due = or_(and_(model.status == 'queued', model.run_after <= now),
+                  and_(model.status == 'running', model.locked_until < now))
+
+        candidates = self.db.session.query(model.id).filter(due).order_by(
+            model.run_after, model.id).limit(5).all()
+        for job_id, in candidates:
+            claimed = self.db.session.query(model).filter(model.id == job_id, due).update({
+                'status': 'running', 'attempts': model.attempts + 1, 'updated': now,
+                'locked_until': now + timedelta(seconds=self.lease)}, synchronize_session=False)
+            self.db.session.commit()
+            if claimed:
+                return self.db.session.query(model).get(job_id)
+        return None
+
+    def run_one(self):
+        """Claims and runs one due job; returns False if there was none."""
+        job = self.claim()
+        if job is None:
+            return False
+
+        job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+        task, _ = self.tasks.get(job.kind, (None, None))
+        try:
+            if task is None:
+                raise LookupError("No task registered for %r" % job.kind)
+            if attempts > max_attempts:
+                raise RuntimeError("Lease expired on the last attempt")
+            result = task(JobContext(self, job))
+        except Exception:
+            self.db.session.rollback()
+            error = traceback.format_exc(limit=5)
+            if task is not None and attempts < max_attempts:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                self.update(job_id, status='queued', error=error, locked_until=None,
+                            run_after=datetime.utcnow() + timedelta(seconds=delay))
+            else:
+                self.update(job_id, status='failed', error=error, locked_until=None)
+        else:
+            self.update(job_id, status='done', result=json.dumps(result), locked_until=None)
+        return True
+
+    def run_pending(self, limit=None):
+        """Runs due jobs until there are none left (or ``limit`` ran); returns how many ran."""
+        ran = 0
+        while (limit is None or ran < limit) and self.run_one():
+            ran += 1
+        return ran
+
+    def run_forever(self, app):
+        with app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    ran = self.run_one()
+                except Exception:
+                    app.logger.exception("Job worker failed to poll")
+                    ran = False
+                finally:
+                    self.db.session.remove()
+
+                if not ran:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+
+    def start(self, app):
+        """Starts a worker thread in this process, once."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run_forever, args=(app,),
+                                            name='job-worker', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,17 @@
+"""Command-line entry point: the app's flask commands, without FLASK_APP or a web worker.
+
+    python manage.py import-catalog item items.csv
+    python manage.py export-catalog defined_item defined_items.ndjson
+    python manage.py db-upgrade
+
+Bulk loads run here, in their own process, instead of tying up the HTTP
+workers.
+"""
+from flask.cli import FlaskGroup
+
+from api import create_app
+
+cli = FlaskGroup(create_app=create_app)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,82 @@
+import bisect
+import threading
+
+# Upper bounds (seconds / bytes / counts) of the histogram buckets.
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the shape Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield repr(float(bound)), total
+        yield '+Inf', total + self.counts[-1]
+
+
+class Registry:
+    """In-memory counters and histograms keyed by metric name and labels.
+
+    Updates take one lock and a few list increments, cheap enough to run on
+    every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, kind, name, help, labels, factory):
+        key = tuple(sorted(labels.items()))
+        metric = self._metrics.setdefault(name, (kind, help, {}))
+        series = metric[2]
+        if key not in series:
+            series[key] = factory()
+        return series, key
+
+    def inc(self, name, help, labels, value=1):
+        with self._lock:
+            series, key = self._get('counter', name, help, labels, lambda: 0)
+            series[key] += value
+
+    def observe(self, name, help, labels, value, buckets=TIME_BUCKETS):
+        with self._lock:
+            series, key = self._get('histogram', name, help, labels, lambda: Histogram(buckets))
+            series[key].observe(value)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help, series) in sorted(self._metrics.items()):
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for key, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append('%s%s %s' % (name, format_labels(key), value))
+                        continue
+
+                    for bound, count in value.samples():
+                        lines.append('%s_bucket%s %d' % (name, format_labels(key + (('le', bound),)), count))
+                    lines.append('%s_sum%s %s' % (name, format_labels(key), repr(value.sum)))
+                    lines.append('%s_count%s %d' % (name, format_labels(key), sum(value.counts)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in key)
@@ -0,0 +1,153 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction and is then
+recorded in the ``schema_version`` table:
+
+    flask db-upgrade        # apply everything pending
+    flask db-status         # list applied and pending versions
+
+Steps look before they create, so a database that was built with
+``db.create_all()`` or ``flask rebuild-ratings`` upgrades cleanly and only
+gets what it is missing.
+"""
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, select, func, case
+from datetime import datetime
+
+version_table = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.utcnow))
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return decorator
+
+
+def create_table(connection, metadata, name):
+    """Creates the table (with its indexes) unless it exists; returns True if it did."""
+    if connection.dialect.has_table(connection, name):
+        return False
+    metadata.tables[name].create(connection)
+    return True
+
+
+def add_column(connection, metadata, table, name):
+    """Adds a nullable column as the model declares it, unless it exists."""
+    if name in {column['name'] for column in inspect(connection).get_columns(table)}:
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    column = metadata.tables[table].c[name]
+    connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+        quote(table), quote(name), column.type.compile(dialect=connection.dialect)))
+
+
+def create_index(connection, metadata, table, name):
+    existing = {index['name'] for index in inspect(connection).get_indexes(table)}
+    if name not in existing:
+        index, = [index for index in metadata.tables[table].indexes if index.name == name]
+        index.create(connection)
+
+
+@migration(1, "baseline tables")
+def baseline(connection, metadata):
+    for name in ('user', 'user__info', 'item_type', 'item', 'sizes', 'defined_items',
+                 'cart', 'cart_items', 'orders', 'order_items', 'reviews'):
+        create_table(connection, metadata, name)
+
+
+@migration(2, "item_rating aggregates")
+def item_rating(connection, metadata):
+    if not create_table(connection, metadata, 'item_rating'):
+        return
+
+    reviews = metadata.tables['reviews']
+    rating = metadata.tables['item_rating']
+    stars = [func.sum(case([(reviews.c.rating == n, 1)], else_=0)) for n in range(1, 6)]
+    connection.execute(rating.insert().from_select(
+        ['item_id', 'count', 'total'] + ['stars_%d' % n for n in range(1, 6)],
+        select([reviews.c.item_id, func.count(reviews.c.id), func.sum(reviews.c.rating)] + stars)
+        .where(reviews.c.item_id.isnot(None)).group_by(reviews.c.item_id)))
+
+
+@migration(3, "indexes for the hot route filters")
+def route_indexes(connection, metadata):
+    # cart listing and checkout filter by cart; order history and reviews
+    # filter by owner and sort newest first; the catalog loaders select
+    # children by parent id.
+    for table, name in (('cart_items', 'ix_cart_items_cart_id'),
+                        ('cart_items', 'ix_cart_items_defined_item_id'),
+                        ('orders', 'ix_orders_user_id_date'),
+                        ('order_items', 'ix_order_items_order_id'),
+                        ('order_items', 'ix_order_items_defined_item_id'),
+                        ('defined_items', 'ix_defined_items_item_id'),
+                        ('item', 'ix_item_item_type_id'),
+                        ('reviews', 'ix_reviews_item_id_date'),
+                        ('reviews', 'ix_reviews_user_id')):
+        create_index(connection, metadata, table, name)
+
+
+@migration(4, "jobs table")
+def jobs(connection, metadata):
+    create_table(connection, metadata, 'jobs')
+
+
+@migration(5, "change log for delta sync")
+def change_log(connection, metadata):
+    create_table(connection, metadata, 'change_log')
+    create_table(connection, metadata, 'change_log_horizon')
+
+
+@migration(6, "stock counters and reservations")
+def stock(connection, metadata):
+    create_table(connection, metadata, 'stock')
+    create_table(connection, metadata, 'stock_reservation')
+
+
+@migration(7, "order archive")
+def order_archive(connection, metadata):
+    create_table(connection, metadata, 'order_archive')
+
+
+@migration(8, "drop public defined item changes")
+def private_defined_items(connection, metadata):
+    # Defined items are cart and order lines; their changes are now logged
+    # as changes to the user's cart item or order instead.
+    change_log = metadata.tables['change_log']
+    connection.execute(change_log.delete().where(change_log.c.entity == 'defined_item'))
+
+
+@migration(9, "job owners")
+def job_owners(connection, metadata):
+    add_column(connection, metadata, 'jobs', 'user_id')
+
+
+@migration(10, "refresh tokens")
+def refresh_tokens(connection, metadata):
+    create_table(connection, metadata, 'refresh_tokens')
+
+
+def applied_versions(engine):
+    version_table.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        return {row.version: row for row in connection.execute(select([version_table]))}
+
+
+def upgrade(engine, metadata, target=None):
+    """Applies pending migrations up to ``target``; returns the (version, description) pairs run."""
+    applied = applied_versions(engine)
+    ran = []
+    for version, description, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied or (target is not None and version > target):
+            continue
+        with engine.begin() as connection:
+            step(connection, metadata)
+            connection.execute(version_table.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+        ran.append((version, description))
+    return ran
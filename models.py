@@ -0,0 +1,316 @@
+"""The database handle and the models. Bound to an app by create_app (db.init_app)."""
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.orm import backref, sessionmaker
+from datetime import datetime
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads from @read_only routes to the 'replica' bind.
+
+    Anything flushed, and any read that must see a recent write by the same
+    user (or to the catalog), stays on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and db.use_replica(self):
+            return db.get_engine(self.app, bind='replica')
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    # Replaced by api.py with the policy that knows about requests and users.
+    use_replica = staticmethod(lambda session: False)
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        rv = super().apply_driver_hacks(app, sa_url, options)
+
+        # Pool sizing is per worker process; SQLite keeps Flask-SQLAlchemy's
+        # own pool choice.
+        options.setdefault('pool_pre_ping', True)
+        options.setdefault('pool_recycle', app.config['DB_POOL_RECYCLE'])
+        if not sa_url.drivername.startswith('sqlite'):
+            options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+
+        return rv
+
+
+db = RoutingSQLAlchemy()
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    public_id = db.Column(db.String(300), unique=True)
+    username = db.Column(db.String(50), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(300), nullable=False)
+    info = db.relationship(
+        "User_Info", cascade="all, delete-orphan", uselist=False, backref="user")
+    cart = db.relationship(
+        "Cart", cascade="all, delete-orphan", uselist=False, backref="user")
+    orders = db.relationship("Orders", backref="user")
+    reviews = db.relationship("Reviews", backref="user")
+    is_admin = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f"User('{self.username}')"
+
+
+class User_Info(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True)
+    first_name = db.Column(db.String(30), nullable=True)
+    last_name = db.Column(db.String(30), nullable=True)
+    phone_number = db.Column(db.String(30), nullable=True)
+    address = db.Column(db.String(30), nullable=True)
+
+
+class Orders(db.Model):
+    __tablename__ = 'orders'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    order_items = db.relationship(
+        "Order_Items", backref="order", cascade="all,delete")
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    price = db.Column(db.Float)
+    paid = db.Column(db.Boolean, nullable=False)
+
+    __table_args__ = (db.Index('ix_orders_user_id_date', 'user_id', 'date'),)
+
+
+class Order_Archive(db.Model):
+    # One row per archived order: its total and a frozen copy of its lines
+    # (JSON). Partitioned by month on PostgreSQL; see archive.py.
+    __tablename__ = 'order_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    price = db.Column(db.Float)
+    line_count = db.Column(db.Integer, nullable=False)
+    lines = db.Column(db.Text, nullable=False)
+    archived = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_order_archive_user_id_date', 'user_id', 'date'),
+        db.Index('ix_order_archive_month', 'month'),
+        {'postgresql_partition_by': 'RANGE (month)'},
+    )
+
+
+class Order_Items(db.Model):
+    __tablename__ = 'order_items'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey(
+        'orders.id'), nullable=False)
+    date_added = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+    defined_item_id = db.Column(db.Integer, db.ForeignKey(
+        'defined_items.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_order_items_order_id', 'order_id'),
+        db.Index('ix_order_items_defined_item_id', 'defined_item_id'),
+    )
+
+
+class Cart(db.Model):
+    __tablename__ = 'cart'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True)
+    cart_items = db.relationship("Cart_Items", backref="cart")
+
+
+class Cart_Items(db.Model):
+    __tablename__ = 'cart_items'
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    defined_item_id = db.Column(db.Integer, db.ForeignKey('defined_items.id'))
+    date_added = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    # Checkout joins on defined_item_id after filtering by cart, so the
+    # first index answers it without touching the table.
+    __table_args__ = (
+        db.Index('ix_cart_items_cart_id', 'cart_id', 'defined_item_id'),
+        db.Index('ix_cart_items_defined_item_id', 'defined_item_id'),
+    )
+
+
+class Defined_Items(db.Model):
+    __tablename__ = 'defined_items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    size = db.Column(db.String(10), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    order_item = db.relationship("Order_Items", backref=backref(
+        'defined_item', remote_side=[id]), lazy=True)
+    cart_item_id = db.relationship("Cart_Items", backref=backref(
+        'defined_item', remote_side=[id]), lazy=True)
+
+    __table_args__ = (db.Index('ix_defined_items_item_id', 'item_id'),)
+
+
+class Item(db.Model):
+    __tablename__ = 'item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.String(200), nullable=True)
+    price = db.Column(db.Float, nullable=False)
+    image_file = db.Column(db.String(20), nullable=False, default='shirt.jpg')
+    item_type_id = db.Column(db.Integer, db.ForeignKey('item_type.id'))
+    defined_item = db.relationship(
+        "Defined_Items", backref=backref('item', remote_side=[id]), lazy=True)
+    reviews = db.relationship("Reviews", backref="item")
+    rating = db.relationship("Item_Rating", uselist=False, lazy=True)
+
+    __table_args__ = (db.Index('ix_item_item_type_id', 'item_type_id'),)
+
+
+class Item_Type(db.Model):
+    __tablename__ = 'item_type'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    item = db.relationship("Item", backref=backref(
+        'item_type', remote_side=[id]), lazy=True)
+
+    def __repr__(self):
+        return f"('{self.name}')"
+
+
+class Sizes(db.Model):
+    __tablename__ = 'sizes'
+    id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.String(10), nullable=False)
+    value = db.Column(db.String(10), nullable=False)
+
+
+class Stock(db.Model):
+    # Units left per item and size (a Sizes.size value); pairs without a row
+    # aren't tracked. Taken and given back by inventory (stock.py).
+    __tablename__ = 'stock'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    size = db.Column(db.String(10), primary_key=True)
+    available = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.CheckConstraint('available >= 0', name='ck_stock_available'),)
+
+
+class Stock_Reservation(db.Model):
+    # Stock an unpaid order has taken, until it is paid or released.
+    __tablename__ = 'stock_reservation'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    created = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_stock_reservation_order_id', 'order_id'),
+        db.Index('ix_stock_reservation_created', 'created'),
+    )
+
+
+class Reviews(db.Model):
+    __tablename__ = 'reviews'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
+    comment = db.Column(db.Text, nullable=False)
+    rating = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_reviews_item_id_date', 'item_id', 'date'),
+        db.Index('ix_reviews_user_id', 'user_id'),
+    )
+
+
+class Item_Rating(db.Model):
+    # Running review aggregates per item, kept up to date by create_review.
+    __tablename__ = 'item_rating'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'histogram': {str(stars): getattr(self, 'stars_%d' % stars) for stars in range(1, 6)},
+        }
+
+
+EMPTY_HISTOGRAM = {'stars_%d' % stars: 0 for stars in range(1, 6)}
+
+
+class Job(db.Model):
+    # Background work run by job_queue; payload and result are JSON.
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    progress = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    created = db.Column(db.DateTime, nullable=False)
+    updated = db.Column(db.DateTime, nullable=False)
+    # Who asked for it, the one user besides admins who may see its status.
+    user_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (db.Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+
+
+class Refresh_Token(db.Model):
+    # One row per refresh token that still works. Using a token deletes its
+    # row (the client gets a new token), and so does a password change.
+    __tablename__ = 'refresh_tokens'
+    jti = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    expires = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index('ix_refresh_tokens_user_id', 'user_id'),)
+
+
+class Change_Log(db.Model):
+    # Which synced rows changed, oldest first; written by change_log, read by /api/sync.
+    __tablename__ = 'change_log'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    changed = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_change_log_entity', 'entity', 'entity_id', 'id'),
+        db.Index('ix_change_log_changed', 'changed'),
+        # Ids are cursors, so SQLite must not hand out an emptied log's ids again.
+        {'sqlite_autoincrement': True},
+    )
+
+
+class Change_Log_Horizon(db.Model):
+    # The highest change_log id compaction has expired; older cursors need a full resync.
+    __tablename__ = 'change_log_horizon'
+    id = db.Column(db.Integer, primary_key=True)
+    cursor = db.Column(db.BigInteger, nullable=False)
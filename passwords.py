@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as PoolTimeout
+from werkzeug.security import check_password_hash
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+
+SCRYPT_PREFIX = 'scrypt'
+
+
+class HasherBusy(Exception):
+    """Raised when the key-derivation pool is full; the caller should retry later."""
+
+
+class PasswordHasher:
+    """scrypt password hashing run on a small, bounded thread pool.
+
+    Hashes are stored as ``scrypt:n:r:p$salt$hash``. Werkzeug hashes written
+    before the switch (``sha256$...``, ``pbkdf2:...``) still verify, and
+    ``needs_rehash`` tells the caller to replace them after a successful
+    login. At most ``workers`` derivations run at once and at most
+    ``queue_size`` more wait; past that callers get HasherBusy immediately
+    instead of tying up a web worker, and so does a caller that waited
+    ``timeout`` seconds without getting a result.
+
+    The pool is per process, so with sync gunicorn workers (one request at a
+    time each) it never fills up. ``host_slots`` caps the hashes in flight
+    across every worker forked from the process that called ``configure``
+    (the master, with ``gunicorn --preload``); a worker that finds them all
+    taken answers busy at once rather than blocking. Workers that build the
+    app themselves each get their own cap.
+    """
+
+    def __init__(self, n=2 ** 14, r=8, p=1, workers=2, queue_size=16, timeout=10, host_slots=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure(n, r, p, workers, queue_size, timeout, host_slots)
+
+    def configure(self, n, r, p, workers, queue_size, timeout=10, host_slots=None):
+        """Sets the cost parameters and pool size; call before the first hash and before forking."""
+        self.n = n
+        self.r = r
+        self.p = p
+        self.timeout = timeout
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # A fork-context semaphore lives in shared memory, so forked workers
+        # all count against the same one.
+        self._host_slots = multiprocessing.get_context('fork').BoundedSemaphore(host_slots) \
+            if host_slots else None
+
+    @property
+    def prefix(self):
+        return '%s:%d:%d:%d' % (SCRYPT_PREFIX, self.n, self.r, self.p)
+
+    def hash(self, password):
+        return self._run(self._hash, password)
+
+    def verify(self, stored, password):
+        return self._run(self._verify, stored, password)
+
+    def needs_rehash(self, stored):
+        return not stored.startswith(self.prefix + '$')
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        if self._host_slots is not None and not self._host_slots.acquire(block=False):
+            self._slots.release()
+            raise HasherBusy()
+
+        try:
+            future = self._pool().submit(function, *args)
+        except BaseException:
+            self._release()
+            raise
+
+        # The slots are held until the work is done or cancelled, not just
+        # while someone waits for it.
+        future.add_done_callback(lambda future: self._release())
+        try:
+            return future.result(self.timeout)
+        except PoolTimeout:
+            # Still queued: give up its place. One already running finishes
+            # in the background and frees its slot then.
+            future.cancel()
+            raise HasherBusy()
+
+    def _release(self):
+        if self._host_slots is not None:
+            self._host_slots.release()
+        self._slots.release()
+
+    def _pool(self):
+        # Created on first use so that forked gunicorn workers each start
+        # their own threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='kdf')
+            return self._executor
+
+    def _hash(self, password):
+        salt = os.urandom(16)
+        key = derive(password, salt, self.n, self.r, self.p)
+        return '%s$%s$%s' % (self.prefix, encode(salt), encode(key))
+
+    @staticmethod
+    def _verify(stored, password):
+        if not stored.startswith(SCRYPT_PREFIX + ':'):
+            return check_password_hash(stored, password)
+
+        try:
+            method, salt, key = stored.split('$')
+            n, r, p = (int(value) for value in method.split(':')[1:])
+            expected = derive(password, decode(salt), n, r, p)
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected, decode(key))
+
+
+def derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
+
+
+def encode(value):
+    return base64.b64encode(value).decode('ascii')
+
+
+def decode(value):
+    return base64.b64decode(value.encode('ascii'))
@@ -0,0 +1,4 @@
+"""The API's blueprints, registered by create_app in this order."""
+from routes import images, cart, orders, products, users, reviews, jobs, sync, catalog
+
+BLUEPRINTS = (images.bp, cart.bp, orders.bp, products.bp, users.bp, reviews.bp, jobs.bp, sync.bp, catalog.bp)
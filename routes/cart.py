@@ -0,0 +1,182 @@
+"""Cart routes: defined items, cart lines and batched cart updates."""
+from flask import Blueprint, jsonify, request
+
+from api import token_required, stream_mode, stream_response, cart_items_query, defined_items_query
+from models import db, Item, Defined_Items, Cart_Items
+from schemas import schema_for, DefinedItemSchema, CartItemSchema
+
+bp = Blueprint('cart', __name__, cli_group=None)
+
+
+@bp.route('/api/user/defined_items', methods=['GET'])
+def get_user_defined_items():
+
+    try:
+        mode = stream_mode()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if mode:
+        return stream_response(defined_items_query().order_by(Defined_Items.id),
+                               schema_for(DefinedItemSchema), mode), 200
+
+    result = defined_items_query().all()
+
+    schema = schema_for(DefinedItemSchema, many=True)
+    output = schema.dump(result)
+
+    return jsonify(output), 200
+
+
+@bp.route('/api/user/cart_items', methods=['GET'])
+@token_required
+def get_user_cart_items(current_user):
+
+    result = cart_items_query(current_user.cart_id).all()
+
+    schema = schema_for(CartItemSchema, many=True, exclude=('cart',))
+    output = schema.dump(result)
+
+    return jsonify(output), 200
+
+
+@bp.route('/api/user/add/cart_items/<int:item_id>', methods=['POST'])
+@token_required
+def add_item_to_cart(current_user, item_id):
+
+    item = Item.query.filter_by(id=item_id).first()
+    data = request.get_json()
+    defined_item = Defined_Items(
+        item_id=item.id, size=data['size'], amount=data['amount'], cart_item_id=current_user.cart_id)
+    db.session.add(defined_item)
+    db.session.commit()
+
+    return jsonify({"message": "Item was added to cart!"}), 200
+
+
+@bp.route('/test', methods=['DELETE'])
+def test():
+
+    data = request.get_json()
+
+    return jsonify({"message": data["items"]}), 200
+
+
+@bp.route('/api/user/delete_cart_item', methods=['DELETE'])
+@token_required
+def delete_user_cart_item(current_user):
+
+    data = request.get_json()
+    id = data["item_id"]
+
+    result = Cart_Items.query.filter_by(
+        cart_id=current_user.cart_id, id=id).first()
+
+    if result:
+        db.session.delete(result)
+        db.session.commit()
+        return jsonify({"message": "Items has been removed from cart!"}), 200
+    else:
+        return jsonify({"message": "Item not found!"}), 404
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# What each operation key must hold; ids end up as dict keys and sizes in a String(10) column.
+OPERATION_CHECKS = {
+    "id": is_integer,
+    "item_id": is_integer,
+    "size": lambda value: isinstance(value, str) and 0 < len(value) <= Defined_Items.size.type.length,
+    "amount": is_integer,
+}
+
+
+def parse_cart_operations(data):
+    """Validates a batch body; returns its operations or raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Body must be a JSON object!")
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list!")
+
+    for index, operation in enumerate(operations):
+        op = operation.get("op") if isinstance(operation, dict) else None
+        if op == "add":
+            required = ("item_id", "size", "amount")
+        elif op == "update":
+            required = ("id", "amount")
+        elif op == "remove":
+            required = ("id",)
+        else:
+            raise ValueError("Operation %d: unknown op!" % index)
+
+        missing = [key for key in required if operation.get(key) is None]
+        if missing:
+            raise ValueError("Operation %d: missing %s!" % (index, ", ".join(missing)))
+
+        invalid = [key for key in required if not OPERATION_CHECKS[key](operation[key])]
+        if op == "add" and "amount" not in invalid and operation["amount"] <= 0:
+            invalid.append("amount")
+        if invalid:
+            raise ValueError("Operation %d: invalid %s!" % (index, ", ".join(invalid)))
+
+    return operations
+
+
+@bp.route('/api/user/cart_items/batch', methods=['POST'])
+@token_required
+def batch_update_cart(current_user):
+
+    try:
+        operations = parse_cart_operations(request.get_json())
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # The whole cart in one query; every operation below works on it in
+    # memory and is written by the single commit at the end.
+    cart_items = cart_items_query(current_user.cart_id).all()
+    by_id = {cart_item.id: cart_item for cart_item in cart_items}
+    by_line = {(cart_item.defined_item.item_id, cart_item.defined_item.size): cart_item
+               for cart_item in cart_items if cart_item.defined_item}
+
+    item_ids = {operation["item_id"] for operation in operations if operation["op"] == "add"}
+    known_items = {item_id for item_id, in db.session.query(Item.id).filter(Item.id.in_(item_ids))}
+    if item_ids - known_items:
+        return jsonify({"message": "Item not found!"}), 404
+
+    with db.session.no_autoflush:
+        for operation in operations:
+            if operation["op"] == "add":
+                line = (operation["item_id"], operation["size"])
+                cart_item = by_line.get(line)
+                if cart_item is not None:
+                    cart_item.defined_item.amount += operation["amount"]
+                    continue
+
+                cart_item = Cart_Items(cart_id=current_user.cart_id, defined_item=Defined_Items(
+                    item_id=operation["item_id"], size=operation["size"], amount=operation["amount"]))
+                db.session.add(cart_item)
+                by_line[line] = cart_item
+                continue
+
+            cart_item = by_id.get(operation["id"])
+            if cart_item is None or cart_item in db.session.deleted:
+                db.session.rollback()
+                return jsonify({"message": "Item not found!"}), 404
+
+            if operation["op"] == "update" and operation["amount"] > 0:
+                cart_item.defined_item.amount = operation["amount"]
+            else:
+                db.session.delete(cart_item)
+                by_line.pop((cart_item.defined_item.item_id, cart_item.defined_item.size), None)
+
+    db.session.commit()
+
+    result = cart_items_query(current_user.cart_id).all()
+
+    schema = schema_for(CartItemSchema, many=True, exclude=('cart',))
+    output = schema.dump(result)
+
+    return jsonify(output), 200
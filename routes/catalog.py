@@ -0,0 +1,104 @@
+"""Catalog import/export: bulk CSV and NDJSON for admins, over HTTP and as commands."""
+from flask import Blueprint, current_app, jsonify, request, stream_with_context
+import click
+import io
+import os
+
+from api import admin_required, read_only, catalog_io
+from catalog_io import FORMATS
+
+bp = Blueprint('catalog', __name__, cli_group=None)
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def request_format():
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = {mimetype: fmt for fmt, mimetype in MIMETYPES.items()}.get(request.mimetype, 'ndjson')
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format: ' + fmt)
+    return fmt
+
+
+@bp.route('/api/catalog/<string:entity>', methods=['POST'])
+@admin_required
+def import_catalog(current_user, entity):
+    # For files too big for one request, use `python manage.py import-catalog`.
+    if entity not in catalog_io.entities:
+        return jsonify({'message': 'Unknown entity!'}), 404
+    try:
+        fmt = request_format()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        report = catalog_io.import_stream(entity, stream, fmt)
+    except UnicodeDecodeError:
+        return jsonify({'message': 'Body is not UTF-8!'}), 400
+
+    return jsonify(report.as_dict()), 200
+
+
+@bp.route('/api/catalog/<string:entity>', methods=['GET'])
+@admin_required
+@read_only
+def export_catalog(current_user, entity):
+    if entity not in catalog_io.entities:
+        return jsonify({'message': 'Unknown entity!'}), 404
+    try:
+        fmt = request_format()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    response = current_app.response_class(stream_with_context(catalog_io.export(entity, fmt)),
+                                          mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (entity, fmt)
+    return response, 200
+
+
+def file_format(path, fmt):
+    if fmt is None:
+        fmt = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise click.BadParameter("can't tell the format of %s; pass --format" % path)
+    return fmt
+
+
+@bp.cli.command('import-catalog')
+@click.argument('entity', type=click.Choice(sorted(catalog_io.entities)))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="default: from the file extension")
+def import_catalog_command(entity, path, fmt):
+    """Upsert a CSV or NDJSON file (- for stdin) into a catalog table, by id."""
+    if path == '-':
+        report = catalog_io.import_stream(entity, click.get_text_stream('stdin'), fmt or 'ndjson')
+    else:
+        with open(path, encoding='utf-8', newline='') as stream:
+            report = catalog_io.import_stream(entity, stream, file_format(path, fmt))
+
+    for line, message in sorted(report.errors):
+        click.echo("line %d: %s" % (line, message), err=True)
+    click.echo("%s: %d inserted, %d updated, %d rows skipped." % (
+        entity, report.inserted, report.updated, report.error_count))
+    if report.error_count:
+        raise click.exceptions.Exit(1)
+
+
+@bp.cli.command('export-catalog')
+@click.argument('entity', type=click.Choice(sorted(catalog_io.entities)))
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="default: from the file extension, else csv")
+def export_catalog_command(entity, path, fmt):
+    """Write a catalog table as CSV or NDJSON to a file (- for stdout)."""
+    if path == '-':
+        for chunk in catalog_io.export(entity, fmt or 'csv'):
+            click.get_text_stream('stdout').write(chunk)
+        return
+
+    fmt = file_format(path, fmt)
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        for chunk in catalog_io.export(entity, fmt):
+            output.write(chunk)
@@ -0,0 +1,46 @@
+"""Image routes: resized, re-encoded product images and the warm-images command."""
+from flask import Blueprint, current_app, jsonify, request, send_file
+import click
+
+import images
+
+bp = Blueprint('images', __name__, cli_group=None)
+
+
+@bp.route('/image', methods=['GET'])
+def get_image():
+
+    name = request.args.get('name', None)
+    photo = request.args.get('photo', default="grey.jpg")
+    width = request.args.get('w', type=int)
+    fmt = request.args.get('format')
+
+    if width is not None and width not in current_app.config['IMAGE_WIDTHS']:
+        return jsonify({'message': 'Unsupported width!'}), 400
+    if fmt is not None and fmt not in images.FORMATS:
+        return jsonify({'message': 'Unsupported format!'}), 400
+
+    try:
+        path, mimetype = images.get_image(
+            current_app.config['IMAGE_ROOT'], current_app.config['IMAGE_CACHE_DIR'], name, photo,
+            width, fmt, current_app.config['IMAGE_QUALITY'])
+    except images.ImageNotFound:
+        return jsonify({'message': 'Image not found!'}), 404
+    except images.ResizeUnavailable:
+        return jsonify({'message': 'Image resizing is not available!'}), 501
+
+    # conditional=True gives ETag, If-None-Match and Range handling.
+    return send_file(path, mimetype=mimetype, conditional=True,
+                     cache_timeout=current_app.config['IMAGE_MAX_AGE'])
+
+
+@bp.cli.command('warm-images')
+@click.option('--width', '-w', type=int, multiple=True, help='Widths to render.')
+@click.option('--format', '-f', 'formats', multiple=True, type=click.Choice(list(images.FORMATS)))
+def warm_images(width, formats):
+    """Pre-render image variants for everything under img/."""
+    rendered = images.warm(
+        current_app.config['IMAGE_ROOT'], current_app.config['IMAGE_CACHE_DIR'],
+        width or current_app.config['IMAGE_WIDTHS'], formats or current_app.config['IMAGE_FORMATS'],
+        current_app.config['IMAGE_QUALITY'])
+    click.echo("%d image variants ready." % rendered)
@@ -0,0 +1,34 @@
+"""Job routes: background job status and the run-jobs command."""
+from flask import Blueprint, current_app, jsonify
+import click
+
+from api import token_required, job_queue
+from models import Job
+from schemas import schema_for, JobSchema
+
+bp = Blueprint('jobs', __name__, cli_group=None)
+
+
+@bp.route('/api/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def get_job(current_user, job_id):
+    result = Job.query.get(job_id)
+
+    # Someone else's job reads as missing rather than forbidden.
+    if result and (current_user.is_admin or result.user_id == current_user.id):
+        schema = schema_for(JobSchema)
+        output = schema.dump(result)
+
+        return jsonify(output), 200
+    else:
+        return jsonify({'message': 'Job not found!'}), 404
+
+
+@bp.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help="Run what is due and exit.")
+def run_jobs(once):
+    """Run background jobs in the foreground."""
+    if once:
+        click.echo("Ran %d jobs." % job_queue.run_pending())
+    else:
+        job_queue.run_forever(current_app._get_current_object())
@@ -0,0 +1,356 @@
+"""Order routes: checkout, payment, order history, archiving and bulk deletion."""
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import func, cast, and_, Integer
+from datetime import timedelta
+import click
+import heapq
+
+from api import token_required, admin_required, read_only, job_queue, job_accepted, change_log, inventory, \
+    order_archive, orders_query, parse_fields, load_fields, is_paginated, page_limit, encode_cursor, decode_cursor, \
+    keyset_after, page_response, stream_mode, stream_rows, not_modified, tag_response, list_etag
+from models import db, Orders, Order_Items, Cart_Items, Defined_Items, Item, Order_Archive, Change_Log
+from schemas import schema_for, OrdersSchema
+from stock import OutOfStock
+from sync import UPSERT, DELETE
+
+bp = Blueprint('orders', __name__, cli_group=None)
+
+
+@bp.route('/api/user/complete_order/<int:order_id>', methods=['PUT'])
+@token_required
+def complete_payment(current_user, order_id):
+
+    # Conditional, so a repeated call neither fails nor runs the hooks twice.
+    paid = Orders.query.filter_by(user_id=current_user.id, id=order_id, paid=False).update(
+        {'paid': True}, synchronize_session=False)
+
+    if paid:
+        try:
+            inventory.confirm(order_id, order_lines(order_id))
+        except OutOfStock as e:
+            db.session.rollback()
+            return out_of_stock(e)
+
+        change_log.record('order', UPSERT, [(order_id, current_user.id)])
+        job_queue.enqueue('order_paid', {'order_id': order_id}, user_id=current_user.id)
+        db.session.commit()
+    elif not Orders.query.filter_by(user_id=current_user.id, id=order_id).first():
+        return jsonify({"message": "Order does not exist!"}), 400
+
+    return jsonify({"message": "Payment was completed!"}), 200
+
+
+def order_lines(order_id):
+    return db.session.query(Defined_Items.item_id, Defined_Items.size, Defined_Items.amount).join(
+        Order_Items, Order_Items.defined_item_id == Defined_Items.id).filter(Order_Items.order_id == order_id)
+
+
+def out_of_stock(e):
+    return jsonify({"message": "Not enough stock!",
+                    "items": [{'item_id': item_id, 'size': size} for item_id, size in e.lines]}), 409
+
+
+# Post-payment side effects, run by the order_paid job after the response
+# has gone out. A job can be retried, so hooks must be safe to run twice.
+ORDER_PAID_HOOKS = []
+
+
+def order_paid_hook(f):
+    ORDER_PAID_HOOKS.append(f)
+    return f
+
+
+@order_paid_hook
+def log_payment(order):
+    current_app.logger.info("Order %d paid by user %d: %.2f", order.id, order.user_id, order.price or 0)
+
+
+@job_queue.task('order_paid', max_attempts=5)
+def run_order_paid_hooks(job):
+    order = Orders.query.get(job.payload['order_id'])
+    if order is None:
+        return {'skipped': 'order was deleted'}
+
+    for hook in ORDER_PAID_HOOKS:
+        hook(order)
+    return {'hooks': [hook.__name__ for hook in ORDER_PAID_HOOKS]}
+
+
+@bp.route('/api/user/orders', methods=['GET'])
+@token_required
+@read_only
+def get_user_orders(current_user):
+
+    try:
+        fields = parse_fields(OrdersSchema)
+        mode = stream_mode()
+        etag = list_etag(history_version(current_user.id), fields, mode)
+        response = not_modified(etag)
+        if response:
+            return response
+
+        query = load_fields(orders_query().filter_by(user_id=current_user.id), Orders, fields,
+                            keys=[Orders.date]).order_by(Orders.date.desc(), Orders.id.desc())
+        schema = schema_for(OrdersSchema, only=fields)
+
+        def dump(row):
+            # Live rows may be ORM objects or plain rows (?fields=); only
+            # archived ones carry the time they were archived.
+            return order_archive.dump(row, fields) if getattr(row, 'archived', None) else schema.dump(row)
+
+        if mode:
+            batch_size = current_app.config['STREAM_BATCH_SIZE']
+            rows = heapq.merge(query.yield_per(batch_size), order_archive.query(current_user.id).yield_per(batch_size),
+                               key=history_key, reverse=True)
+            return tag_response(stream_rows(rows, dump, mode), etag), 200
+
+        result, next_cursor = fetch_history_page(query, current_user.id)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    output = [dump(row) for row in result]
+
+    return tag_response(page_response(output, next_cursor), etag), 200
+
+
+def history_version(user_id):
+    # Everything the history shows, in one aggregate query run before any
+    # row is loaded: the user's orders (added, paid, archived or deleted, and
+    # any logged change to one, its lines included) and the catalog data
+    # nested in them, which changes without them: their items (logged, along
+    # with item type renames) and the defined items listed under each item.
+    order_ids = db.session.query(Orders.id).filter(Orders.user_id == user_id)
+    item_ids = db.session.query(Defined_Items.item_id).join(
+        Order_Items, Order_Items.defined_item_id == Defined_Items.id).filter(Order_Items.order_id.in_(order_ids))
+    archived = db.session.query(Order_Archive.id).filter(Order_Archive.user_id == user_id)
+    changes = db.session.query(func.max(Change_Log.id))
+    listed = db.session.query(Defined_Items.id).filter(Defined_Items.item_id.in_(item_ids))
+
+    values = db.session.query(
+        func.count(Orders.id), func.max(Orders.id), func.sum(cast(Orders.paid, Integer)),
+        archived.with_entities(func.count(Order_Archive.id)).as_scalar(),
+        archived.with_entities(func.max(Order_Archive.id)).as_scalar(),
+        changes.filter(Change_Log.entity == 'order', Change_Log.entity_id.in_(order_ids)).as_scalar(),
+        changes.filter(Change_Log.entity == 'item', Change_Log.entity_id.in_(item_ids)).as_scalar(),
+        listed.with_entities(func.count(Defined_Items.id)).as_scalar(),
+        listed.with_entities(func.max(Defined_Items.id)).as_scalar()).filter(Orders.user_id == user_id).one()
+    return "orders-%d-%s" % (user_id, "-".join(str(value or 0) for value in values))
+
+
+def history_key(row):
+    return row.date, row.id
+
+
+def fetch_history_page(query, user_id):
+    # Live orders newest first, merged with archived summaries by (date, id).
+    # The archive is only read for the stretch the page covers: after the
+    # cursor and, once the live orders fill the page, no older than the
+    # last of them. Its month filter keeps other months' rows out of the read.
+    if not is_paginated():
+        return list(heapq.merge(query.all(), order_archive.query(user_id).all(),
+                                key=history_key, reverse=True)), None
+
+    limit = page_limit()
+    columns = [Orders.date, Orders.id]
+    cursor = request.args.get('cursor')
+    before = decode_cursor(cursor, columns) if cursor else None
+    if before is not None:
+        query = query.filter(keyset_after(columns, before, True))
+
+    live = query.limit(limit + 1).all()
+    oldest = history_key(live[limit - 1]) if len(live) > limit else None
+    archived = order_archive.query(user_id, before=before, after=oldest).limit(limit + 1).all()
+
+    rows = list(heapq.merge(live, archived, key=history_key, reverse=True))
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(list(history_key(rows[-1])))
+
+
+@bp.route('/api/user/delete_order', methods=['DELETE'])
+@token_required
+def delete_user_order(current_user):
+
+    data = request.get_json()
+    item_id = data["item_id"]
+
+    result = Orders.query.filter_by(
+        user_id=current_user.id, id=item_id).first()
+
+    if result:
+
+        inventory.release([result.id])
+        db.session.delete(result)
+        db.session.commit()
+        return jsonify({"message": "Order has been removed!"}), 200
+    elif order_archive.delete(and_(Order_Archive.user_id == current_user.id, Order_Archive.id == item_id)):
+        db.session.commit()
+        return jsonify({"message": "Order has been removed!"}), 200
+    else:
+        return jsonify({"message": "Order does not exist!"}), 400
+
+
+@bp.route('/api/delete_orders', methods=['DELETE'])
+@admin_required
+def delete_orders(current_user):
+    # Orders placed after the request are left alone.
+    last_id = db.session.query(func.max(Orders.id)).scalar() or 0
+    job = job_queue.enqueue('delete_orders', {'last_id': last_id}, user_id=current_user.id)
+    db.session.commit()
+
+    return job_accepted("Orders are being removed!", job), 202
+
+
+@job_queue.task('delete_orders')
+def delete_orders_job(job):
+    last_id = job.payload['last_id']
+    batch_size = current_app.config['DELETE_BATCH_SIZE']
+    archived = db.session.query(func.count(Order_Archive.id)).scalar()
+    total = db.session.query(func.count(Orders.id)).filter(Orders.id <= last_id).scalar() + archived
+    done = 0
+
+    # One DELETE per table per batch, each batch its own transaction, so a
+    # retry carries on from whatever is left.
+    while True:
+        rows = db.session.query(Orders.id, Orders.user_id).filter(
+            Orders.id <= last_id).order_by(Orders.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        ids = [order_id for order_id, _ in rows]
+        inventory.release(ids)
+        Order_Items.query.filter(Order_Items.order_id.in_(ids)).delete(synchronize_session=False)
+        Orders.query.filter(Orders.id.in_(ids)).delete(synchronize_session=False)
+        change_log.record('order', DELETE, rows)
+        done += len(ids)
+        job.progress(done, total)
+
+    # Every archived order was placed before the request, whatever its id:
+    # the live ids may all be lower, or reused after archiving on SQLite.
+    done += order_archive.delete()
+    job.progress(done, total)
+    return {'deleted': done}
+
+
+@bp.route('/api/user/create_order', methods=['POST'])
+@token_required
+def create_user_order(current_user):
+
+    # Every cart line with its unit price in one joined query, then a single
+    # flush for the order, one executemany for its lines and one DELETE to
+    # empty the cart, all in the same transaction.
+    lines = db.session.query(Cart_Items.defined_item_id, Defined_Items.amount, Item.price,
+                             Cart_Items.id, Defined_Items.item_id, Defined_Items.size).join(
+        Defined_Items, Cart_Items.defined_item_id == Defined_Items.id).join(
+        Item, Defined_Items.item_id == Item.id).filter(
+        Cart_Items.cart_id == current_user.cart_id).all()
+
+    new_order = Orders(paid=False, user_id=current_user.id,
+                       price=sum(line.price * line.amount for line in lines))
+    db.session.add(new_order)
+    db.session.flush()
+
+    try:
+        reserved = inventory.reserve([(line.item_id, line.size, line.amount) for line in lines], new_order.id)
+    except OutOfStock as e:
+        db.session.rollback()
+        return out_of_stock(e)
+    if reserved:
+        job_queue.enqueue('release_stock', {'order_id': new_order.id},
+                          delay=inventory.hold.total_seconds(), user_id=current_user.id)
+
+    db.session.bulk_insert_mappings(Order_Items, [
+        {'order_id': new_order.id, 'defined_item_id': line.defined_item_id} for line in lines])
+    Cart_Items.query.filter_by(cart_id=current_user.cart_id).delete(synchronize_session=False)
+    change_log.record('cart_item', DELETE, [(line.id, current_user.id) for line in lines])
+    db.session.commit()
+
+    result = orders_query().filter_by(id=new_order.id).first()
+
+    schema = schema_for(OrdersSchema)
+    output = schema.dump(result)
+
+    return jsonify(output), 200
+
+
+@job_queue.task('release_stock')
+def release_stock_job(job):
+    # Queued at checkout to run once the hold is up; a paid order has
+    # nothing left to release.
+    return {'released': inventory.release([job.payload['order_id']])}
+
+
+@bp.cli.command('set-stock')
+@click.argument('item_id', type=int)
+@click.argument('size')
+@click.argument('available', type=int, required=False)
+def set_stock(item_id, size, available):
+    """Set the units left of an item in a size; leave out AVAILABLE to stop tracking it."""
+    inventory.set(item_id, size, available)
+    click.echo("Stock of item %d in %s: %s" % (item_id, size, "untracked" if available is None else available))
+
+
+@bp.cli.command('release-stock')
+def release_stock():
+    """Give back the stock of orders left unpaid past the hold, for jobs that never ran."""
+    click.echo("Released %d reservations." % inventory.release(expired=True))
+
+
+def order_summaries(order_ids):
+    """Archive summaries of the given orders, lines in the order they were added."""
+    summaries = {order_id: {'id': order_id, 'user_id': user_id, 'date': date, 'price': price,
+                            'line_count': 0, 'lines': []}
+                 for order_id, user_id, date, price in db.session.query(
+                     Orders.id, Orders.user_id, Orders.date, Orders.price).filter(Orders.id.in_(order_ids))}
+
+    lines = db.session.query(Order_Items.order_id, Defined_Items.id, Defined_Items.item_id, Item.name,
+                             Defined_Items.size, Defined_Items.amount, Item.price).join(
+        Defined_Items, Order_Items.defined_item_id == Defined_Items.id).outerjoin(
+        Item, Defined_Items.item_id == Item.id).filter(
+        Order_Items.order_id.in_(order_ids)).order_by(Order_Items.id)
+    for order_id, defined_item_id, item_id, name, size, amount, price in lines:
+        summary = summaries[order_id]
+        summary['line_count'] += 1
+        summary['lines'].append({'defined_item_id': defined_item_id, 'item_id': item_id, 'name': name,
+                                 'size': size, 'amount': amount, 'price': price})
+    return list(summaries.values())
+
+
+def archive_orders(batch_size):
+    """Moves paid orders older than the archive cutoff into order_archive,
+    one transaction per batch; returns how many it moved."""
+    cutoff = order_archive.cutoff()
+    last_id = moved = 0
+
+    # Walks the table once by id, so each batch starts where the last one
+    # stopped instead of rescanning the orders it skipped.
+    while True:
+        rows = db.session.query(Orders.id, Orders.paid, Orders.date).filter(
+            Orders.id > last_id).order_by(Orders.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        # No change log entries: the orders stay in the client's history,
+        # only now served from the archive.
+        ids = [order_id for order_id, paid, date in rows if paid and date < cutoff]
+        if ids:
+            order_archive.store(order_summaries(ids))
+            Order_Items.query.filter(Order_Items.order_id.in_(ids)).delete(synchronize_session=False)
+            Orders.query.filter(Orders.id.in_(ids)).delete(synchronize_session=False)
+            moved += len(ids)
+        db.session.commit()
+
+    return moved
+
+
+@bp.cli.command('archive-orders')
+@click.option('--days', type=int, default=None, help="archive paid orders older than this (default ORDER_ARCHIVE_AFTER_DAYS)")
+def archive_orders_command(days):
+    """Move old paid orders into the order archive; run it daily from a scheduler."""
+    if days is not None:
+        order_archive.after = timedelta(days=days)
+    moved = archive_orders(current_app.config['ORDER_ARCHIVE_BATCH_SIZE'])
+    click.echo("Archived %d orders." % moved)
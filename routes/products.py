@@ -0,0 +1,154 @@
+"""Product routes: the catalog, single products and search."""
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func
+
+from api import token_required, read_only, catalog_cache, catalog_query, search_index, json_bytes, \
+    content_etag, cached_json_response, parse_fields, load_fields, fetch_page, page_response, page_limit, \
+    encode_cursor, decode_cursor, stream_mode, stream_response
+from models import db, Item, Item_Type, Defined_Items, Cart_Items
+from schemas import schema_for, ProductSchema
+from search import SORTS
+import compression
+
+bp = Blueprint('products', __name__, cli_group=None)
+
+
+@bp.route('/api/products', methods=['GET'])
+@read_only(catalog=True)
+def get_all_products():
+    if request.args:
+        return get_products_page()
+
+    key = catalog_cache.key('products')
+    entry = catalog_cache.get(key)
+
+    if entry is None:
+        result = catalog_query().all()
+
+        schema = schema_for(ProductSchema, many=True)
+        body = json_bytes(schema.dump(result))
+        entry = compression.CachedBody(body, content_etag(body))
+        catalog_cache.set(key, entry)
+
+    return cached_json_response(entry)
+
+
+def get_products_page():
+    try:
+        fields = parse_fields(ProductSchema)
+        mode = stream_mode()
+        query = load_fields(catalog_query(fields), Item, fields)
+
+        if mode:
+            return stream_response(query.order_by(Item.id), schema_for(ProductSchema, only=fields), mode), 200
+
+        result, next_cursor = fetch_page(query, [Item.id])
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    schema = schema_for(ProductSchema, many=True, only=fields)
+    output = schema.dump(result)
+
+    return page_response(output, next_cursor), 200
+
+
+@bp.route('/api/product/addtocart', methods=['POST'])
+@token_required
+def add_to_cart(current_user):
+
+    data = request.get_json()
+    item_id = data["item_id"]
+    size = data["selectedSize"]
+    amount = data["selectedAmount"]
+
+    if item_id is not None or size is not None or amount is None:
+
+        def_item = Defined_Items(
+            item_id=item_id, size=size, amount=int(amount))
+        new_cart_item = Cart_Items(
+            cart_id=current_user.cart_id, defined_item=def_item)
+        db.session.add(new_cart_item)
+        db.session.commit()
+
+        return jsonify({"message": "Item has been added to the cart!"}), 200
+    else:
+        return jsonify({"message": "Error!"}), 400
+
+
+@bp.route('/api/product/<int:item_id>', methods=['GET'])
+@read_only(catalog=True)
+def get_product(item_id):
+    key = catalog_cache.key('product', item_id)
+    entry = catalog_cache.get(key)
+
+    if entry is None:
+        result = catalog_query().filter_by(id=item_id).first()
+
+        if not result:
+            return jsonify({'message': 'Item not found!'}), 404
+
+        schema = schema_for(ProductSchema)
+        body = json_bytes(schema.dump(result))
+        entry = compression.CachedBody(body, content_etag(body))
+        catalog_cache.set(key, entry)
+
+    return cached_json_response(entry)
+
+
+@bp.route('/api/products/cache', methods=['GET'])
+def get_catalog_cache_stats():
+    return jsonify(catalog_cache.stats()), 200
+
+
+# --- Search ---------------------------------------------------------------------------------
+
+def parse_list(name):
+    values = [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+    return values or None
+
+
+def parse_item_types():
+    # ?type= takes item type ids or names.
+    values = parse_list('type')
+    if values is None:
+        return None
+
+    type_ids = {int(value) for value in values if value.isdigit()}
+    names = [value.lower() for value in values if not value.isdigit()]
+    if names:
+        type_ids.update(type_id for type_id, in db.session.query(Item_Type.id).filter(
+            func.lower(Item_Type.name).in_(names)))
+    return type_ids
+
+
+@bp.route('/api/products/search', methods=['GET'])
+@read_only(catalog=True)
+def search_products():
+    try:
+        fields = parse_fields(ProductSchema)
+        query = request.args.get('q')
+        sort = request.args.get('sort', 'relevance' if query else 'id')
+        if sort not in SORTS:
+            raise ValueError('Unknown sort: ' + sort)
+
+        cursor = request.args.get('cursor')
+        item_ids, next_key, total = search_index.search(
+            query=query, type_ids=parse_item_types(), sizes=parse_list('size'),
+            min_price=request.args.get('min_price', type=float),
+            max_price=request.args.get('max_price', type=float),
+            sort=sort, after=decode_cursor(cursor) if cursor else None, limit=page_limit())
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    result = []
+    if item_ids:
+        query = load_fields(catalog_query(fields), Item, fields, keys=[Item.id])
+        items = {item.id: item for item in query.filter(Item.id.in_(item_ids))}
+        result = [items[item_id] for item_id in item_ids if item_id in items]
+
+    schema = schema_for(ProductSchema, many=True, only=fields)
+    output = schema.dump(result)
+
+    response = page_response(output, next_key and encode_cursor(next_key))
+    response.headers['X-Total-Count'] = str(total)
+    return response, 200
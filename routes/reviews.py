@@ -0,0 +1,141 @@
+"""Review routes: listings, rating summaries and new reviews."""
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func, case, inspect
+from sqlalchemy.exc import IntegrityError
+import click
+
+from api import token_required, read_only, catalog_cache, change_log, not_modified, tag_response, \
+    parse_fields, load_fields, fetch_page, page_response, json_bytes, content_etag, cached_json_response, \
+    reviews_query, list_etag, is_paginated
+from models import db, EMPTY_HISTOGRAM, Item, Reviews, Item_Rating
+from schemas import schema_for, ReviewSchema
+from sync import UPSERT
+import compression
+
+bp = Blueprint('reviews', __name__, cli_group=None)
+
+
+@bp.route('/api/reviews/product/<int:item_id>', methods=['GET'])
+@read_only
+def get_reviews(item_id):
+    count, last_id, last_date = db.session.query(
+        func.count(Reviews.id), func.max(Reviews.id), func.max(Reviews.date)).filter(
+        Reviews.item_id == item_id).one()
+
+    if count:
+        try:
+            fields = parse_fields(ReviewSchema)
+            etag = list_etag("reviews-%d-%d-%d" % (item_id, count, last_id), fields)
+            # Last-Modified can't tell pages or field sets apart; only the full list sends it.
+            if fields is not None or is_paginated():
+                last_date = None
+
+            response = not_modified(etag, last_date)
+            if response:
+                return response
+
+            result, next_cursor = fetch_page(
+                load_fields(reviews_query().filter_by(item_id=item_id), Reviews, fields,
+                            keys=[Reviews.date]),
+                [Reviews.date, Reviews.id], descending=True)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
+        schema = schema_for(ReviewSchema, many=True, only=fields)
+        output = schema.dump(result)
+
+        return tag_response(page_response(output, next_cursor), etag, last_date), 200
+    else:
+        return jsonify({'message': 'No comments!'}), 404
+
+
+@bp.route('/api/reviews/product/<int:item_id>/summary', methods=['GET'])
+@read_only(catalog=True)
+def get_review_summary(item_id):
+    key = catalog_cache.key('summary', item_id)
+    entry = catalog_cache.get(key)
+
+    if entry is None:
+        result = Item_Rating.query.get(item_id)
+        if result is None:
+            if not Item.query.get(item_id):
+                return jsonify({'message': 'Item not found!'}), 404
+            result = Item_Rating(count=0, total=0, **EMPTY_HISTOGRAM)
+
+        body = json_bytes(dict(item_id=item_id, **result.summary()))
+        entry = compression.CachedBody(body, content_etag(body))
+        catalog_cache.set(key, entry)
+
+    return cached_json_response(entry)
+
+
+RATINGS = (1, 2, 3, 4, 5)
+
+
+def record_rating(item_id, rating):
+    # A single UPDATE keeps concurrent reviews from losing counts; the row is
+    # only inserted for an item's first review.
+    # The product payload carries the rating, so synced clients refetch the item.
+    change_log.record('item', UPSERT, [(item_id, None)])
+    stars = getattr(Item_Rating, 'stars_%d' % rating)
+    values = {Item_Rating.count: Item_Rating.count + 1,
+              Item_Rating.total: Item_Rating.total + rating,
+              stars: stars + 1}
+
+    if Item_Rating.query.filter_by(item_id=item_id).update(values, synchronize_session=False):
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(Item_Rating(item_id=item_id, count=1, total=rating,
+                                       **dict(EMPTY_HISTOGRAM, **{'stars_%d' % rating: 1})))
+    except IntegrityError:
+        Item_Rating.query.filter_by(item_id=item_id).update(values, synchronize_session=False)
+
+
+@bp.cli.command('rebuild-ratings')
+def rebuild_ratings():
+    """Recompute item_rating from the reviews table."""
+    Item_Rating.__table__.create(db.engine, checkfirst=True)
+    existing = {index['name'] for index in inspect(db.engine).get_indexes(Reviews.__tablename__)}
+    for index in Reviews.__table__.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+
+    columns = [func.count(Reviews.id), func.sum(Reviews.rating)] + [
+        func.sum(case([(Reviews.rating == stars, 1)], else_=0)) for stars in RATINGS]
+    rows = db.session.query(Reviews.item_id, *columns).filter(
+        Reviews.item_id.isnot(None)).group_by(Reviews.item_id).all()
+
+    Item_Rating.query.delete()
+    db.session.bulk_insert_mappings(Item_Rating, [
+        dict(zip(['item_id', 'count', 'total'] + list(EMPTY_HISTOGRAM), row)) for row in rows])
+    db.session.commit()
+    click.echo("Ratings rebuilt for %d items." % len(rows))
+
+
+@bp.route('/api/create_review', methods=['POST'])
+@token_required
+def create_review(current_user):
+
+    data = request.get_json()
+    item_id = data["item_id"]
+    rating = data["rating"]
+    comment = data["comment"]
+
+    # JSON true and 5.0 compare equal to 1 and 5; only a plain int is a rating.
+    if not isinstance(rating, int) or isinstance(rating, bool) or rating not in RATINGS:
+        return jsonify({'message': 'Rating must be 1-5!'}), 400
+
+    if item_id is not None or rating is not None or comment is None:
+
+        newComment = Reviews(
+            item_id=item_id, user_id=current_user.id, comment=comment, rating=rating)
+        db.session.add(newComment)
+        record_rating(item_id, rating)
+        db.session.commit()
+
+        return jsonify({'message': 'Comment Written!'}), 200
+
+    else:
+        return jsonify({'message': 'Server error!'}), 401
@@ -0,0 +1,82 @@
+"""Sync route: changes since a cursor, and the compact-changes command."""
+from flask import Blueprint, jsonify, request
+from datetime import timedelta
+import click
+
+from api import token_required, read_only, change_log, catalog_query, reviews_query, \
+    orders_query, cart_items_query, encode_cursor, decode_cursor, page_limit
+from models import Item, Reviews, Orders, Cart_Items, Change_Log
+from schemas import schema_for, ProductSchema, ReviewSchema, OrdersSchema, CartItemSchema
+from sync import UPSERT, DELETE
+
+bp = Blueprint('sync', __name__, cli_group=None)
+
+
+# entity -> (query for the caller's rows with these ids, schema and exclude the list endpoint dumps with)
+SYNC_ENTITIES = {
+    'item': (lambda user, ids: catalog_query().filter(Item.id.in_(ids)), ProductSchema, ()),
+    'review': (lambda user, ids: reviews_query().filter(Reviews.id.in_(ids)), ReviewSchema, ()),
+    'order': (lambda user, ids: orders_query().filter(Orders.user_id == user.id, Orders.id.in_(ids)),
+              OrdersSchema, ()),
+    'cart_item': (lambda user, ids: cart_items_query(user.cart_id).filter(Cart_Items.id.in_(ids)),
+                  CartItemSchema, ('cart',)),
+}
+
+
+def load_changed_rows(current_user, changes):
+    """Dumps the current state of every upserted row, one query per entity."""
+    ids = {}
+    for change in changes:
+        if change.op == UPSERT:
+            ids.setdefault(change.entity, []).append(change.id)
+
+    rows = {}
+    for entity, entity_ids in ids.items():
+        query, schema_class, exclude = SYNC_ENTITIES[entity]
+        schema = schema_for(schema_class, many=True, exclude=exclude)
+        for output in schema.dump(query(current_user, entity_ids).all()):
+            rows[entity, output['id']] = output
+    return rows
+
+
+@bp.route('/api/sync', methods=['GET'])
+@token_required
+@read_only
+def sync_changes(current_user):
+
+    try:
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            cursor, = decode_cursor(cursor, [Change_Log.id])
+            if not isinstance(cursor, int):
+                raise ValueError('Invalid cursor!')
+        changes, next_cursor, more = change_log.read(cursor, current_user.id, page_limit())
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if changes is None:
+        # First sync, or the log no longer reaches back to this cursor: the
+        # client reloads its lists and carries on from the cursor given here.
+        return jsonify({'full_resync': True, 'changes': [], 'more': False,
+                        'cursor': encode_cursor([next_cursor])}), 200
+
+    rows = load_changed_rows(current_user, changes)
+    output = []
+    for change in changes:
+        data = rows.get((change.entity, change.id)) if change.op == UPSERT else None
+        # A row that is gone by now (or was never the caller's) reads as deleted.
+        entry = {'entity': change.entity, 'id': change.id, 'op': UPSERT if data else DELETE}
+        if data:
+            entry['data'] = data
+        output.append(entry)
+
+    return jsonify({'full_resync': False, 'changes': output, 'more': more,
+                    'cursor': encode_cursor([next_cursor])}), 200
+
+
+@bp.cli.command('compact-changes')
+@click.option('--days', type=int, default=None, help="Keep this many days instead of SYNC_RETENTION_DAYS.")
+def compact_changes(days):
+    """Drop superseded and expired change_log entries."""
+    superseded, expired = change_log.compact(timedelta(days=days) if days is not None else None)
+    click.echo("Removed %d superseded and %d expired entries." % (superseded, expired))
@@ -0,0 +1,225 @@
+"""User routes: accounts, user info, login and token refresh."""
+from flask import Blueprint, current_app, jsonify, request, make_response
+from datetime import datetime, timedelta
+import uuid
+import jwt
+
+from api import token_required, read_only, password_hasher, users_query, parse_fields, load_fields, \
+    fetch_page, page_response, stream_mode, stream_response
+from models import db, User, User_Info, Cart, Refresh_Token
+from passwords import HasherBusy
+from schemas import schema_for, UserSchema, UserInfoSchema
+
+bp = Blueprint('users', __name__, cli_group=None)
+
+
+@bp.route('/api/users/check/<string:uname>', methods=['GET'])
+@read_only
+def check_user(uname):
+    result = User.query.filter_by(username=uname).first()
+
+    if result:
+        schema = schema_for(UserSchema)
+        output = schema.dump(result)
+
+        return jsonify(output), 200
+    else:
+        return jsonify({'message': 'User not found!'}), 404
+
+
+@bp.route('/api/user', methods=['GET'])
+@token_required
+def get_user_details(current_user):
+    result = User.query.filter_by(id=current_user.id).first()
+
+    if result:
+        schema = schema_for(UserSchema)
+        output = schema.dump(result)
+
+        return jsonify(output), 200
+    else:
+        return jsonify({'message': 'User not found!'}), 404
+
+
+@bp.route('/api/user/<string:public_id>', methods=['GET'])
+def get_user(public_id):
+    result = User.query.filter_by(public_id=public_id).first()
+
+    if result:
+        schema = schema_for(UserSchema)
+        output = schema.dump(result)
+
+        return jsonify(output), 200
+    else:
+        return jsonify({'message': 'User not found!'}), 404
+
+
+@bp.route('/api/users', methods=['GET'])
+def get_all_users():
+
+    try:
+        fields = parse_fields(UserSchema)
+        mode = stream_mode()
+        query = load_fields(users_query(), User, fields)
+
+        if mode:
+            return stream_response(query.order_by(User.id), schema_for(UserSchema, only=fields), mode), 200
+
+        result, next_cursor = fetch_page(query, [User.id])
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    schema = schema_for(UserSchema, many=True, only=fields)
+    output = schema.dump(result)
+
+    return page_response(output, next_cursor), 200
+
+
+@bp.route('/api/users', methods=['POST'])
+def create_user():
+
+    data = request.get_json()
+    user = User.query.filter_by(username=data['username']).first()
+
+    if not user:
+
+        try:
+            hashed_password = password_hasher.hash(data['password'])
+        except HasherBusy:
+            return busy_response()
+
+        new_user = User(public_id=str(
+            uuid.uuid4()), username=data['username'], email=data['email'], password=hashed_password, is_admin=False)
+
+        new_user.info = User_Info()
+        new_user.cart = Cart()
+
+        db.session.add(new_user)
+        db.session.commit()
+
+        return jsonify({'message': 'User created!'}), 201
+
+    else:
+        return jsonify({'message': 'User already exists!'}), 401
+
+# --- UserInfo Routes ------------------------------------------------------------------------------------
+
+
+@bp.route('/api/user_info', methods=['GET'])
+@token_required
+def get_info(current_user):
+    result = User_Info.query.filter_by(user_id=current_user.id).first()
+
+    if result:
+        schema = schema_for(UserInfoSchema)
+        output = schema.dump(result)
+
+        return jsonify(output), 200
+    else:
+        return jsonify({'message': 'Info not found!'}), 404
+
+
+@bp.route('/api/user_info/update', methods=['PUT'])
+@token_required
+def update_info(current_user):
+
+    data = request.get_json()
+    info = User_Info.query.filter_by(user_id=current_user.id).first()
+
+    if info:
+
+        info.first_name = data["first_name"]
+        info.last_name = data["last_name"]
+        info.phone_number = data["phone_number"]
+        info.address = data["address"]
+        db.session.commit()
+
+        return jsonify({'message': 'Info Updated!'}), 200
+
+    else:
+        return jsonify({'message': 'Server error!'}), 401
+
+# --- Login Route ------------------------------------------------------------------------------------
+
+
+@bp.route('/login')
+def login():
+    auth = request.authorization
+
+    if not auth or not auth.username or not auth.password:
+        return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
+
+    user = User.query.filter_by(username=auth.username).first()
+
+    if not user:
+        return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
+
+    try:
+        valid = password_hasher.verify(user.password, auth.password)
+
+        # Hashes from before the scrypt switch (or with older cost
+        # parameters) are replaced while we still have the plain password.
+        if valid and password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.hash(auth.password)
+            db.session.commit()
+    except HasherBusy:
+        return busy_response()
+
+    if valid:
+        return jsonify(issue_tokens(user))
+
+    return make_response('Could not verify', 401, {'WWW-Authenticate': 'Basic realm=login required!'})
+
+
+@bp.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    # Trades a refresh token for a fresh pair without another password check.
+    # Each refresh token works once; the new pair replaces it.
+    data = request.get_json(silent=True) or {}
+    token = data.get('refresh_token')
+
+    if not token:
+        return jsonify({'message': 'Token is missing!'}), 401
+
+    try:
+        claims = jwt.decode(token, current_app.config['SECRET_KEY'])
+    except jwt.InvalidTokenError:
+        return jsonify({'message': 'Token is invalid!'}), 401
+
+    user = User.query.filter_by(public_id=claims.get('public_id')).first() \
+        if claims.get('type') == 'refresh' and claims.get('jti') else None
+    if not user:
+        return jsonify({'message': 'Token is invalid!'}), 401
+
+    # Deleting the row is the check: of two requests with the same token
+    # only one deletes it.
+    used = Refresh_Token.query.filter_by(jti=claims['jti'], user_id=user.id).delete(synchronize_session=False)
+    if not used:
+        db.session.rollback()
+        return jsonify({'message': 'Token is invalid!'}), 401
+
+    return jsonify(issue_tokens(user)), 200
+
+
+def issue_tokens(user):
+    now = datetime.utcnow()
+    expires = now + timedelta(hours=current_app.config['REFRESH_TOKEN_HOURS'])
+    jti = uuid.uuid4().hex
+
+    # The user's expired tokens go as a new one is stored.
+    Refresh_Token.query.filter(Refresh_Token.user_id == user.id,
+                               Refresh_Token.expires < now).delete(synchronize_session=False)
+    db.session.add(Refresh_Token(jti=jti, user_id=user.id, expires=expires))
+    db.session.commit()
+
+    token = jwt.encode({'public_id': user.public_id, 'exp': now + timedelta(
+        minutes=current_app.config['ACCESS_TOKEN_MINUTES'])}, current_app.config['SECRET_KEY'])
+    refresh = jwt.encode({'public_id': user.public_id, 'type': 'refresh', 'jti': jti, 'exp': expires},
+                         current_app.config['SECRET_KEY'])
+
+    return {'token': token.decode('UTF-8'), 'refresh_token': refresh.decode('UTF-8')}
+
+
+def busy_response():
+    return make_response(jsonify({'message': 'Server is busy, try again shortly!'}), 503,
+                         {'Retry-After': '1'})
@@ -0,0 +1,190 @@
+"""Marshmallow schemas for the API's payloads, dumped through compiled field lists."""
+from flask import current_app, g, has_request_context
+from flask_marshmallow import Marshmallow
+import json
+import time
+
+from cache import LRUCache
+from models import db, EMPTY_HISTOGRAM, Item, Item_Type, Item_Rating, Defined_Items, Cart_Items, Cart, \
+    User, Order_Items, Orders, User_Info, Reviews, Job
+from serializers import compile_dumper
+
+ma = Marshmallow()
+schema_cache = LRUCache(maxsize=256)
+
+
+class BaseSchema(ma.SQLAlchemyAutoSchema):
+    """Dumps through a compiled field list and adds the time spent to the
+    current request's metrics."""
+
+    def dump(self, obj, *, many=None):
+        # Nested schemas dump through here too; only time the outermost one.
+        if not has_request_context() or 'instrumentation' not in g or g.get('dumping'):
+            return self._dump(obj, many)
+
+        g.dumping = True
+        start = time.perf_counter()
+        try:
+            return self._dump(obj, many)
+        finally:
+            g.instrumentation['serialize_time'] += time.perf_counter() - start
+            g.dumping = False
+
+    def _dump(self, obj, many):
+        dump = self.dumper()
+        if dump is None or not current_app.config['FAST_SERIALIZERS']:
+            return super().dump(obj, many=many)
+
+        many = self.many if many is None else bool(many)
+        return [dump(each) for each in obj] if many else dump(obj)
+
+    def dumper(self):
+        if not hasattr(self, '_dumper'):
+            self._dumper = compile_dumper(self, nested_dumper)
+        return self._dumper
+
+
+def nested_dumper(schema):
+    dump = schema.dumper() if isinstance(schema, BaseSchema) else None
+    return dump or (lambda obj: schema.dump(obj, many=False))
+
+
+def schema_for(schema_class, many=False, only=None, exclude=()):
+    """Shared schema instance for these options, compiled when first built.
+
+    Dumping doesn't change a schema, so one instance serves every request.
+    Nothing is built at import; warm_schemas builds the variants the routes
+    use ahead of time.
+    """
+    key = (schema_class, bool(many), None if only is None else frozenset(only), frozenset(exclude))
+    schema = schema_cache.get(key)
+    if schema is None:
+        schema = schema_class(many=many, only=only, exclude=exclude)
+        schema.dumper()
+        schema_cache.set(key, schema)
+    return schema
+
+
+class Item_TypeSchema(BaseSchema):
+    class Meta:
+        model = Item_Type
+        sqla_session = db.session
+        load_instance = True
+
+
+class ProductSchema(BaseSchema):
+    class Meta:
+        model = Item
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+    item_type = ma.Nested(Item_TypeSchema, many=False)
+    rating = ma.Method("get_rating")
+
+    def get_rating(self, obj):
+        return (obj.rating or Item_Rating(count=0, total=0, **EMPTY_HISTOGRAM)).summary()
+
+
+class DefinedItemSchema(BaseSchema):
+    class Meta:
+        model = Defined_Items
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+    item = ma.Nested(ProductSchema, many=False, exclude=["reviews", "rating"])
+
+
+class CartItemSchema(BaseSchema):
+    class Meta:
+        model = Cart_Items
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+    defined_item = ma.Nested(DefinedItemSchema, many=False, exclude=[
+                             "id", "cart_item_id", "order_item"])
+
+
+class CartSchema(BaseSchema):
+    class Meta:
+        model = Cart
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+
+
+class UserSchema(BaseSchema):
+    class Meta:
+        model = User
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+
+
+class OrderItemsSchema(BaseSchema):
+    class Meta:
+        model = Order_Items
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+
+    defined_item = ma.Nested(DefinedItemSchema, many=False)
+
+
+class OrdersSchema(BaseSchema):
+    class Meta:
+        model = Orders
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+
+    order_items = ma.Nested(OrderItemsSchema, many=True)
+
+
+class UserInfoSchema(BaseSchema):
+    class Meta:
+        model = User_Info
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+
+
+class ReviewSchema(BaseSchema):
+    class Meta:
+        model = Reviews
+        sqla_session = db.session
+        load_instance = True
+        include_relationships = True
+    user = ma.Nested(UserSchema, many=False, exclude=[
+                     "id", "public_id", "public_id", "email", "info", "password", "cart", "orders", "reviews", "is_admin"])
+
+
+class JobSchema(BaseSchema):
+    class Meta:
+        model = Job
+        sqla_session = db.session
+        load_instance = True
+        exclude = ("payload", "locked_until", "run_after", "user_id")
+    result = ma.Method("get_result")
+
+    def get_result(self, obj):
+        return json.loads(obj.result) if obj.result else None
+
+
+# (schema, many, exclude) variants the routes dump with.
+ROUTE_SCHEMAS = (
+    (ProductSchema, False, ()), (ProductSchema, True, ()),
+    (DefinedItemSchema, False, ()), (DefinedItemSchema, True, ()),
+    (CartItemSchema, True, ('cart',)),
+    (OrdersSchema, False, ()), (OrdersSchema, True, ()),
+    (UserSchema, False, ()), (UserSchema, True, ()),
+    (UserInfoSchema, False, ()), (ReviewSchema, True, ()), (JobSchema, False, ()))
+
+
+def warm_schemas():
+    """Builds and compiles the route schemas now rather than on first use.
+
+    Worth it in a process that forks workers (gunicorn --preload), so they
+    share the result instead of each building their own.
+    """
+    for schema_class, many, exclude in ROUTE_SCHEMAS:
+        schema_for(schema_class, many=many, exclude=exclude)
@@ -0,0 +1,280 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, namedtuple
+import heapq
+import re
+import threading
+import time
+
+Document = namedtuple('Document', 'id name description price type_id sizes')
+
+# Matches in the name count for more than matches in the description.
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+SORTS = ('relevance', 'price', '-price', 'name', 'id', '-id')
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class AnyOf:
+    """Items found in any of ``collections`` (posting dicts or id sets).
+
+    Narrowing a candidate set either probes each candidate against every
+    collection or merges the collections first, whichever touches fewer
+    entries.
+    """
+
+    def __init__(self, collections):
+        self.collections = collections
+        self.size = sum(map(len, collections))
+
+    def ids(self):
+        return set().union(*self.collections)
+
+    def _probe(self, ids):
+        return len(ids) * len(self.collections) < self.size
+
+    def filter(self, ids):
+        if self._probe(ids):
+            return {item_id for item_id in ids
+                    if any(item_id in collection for collection in self.collections)}
+        return ids & self.ids()
+
+    def weights(self, ids):
+        if self._probe(ids):
+            return {item_id: max(postings.get(item_id, 0) for postings in self.collections)
+                    for item_id in ids}
+        merged = {}
+        for postings in self.collections:
+            for item_id, weight in postings.items():
+                if weight > merged.get(item_id, 0):
+                    merged[item_id] = weight
+        return {item_id: merged[item_id] for item_id in ids}
+
+
+class PriceRange:
+    """Items priced within [low, high], given the index's sorted (price, id) list."""
+
+    def __init__(self, docs, prices, start, end, low, high):
+        self.docs = docs
+        self.prices = prices
+        self.start = start
+        self.end = end
+        self.size = end - start
+        self.low = float('-inf') if low is None else low
+        self.high = float('inf') if high is None else high
+
+    def ids(self):
+        return {item_id for _, item_id in self.prices[self.start:self.end]}
+
+    def filter(self, ids):
+        return {item_id for item_id in ids if self.low <= self.docs[item_id].price <= self.high}
+
+
+class SearchIndex:
+    """In-memory inverted index over the catalog.
+
+    ``loader(ids)`` returns Documents for the given item ids, or for every
+    item when ids is None. The index loads everything on first use and
+    again after ``ttl`` seconds or ``reset``; ``touch(ids)`` queues items
+    to be reloaded one by one before the next search. A full load runs
+    outside the lock and is swapped in when done; searches keep using the
+    previous index meanwhile, so only the very first load makes them wait.
+
+    Lookups start from the smallest posting list among the query terms
+    and filters, price ranges come from a sorted list and only one page
+    is ever sorted, so a search costs about as much as its most selective
+    condition matches rather than the size of the catalog.
+    """
+
+    def __init__(self, loader, ttl=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.built = None
+        self._dirty = set()
+        # Items touched while a full load runs, applied again once it is in.
+        self._touched = None
+        self._generation = 0
+        self._ready = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.docs = {}
+        self._postings = defaultdict(dict)
+        self._vocabulary = None
+        self._by_type = defaultdict(set)
+        self._by_size = defaultdict(set)
+        self._prices = []
+
+    def touch(self, ids):
+        with self._lock:
+            self._dirty.update(ids)
+            if self._touched is not None:
+                self._touched.update(ids)
+
+    def reset(self):
+        with self._lock:
+            self.built = None
+            self._generation += 1
+
+    def _stale(self):
+        return self.built is None or (self.ttl is not None and time.monotonic() - self.built > self.ttl)
+
+    def _rebuild(self):
+        # One thread loads; the others search the old index unless there is none yet.
+        if not self._build_lock.acquire(blocking=not self._ready):
+            return
+        try:
+            if not self._stale():
+                return
+            with self._lock:
+                generation = self._generation
+                self._touched = set()
+
+            fresh = SearchIndex(self.loader)
+            for doc in self.loader(None):
+                fresh._add(doc)
+
+            with self._lock:
+                self.docs, self._postings, self._vocabulary = fresh.docs, fresh._postings, fresh._vocabulary
+                self._by_type, self._by_size, self._prices = fresh._by_type, fresh._by_size, fresh._prices
+                # Earlier changes are in the load, but it may have read these
+                # rows before they changed.
+                self._dirty = self._touched
+                # And a reset during the load may have come after it read the rows.
+                self.built = time.monotonic() if generation == self._generation else None
+                self._ready = True
+        finally:
+            with self._lock:
+                self._touched = None
+            self._build_lock.release()
+
+    def _update(self):
+        if self._dirty:
+            ids, self._dirty = self._dirty, set()
+            for item_id in ids:
+                self._remove(item_id)
+            for doc in self.loader(ids):
+                self._add(doc)
+
+    def _terms(self, doc):
+        weights = {}
+        for weight, text in ((DESCRIPTION_WEIGHT, doc.description), (NAME_WEIGHT, doc.name)):
+            for term in tokenize(text):
+                weights[term] = max(weights.get(term, 0), weight)
+        return weights
+
+    def _add(self, doc):
+        self.docs[doc.id] = doc
+        for term, weight in self._terms(doc).items():
+            if term not in self._postings:
+                self._vocabulary = None
+            self._postings[term][doc.id] = weight
+        self._by_type[doc.type_id].add(doc.id)
+        for size in doc.sizes:
+            self._by_size[size.lower()].add(doc.id)
+        insort(self._prices, (doc.price, doc.id))
+
+    def _remove(self, item_id):
+        doc = self.docs.pop(item_id, None)
+        if doc is None:
+            return
+        for term in self._terms(doc):
+            postings = self._postings[term]
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary = None
+        self._by_type[doc.type_id].discard(item_id)
+        for size in doc.sizes:
+            self._by_size[size.lower()].discard(item_id)
+        del self._prices[bisect_left(self._prices, (doc.price, item_id))]
+
+    def _expand(self, prefix):
+        # Every indexed term starting with prefix, for the word being typed.
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        start = bisect_left(self._vocabulary, prefix)
+        end = bisect_left(self._vocabulary, prefix + '\uffff')
+        return self._vocabulary[start:end]
+
+    def _price_range(self, min_price, max_price):
+        start = 0 if min_price is None else bisect_left(self._prices, (min_price,))
+        end = len(self._prices) if max_price is None else bisect_right(
+            self._prices, (max_price, float('inf')))
+        return PriceRange(self.docs, self._prices, start, end, min_price, max_price)
+
+    def search(self, query=None, type_ids=None, sizes=None, min_price=None, max_price=None,
+               sort='relevance', after=None, limit=50):
+        """Returns (item ids for one page, sort key to pass as ``after`` for the next, total matches).
+
+        Every query term has to match the name or description; the last one
+        also matches as a prefix. The most selective term or filter supplies
+        the candidates and the others are only probed for those.
+        """
+        if self._stale():
+            self._rebuild()
+
+        with self._lock:
+            self._update()
+
+            terms = tokenize(query)
+            matches = []
+            for position, term in enumerate(terms):
+                expansions = self._expand(term) if position == len(terms) - 1 else [term]
+                matches.append(AnyOf([self._postings[e] for e in expansions if e in self._postings]))
+
+            constraints = list(matches)
+            if type_ids is not None:
+                constraints.append(AnyOf(
+                    [self._by_type[type_id] for type_id in type_ids if type_id in self._by_type]))
+            if sizes is not None:
+                constraints.append(AnyOf(
+                    [self._by_size[size.lower()] for size in sizes if size.lower() in self._by_size]))
+            if min_price is not None or max_price is not None:
+                constraints.append(self._price_range(min_price, max_price))
+
+            if constraints:
+                constraints.sort(key=lambda constraint: constraint.size)
+                matched = constraints[0].ids()
+                for constraint in constraints[1:]:
+                    matched = constraint.filter(matched)
+            else:
+                matched = set(self.docs)
+
+            scores = None
+            if sort == 'relevance' and matches:
+                scores = dict.fromkeys(matched, 0)
+                for match in matches:
+                    for item_id, weight in match.weights(matched).items():
+                        scores[item_id] += weight
+
+            keys = (self.sort_key(sort, self.docs[item_id], scores) for item_id in matched)
+            try:
+                if after is not None:
+                    after = tuple(after)
+                    keys = [key for key in keys if key > after]
+                page = heapq.nsmallest(limit + 1, keys)
+            except TypeError:
+                raise ValueError('Invalid cursor!')
+
+        next_key = list(page[limit - 1]) if len(page) > limit else None
+        return [key[-1] for key in page[:limit]], next_key, len(matched)
+
+    @staticmethod
+    def sort_key(sort, doc, scores):
+        if sort == 'relevance':
+            return (-scores[doc.id] if scores else 0, doc.id)
+        if sort == 'price':
+            return (doc.price, doc.id)
+        if sort == '-price':
+            return (-doc.price, doc.id)
+        if sort == 'name':
+            return (doc.name.lower(), doc.id)
+        if sort == '-id':
+            return (-doc.id, doc.id)
+        return (doc.id,)
@@ -1 +1,8 @@
-from api import app
+from api import create_app
+from schemas import warm_schemas
+
+app = create_app()
+
+# With gunicorn --preload this runs once, in the master, and every worker
+# is forked with the schemas already built.
+warm_schemas()
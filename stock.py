@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, bindparam
+
+
+class OutOfStock(Exception):
+    """Raised by reserve when tracked stock can't cover an order; ``lines``
+    lists the (item_id, size) pairs that ran short."""
+
+    def __init__(self, lines):
+        super().__init__(lines)
+        self.lines = lines
+
+
+class Inventory:
+    """Stock counters per (item, size) and the reservations taken against them.
+
+    Only pairs with a row in ``stock_model`` are tracked; anything else can
+    be ordered without limit. ``reserve`` takes stock with one conditional
+    UPDATE per pair (``available = available - n WHERE available >= n``), so
+    concurrent checkouts never read a count and write it back, and a count
+    can't go below zero. Each checkout holds the row locks it took only
+    until it commits, and takes them in the same order as every other
+    checkout, so two carts sharing items can't deadlock.
+
+    What an order took is kept in ``reservation_model`` until the order is
+    paid (``confirm``) or the stock is given back (``release``) because the
+    order was deleted or stayed unpaid for ``hold``.
+    """
+
+    def __init__(self, db, stock_model, reservation_model, hold=timedelta(minutes=30)):
+        self.db = db
+        self.stock_model = stock_model
+        self.reservation_model = reservation_model
+        self.hold = hold
+
+    def tracked(self, pairs):
+        """The (item_id, size) pairs among ``pairs`` that have a stock row."""
+        if not pairs:
+            return set()
+        stock = self.stock_model
+        return set(self.db.session.query(stock.item_id, stock.size).filter(or_(*[
+            and_(stock.item_id == item_id, stock.size == size) for item_id, size in pairs])))
+
+    def reserve(self, lines, order_id=None):
+        """Takes stock for (item_id, size, amount) lines; returns what it took.
+
+        Raises OutOfStock if a tracked pair has too little left, after which
+        the caller must roll back. With ``order_id`` the reservation is
+        recorded so it can be released later.
+        """
+        wanted = {}
+        for item_id, size, amount in lines:
+            wanted[item_id, size] = wanted.get((item_id, size), 0) + amount
+        tracked = self.tracked(list(wanted))
+
+        stock = self.stock_model.__table__
+        taken, short = [], []
+        for (item_id, size) in sorted(tracked):
+            amount = wanted[item_id, size]
+            if amount <= 0:
+                continue
+            updated = self.db.session.execute(stock.update().where(and_(
+                stock.c.item_id == item_id, stock.c.size == size, stock.c.available >= amount)).values(
+                available=stock.c.available - amount)).rowcount
+            if updated:
+                taken.append((item_id, size, amount))
+            else:
+                short.append((item_id, size))
+
+        if short:
+            raise OutOfStock(short)
+
+        if order_id is not None and taken:
+            now = datetime.utcnow()
+            self.db.session.bulk_insert_mappings(self.reservation_model, [
+                {'order_id': order_id, 'item_id': item_id, 'size': size, 'quantity': amount, 'created': now}
+                for item_id, size, amount in taken])
+        return taken
+
+    def confirm(self, order_id, lines):
+        """Turns the order's reservation into a sale.
+
+        If the reservation was already released, stock is taken again from
+        ``lines`` (only iterated in that case), which can raise OutOfStock.
+        """
+        reservations = self.reservation_model.__table__
+        if not self.db.session.execute(reservations.delete().where(
+                reservations.c.order_id == order_id)).rowcount:
+            self.reserve(lines)
+
+    def release(self, order_ids=None, expired=False):
+        """Gives back the reservations of ``order_ids``, or with ``expired``
+        every reservation older than ``hold``. Returns how many were released.
+
+        Each reservation is added back by whoever deletes it, so a timeout
+        and a delete racing for the same order can't both restock it.
+        """
+        reservations = self.reservation_model.__table__
+        if expired:
+            condition = reservations.c.created < datetime.utcnow() - self.hold
+        elif order_ids:
+            condition = reservations.c.order_id.in_(order_ids)
+        else:
+            return 0
+
+        session = self.db.session
+        columns = [reservations.c.item_id, reservations.c.size, reservations.c.quantity]
+        if session.connection().dialect.name == 'postgresql':
+            rows = session.execute(reservations.delete().where(condition).returning(*columns)).fetchall()
+        else:
+            # No DELETE ... RETURNING: delete one row at a time and keep
+            # the ones this transaction actually removed.
+            rows = []
+            for row in session.execute(reservations.select().where(condition)).fetchall():
+                if session.execute(reservations.delete().where(reservations.c.id == row.id)).rowcount:
+                    rows.append((row.item_id, row.size, row.quantity))
+
+        returned = {}
+        for item_id, size, quantity in rows:
+            returned[item_id, size] = returned.get((item_id, size), 0) + quantity
+
+        if returned:
+            stock = self.stock_model.__table__
+            session.execute(stock.update().where(and_(
+                stock.c.item_id == bindparam('b_item_id'), stock.c.size == bindparam('b_size'))).values(
+                available=stock.c.available + bindparam('b_quantity')), [
+                {'b_item_id': item_id, 'b_size': size, 'b_quantity': quantity}
+                for (item_id, size), quantity in sorted(returned.items())])
+        return len(rows)
+
+    def set(self, item_id, size, available):
+        """Sets the stock of one pair, starting to track it if it wasn't.
+        Commits. ``available`` of None stops tracking it."""
+        stock = self.stock_model
+        row = stock.query.get((item_id, size))
+        if available is None:
+            if row is not None:
+                self.db.session.delete(row)
+        elif row is None:
+            self.db.session.add(stock(item_id=item_id, size=size, available=available))
+        else:
+            row.available = available
+        self.db.session.commit()
@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect, select, func, and_, or_, exists
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+class Change:
+    """One entry of a sync page: which row changed and whether it still exists."""
+    __slots__ = ('cursor', 'entity', 'id', 'op')
+
+    def __init__(self, cursor, entity, id, op):
+        self.cursor = cursor
+        self.entity = entity
+        self.id = id
+        self.op = op
+
+
+class ChangeLog:
+    """Records which rows of the tracked models changed, in commit order.
+
+    Every flush that inserts, updates or deletes a tracked row adds one entry
+    per row to ``model`` in the same transaction, so the log commits or rolls
+    back with the change itself. The entry id is the sync cursor. Entries
+    only say which row changed; the caller reads the row's current state when
+    it serves them.
+
+    Ids are handed out at flush time but become visible at commit time, so a
+    slow transaction can commit an id below one a client has already seen.
+    Cursors therefore never move past entries younger than ``settle``
+    seconds; those entries are sent again on the next read, which is
+    harmless because applying an entry twice gives the same result.
+
+    ``compact`` drops entries that a later entry for the same row supersedes,
+    and entries older than ``retention``. The highest id it expired is kept
+    in ``horizon_model``; a cursor below it has missed changes and has to
+    start over with a full fetch.
+    """
+
+    def __init__(self, db, model, horizon_model, settle=5, retention=timedelta(days=30)):
+        self.db = db
+        self.model = model
+        self.horizon_model = horizon_model
+        self.settle = settle
+        self.retention = retention
+        self.tracked = {}
+        self.nested = {}
+        event.listen(db.session, 'after_flush', self._after_flush)
+
+    def track(self, model, entity, owner=None):
+        """Logs changes to ``model`` as ``entity``.
+
+        ``owner(values)`` gets the row's column values and returns the user
+        id the row is private to, or None for rows every client syncs.
+        """
+        self.tracked[model] = (entity, owner)
+
+    def track_nested(self, model, parents):
+        """Logs changes to ``model``, which clients only see inside other
+        rows, as upserts of those rows.
+
+        ``parents(connection, ids)`` returns (entity, id, owner) for the rows
+        that nest the given ``model`` rows.
+        """
+        self.nested[model] = parents
+
+    def _after_flush(self, session, flush_context):
+        dirty = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+        entries = [self._entry(obj, UPSERT) for obj in (*session.new, *dirty)] + \
+            [self._entry(obj, DELETE) for obj in session.deleted]
+        entries = [entry for entry in entries if entry is not None]
+
+        nested = {}
+        for obj in (*session.new, *dirty, *session.deleted):
+            if type(obj) in self.nested:
+                nested.setdefault(type(obj), set()).add(inspect(obj).dict.get('id'))
+        for model, ids in nested.items():
+            entries += self._parent_entries(session.connection(), model, ids)
+
+        if entries:
+            # A parent changed in the same flush is logged once.
+            self.write(session.connection(), list(dict.fromkeys(entries)))
+
+    def _parent_entries(self, connection, model, ids):
+        return [(entity, id, UPSERT, owner) for entity, id, owner in self.nested[model](connection, ids)]
+
+    def _entry(self, obj, op):
+        tracked = self.tracked.get(type(obj))
+        if tracked is None:
+            return None
+        entity, owner = tracked
+        values = inspect(obj).dict
+        return entity, values.get('id'), op, owner(values) if owner else None
+
+    def record(self, entity, op, rows):
+        """Logs (id, owner) rows changed by a bulk UPDATE or DELETE, which
+        skip the flush events."""
+        if rows:
+            self.write(self.db.session.connection(), [(entity, id, op, owner) for id, owner in rows])
+
+    def record_nested(self, model, ids):
+        """Logs the parents of ``track_nested`` rows changed by a bulk statement."""
+        connection = self.db.session.connection()
+        entries = self._parent_entries(connection, model, ids) if ids else []
+        if entries:
+            self.write(connection, entries)
+
+    def write(self, connection, entries):
+        now = datetime.utcnow()
+        connection.execute(self.model.__table__.insert(), [
+            {'entity': entity, 'entity_id': id, 'op': op, 'user_id': owner, 'changed': now}
+            for entity, id, op, owner in entries])
+
+    def position(self):
+        """Returns (horizon, settled head): the oldest cursor that is still
+        valid and the newest one a client may be given."""
+        model = self.model
+        cutoff = datetime.utcnow() - timedelta(seconds=self.settle)
+        horizon, unsettled, last = self.db.session.query(
+            self.db.session.query(func.max(self.horizon_model.cursor)).as_scalar(),
+            self.db.session.query(func.min(model.id)).filter(model.changed >= cutoff).as_scalar(),
+            self.db.session.query(func.max(model.id)).as_scalar()).one()
+        head = unsettled - 1 if unsettled is not None else (last or 0)
+        return horizon or 0, max(head, horizon or 0)
+
+    def read(self, cursor, owner, limit):
+        """Entries after ``cursor`` visible to ``owner``, oldest first.
+
+        Returns (changes, next cursor, more), or (None, cursor to resume
+        from, False) when ``cursor`` is missing or older than the horizon
+        and the client has to fetch everything again.
+        """
+        horizon, head = self.position()
+        if cursor is None or cursor < horizon:
+            return None, head, False
+
+        model = self.model
+        rows = self.db.session.query(model.id, model.entity, model.entity_id, model.op).filter(
+            model.id > cursor, or_(model.user_id.is_(None), model.user_id == owner)).order_by(
+            model.id).limit(limit + 1).all()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = min(rows[-1].id if more else head, head)
+        more = more and next_cursor == rows[-1].id
+
+        # Only the last entry for a row matters within a page.
+        latest = {}
+        for row in rows:
+            latest[row.entity, row.entity_id] = row
+        changes = [Change(row.id, row.entity, row.entity_id, row.op)
+                   for row in sorted(latest.values(), key=lambda row: row.id)]
+        return changes, max(cursor, next_cursor), more
+
+    def compact(self, retention=None):
+        """Drops superseded and expired entries; returns how many of each.
+
+        Commits. Safe to run while clients sync: a superseded entry is only
+        removed once a later one for the same row exists.
+        """
+        model = self.model
+        table = model.__table__
+        newer = table.alias()
+        superseded = self.db.session.execute(table.delete().where(exists(select([newer.c.id]).where(and_(
+            newer.c.entity == table.c.entity, newer.c.entity_id == table.c.entity_id,
+            newer.c.id > table.c.id))))).rowcount
+
+        cutoff = datetime.utcnow() - (retention if retention is not None else self.retention)
+        unexpired = self.db.session.query(func.min(model.id)).filter(model.changed >= cutoff).scalar()
+        last = unexpired - 1 if unexpired is not None else self.db.session.query(func.max(model.id)).scalar()
+        expired = 0
+        if last:
+            expired = self.db.session.execute(table.delete().where(table.c.id <= last)).rowcount
+            horizon = self.horizon_model.__table__
+            if expired and last > (self.db.session.query(func.max(self.horizon_model.cursor)).scalar() or 0):
+                self.db.session.execute(horizon.delete())
+                self.db.session.execute(horizon.insert().values(cursor=last))
+
+        self.db.session.commit()
+        return superseded, expired